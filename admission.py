@@ -0,0 +1,90 @@
+"""
+(V26.23 新增) 准入控制：全局排队页数上限 + 等待时间估算
+
+每个任务按页数计入"排队中的页数" (排队 + 处理中)，任务结束时扣除。
+新任务会让总数超过 max_queued_pages 时直接拒绝 (HTTP 429)，并根据最近的处理速度 (页/秒)
+估算需要等待多久才能腾出足够的额度，交给客户端作为 Retry-After。
+(单个任务本身超过上限时，只在系统空闲时放行，不会永远被拒绝)
+批量任务不整体计入：check() 只在提交时检查能否接收，各份文书开始处理时再 admit(页数, wait=True) 逐份计入
+(额度不足时等待而不是拒绝)，处理完一份归还一份，一个大批量不会让其他客户端长时间收到 429。
+"""
+import math
+import threading
+import time
+from collections import deque
+
+
+class AdmissionRejectedError(Exception):
+    """系统饱和，暂不接收新任务"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """(线程安全) 用法: admit(页数) -> 处理 -> release(页数)；admit 之后未能提交时 release(页数, processed=False)"""
+
+    def __init__(self, max_queued_pages, default_pages_per_minute=60, window_seconds=600):
+        self.max_queued_pages = max_queued_pages
+        self.default_rate = default_pages_per_minute / 60.0
+        self.window_seconds = window_seconds
+        self.queued_pages = 0
+        self.completed = deque()  # ((完成时间, 页数)，只保留 window_seconds 内的记录)
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.released = threading.Condition(self.lock)  # (admit(wait=True) 在额度归还时被唤醒)
+
+    def pages_per_second(self):
+        """最近 window_seconds 内的处理速度；样本太少时使用默认值 (调用方持有 self.lock)"""
+        now = time.monotonic()
+        while self.completed and now - self.completed[0][0] > self.window_seconds:
+            self.completed.popleft()
+        pages = sum(count for _, count in self.completed)
+        if len(self.completed) < 2 or not pages:
+            return self.default_rate
+        return pages / max(now - self.completed[0][0], 60.0)
+
+    def _saturated(self, pages):
+        """(调用方持有 self.lock)"""
+        return self.queued_pages and self.queued_pages + pages > self.max_queued_pages
+
+    def _reject(self, pages):
+        """(调用方持有 self.lock) 计数并抛出 AdmissionRejectedError"""
+        self.rejected += 1
+        excess = self.queued_pages + pages - self.max_queued_pages
+        retry_after = math.ceil(excess / self.pages_per_second())
+        raise AdmissionRejectedError(
+            f"服务器繁忙：排队中 {self.queued_pages} 页 (上限 {self.max_queued_pages} 页)，"
+            f"预计约 {retry_after} 秒后可以接收 {pages} 页的新任务", retry_after)
+
+    def check(self, pages):
+        """只检查现在能否接收 pages 页 (不计入)；不能时抛出 AdmissionRejectedError"""
+        with self.lock:
+            if self._saturated(pages):
+                self._reject(pages)
+
+    def admit(self, pages, wait=False):
+        """计入 pages 页；饱和时抛出 AdmissionRejectedError，wait 为 True 时改为等待额度归还"""
+        with self.lock:
+            if self._saturated(pages) and not wait:
+                self._reject(pages)
+            while self._saturated(pages):
+                self.released.wait()
+            self.queued_pages += pages
+
+    def release(self, pages, processed=True):
+        with self.lock:
+            self.queued_pages = max(0, self.queued_pages - pages)
+            if processed and pages:
+                self.completed.append((time.monotonic(), pages))
+            self.released.notify_all()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "queued_pages": self.queued_pages,
+                "max_queued_pages": self.max_queued_pages,
+                "pages_per_minute": round(self.pages_per_second() * 60, 1),
+                "rejected": self.rejected,
+            }
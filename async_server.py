@@ -0,0 +1,539 @@
+"""
+(V26.19 新增) asyncio 服务模式：ASGI 应用，上游模型调用全部为异步 HTTP
+
+server.py (Flask) 用阻塞式 SDK 调用上游：每个等待中的模型调用占用一个线程几分钟，并发上限等于线程数。
+本模块在少数几个线程上同时 await 大量模型调用：
+- 文本与 VLM 都走 DashScope 的 OpenAI 兼容模式 (AsyncOpenAI，底层为 httpx)
+- 缓存读写、检测、页面筛选、栅格化等阻塞/CPU 密集的工作交给线程池 (渲染仍可再分给多进程)
+- Prompt、缓存、限流、重试、熔断、Prompt 统计与 server.py 共用同一套实现和常量
+
+启动: python async_server.py (或 uvicorn async_server:app --host 0.0.0.0 --port 5001)
+依赖: pip install starlette uvicorn python-multipart
+提供 POST /extract 与 GET /stats，请求/响应格式与 server.py 相同；异步任务 API (/jobs) 仍由 server.py 提供。
+(V26.24) 相同内容的进行中请求合并：后到的请求 await 先到请求的同一个 Task
+(V26.23) 与 server.py 相同的按页准入控制 (429) 和按客户端公平分配的上游名额；
+(V26.20) 上传边接收边解析 multipart，直接写入 UploadBuffer (不经过 request.form() 的临时文件)，超限立即拒绝
+"""
+import asyncio
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # (python-multipart 0.0.13 之前的包名)
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from admission import AdmissionController, AdmissionRejectedError
+from fair_scheduler import FairScheduler
+
+from fast_extract import (apply_known_fields, confident_fields, extract_fast_fields, fast_path_result,
+                          format_fast_fields, is_complete)
+from page_filter import print_filter_report, select_relevant_pages
+from pdf_render import iter_rendered_pages, jpeg_to_data_uri
+from rate_control import CircuitOpenError, call_with_retry_async
+from text_pipeline import is_long_document, merge_extractions, segment_prompt, split_into_segments
+from upload_store import UploadBuffer, UploadTooLargeError, receive_upload
+from vlm_pipeline import AdaptiveChunkSizer, describe_pages, iter_adaptive_chunks, prefetch
+from server import (ADMISSION_DEFAULT_PAGES_PER_MINUTE, ADMISSION_MAX_QUEUED_PAGES, API_KEY, API_TIMEOUT,
+                    BREAKER_RESET_TIMEOUT, CLIENT_ID_HEADER, CLIENT_WEIGHTS, FAST_PATH_MIN_CONFIDENCE, FAST_PATH_SKIP_LLM,
+                    IMAGE_COMPRESSION_QUALITY, MAX_RETRIES, PROMPT_VERSION, QWEN_COMPATIBLE_BASE_URL,
+                    QWEN_MODEL_NAME_TEXT, QWEN_MODEL_NAME_VISION, RENDER_WORKERS, RESULT_CACHE, RETRY_POLICY,
+                    SYSTEM_PROMPT, TEXT_PROMPT_STATS, UPLOAD_MAX_BYTES, UPLOAD_MEMORY_MAX_BYTES, TEXT_SEGMENT_MAX_IN_FLIGHT, UPSTREAM_BREAKER,
+                    UPSTREAM_MAX_IN_FLIGHT,
+                    VLM_CHUNK_CACHE, VLM_CHUNK_FAST_SECONDS, VLM_CHUNK_MAX_SIZE, VLM_CHUNK_MIN_SIZE,
+                    VLM_MAX_IN_FLIGHT, VLM_PAGE_CHUNK_SIZE, VLM_PAGE_FILTER_ENABLED, VLM_PAGE_PIXEL_BUDGET,
+                    VLM_PIPELINE_QUEUE_SIZE, VLM_PROMPT_STATS, VLM_RATE_LIMITER, VLM_TASK_PROMPT, SINGLE_FLIGHT,
+                    build_document_text, build_text_messages, detect_pdf_type, parse_vlm_output,
+                    result_cache_key, stats_snapshot, vlm_chunk_cache_key, vlm_chunk_plan_key)
+
+# --- 1. 常量与客户端 ---
+ASYNC_SERVER_PORT = 5001  # (与 Flask 版的 5000 端口并存，便于对比)
+BLOCKING_WORKERS = 8  # (检测/筛选/渲染/缓存读写的线程数；与同时在途的模型调用数无关)
+
+ASYNC_QWEN_CLIENT = AsyncOpenAI(
+    api_key=API_KEY,
+    base_url=QWEN_COMPATIBLE_BASE_URL,
+    max_retries=0,  # (重试统一由 call_with_retry_async 负责)
+    timeout=API_TIMEOUT,
+)
+BLOCKING_EXECUTOR = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+# (V26.23) 准入控制与上游名额：与 server.py 相同的规则 (两种服务模式是不同的进程，各自计数)
+ADMISSION = AdmissionController(ADMISSION_MAX_QUEUED_PAGES,
+                                default_pages_per_minute=ADMISSION_DEFAULT_PAGES_PER_MINUTE)
+UPSTREAM_SCHEDULER = FairScheduler(UPSTREAM_MAX_IN_FLIGHT)
+# (当前计算所属的 (客户端, 权重, 文档)；在计算的 Task 中设置，其中创建的子任务自动继承)
+CURRENT_DOCUMENT = contextvars.ContextVar("current_document", default=(None, 1.0, None))
+
+
+async def run_blocking(func, *args):
+    """阻塞/CPU 密集的调用交给线程池，事件循环继续处理其他请求"""
+    return await asyncio.get_running_loop().run_in_executor(BLOCKING_EXECUTOR, func, *args)
+
+
+async def gather_or_cancel(*aws):
+    """与 asyncio.gather 相同；任何一个失败 (或自身被取消) 时取消其余仍在运行的任务，不留下无人等待的任务"""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+def upstream_slot():
+    """(V26.23) 当前文档所属客户端的上游名额，在该客户端的文档之间轮转"""
+    client, weight, document = CURRENT_DOCUMENT.get()
+    return UPSTREAM_SCHEDULER.async_slot(client, weight, member=document)
+
+
+# --- 2. 文本模型 ---
+async def call_qwen_text_api(raw_text, user_content=None, known_fields=None):
+    messages = build_text_messages(raw_text, user_content, known_fields)
+    print(f"--- (大脑) 正在调用 {QWEN_MODEL_NAME_TEXT} (纯文本 API, async) ---")
+
+    async def request_completion():
+        return await ASYNC_QWEN_CLIENT.chat.completions.create(
+            model=QWEN_MODEL_NAME_TEXT,
+            messages=messages,
+            response_format={"type": "json_object"},
+            temperature=0.0
+        )
+
+    try:
+        completion = await call_with_retry_async(request_completion, RETRY_POLICY, UPSTREAM_BREAKER,
+                                                 name=QWEN_MODEL_NAME_TEXT)
+        print(TEXT_PROMPT_STATS.record(messages, completion.usage))
+        return json.loads(completion.choices[0].message.content)
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        print(f"【Qwen 文本 API 错误】: {e}")
+        return None
+
+
+async def extract_text_document(raw_text):
+    """与 server.extract_text_document 相同的流程；长文书各段并发 await，最多 TEXT_SEGMENT_MAX_IN_FLIGHT 段在途"""
+    matches = extract_fast_fields(raw_text)
+    print(format_fast_fields(matches))
+    known_fields = confident_fields(matches, FAST_PATH_MIN_CONFIDENCE)
+    if FAST_PATH_SKIP_LLM and is_complete(known_fields):
+        print("--- (规则) 全部规则字段高置信度命中，跳过文本模型 ---")
+        return fast_path_result(known_fields)
+
+    if not is_long_document(raw_text):
+        return apply_known_fields(await call_qwen_text_api(raw_text, known_fields=known_fields), known_fields)
+
+    segments = await run_blocking(split_into_segments, raw_text)
+    print(f"--- (大脑) 长文书模式：全文切分为 {len(segments)} 段，"
+          f"最多 {TEXT_SEGMENT_MAX_IN_FLIGHT} 段并行提取 ---")
+    semaphore = asyncio.Semaphore(TEXT_SEGMENT_MAX_IN_FLIGHT)
+
+    async def extract_segment(index, segment):
+        async with semaphore:
+            return await call_qwen_text_api(segment, user_content=segment_prompt(segment, index, len(segments)),
+                                            known_fields=known_fields)
+
+    results = await gather_or_cancel(*(extract_segment(i, segment) for i, segment in enumerate(segments)))
+    failed = sum(1 for result in results if result is None)
+    if failed:
+        print(f"【长文书警告】: {failed}/{len(segments)} 段提取失败，合并结果可能不完整。")
+    return apply_known_fields(merge_extractions(results), known_fields)
+
+
+async def extract_text_scheduled(text):
+    """(V26.23) 取得上游名额后提取全文 (与 server.scheduled 相同：整篇文本提取占一个名额)"""
+    async with upstream_slot():
+        return await extract_text_document(text)
+
+
+# --- 3. VLM (兼容模式：图像以 image_url 形式内联 Data URI) ---
+async def call_vlm_chunk(image_url_chunk, chunk_name, chunk_sizer=None):
+    """调用 VLM 处理一个批次，返回该批次的 JSON 结果 (失败时返回带 "error" 的字典)"""
+    content = [{"type": "image_url", "image_url": {"url": url}} for url in image_url_chunk]
+    content.append({"type": "text", "text": VLM_TASK_PROMPT})
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": content}
+    ]
+
+    async def before_attempt(attempt):
+        waited = await VLM_RATE_LIMITER.acquire_async()
+        if waited > 0:
+            print(f"--- (限流) {chunk_name} 等待令牌 {waited:.1f} 秒 ---")
+        print(f"--- (眼睛) 正在调用 VLM API ({chunk_name}, Attempt {attempt + 1}/{MAX_RETRIES}, async)... ---")
+
+    async def request_vlm():
+        return await ASYNC_QWEN_CLIENT.chat.completions.create(
+            model=QWEN_MODEL_NAME_VISION,
+            messages=messages,
+            temperature=0.0
+        )
+
+    async def attempt_vlm():
+        """(V26.6) 每次失败的尝试 (包括最后一次) 在这里给自适应批次记录且只记录一次失败"""
+        try:
+            return await request_vlm()
+        except Exception:
+            if chunk_sizer:
+                chunk_sizer.record_failure()
+            raise
+
+    try:
+        completion = await call_with_retry_async(attempt_vlm, RETRY_POLICY, UPSTREAM_BREAKER, name=chunk_name,
+                                                 before_attempt=before_attempt)
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        print(f"【VLM API 错误】 ({chunk_name}): {e}")
+        print(f"--- 批次 {chunk_name} 【失败】，已放弃重试。---")
+        return {"error": f"批次 {chunk_name} 处理失败。"}
+
+    print(VLM_PROMPT_STATS.record(messages, completion.usage))
+    return parse_vlm_output(completion.choices[0].message.content or "", chunk_name)
+
+
+async def call_qwen_vlm_api(session, page_indices=None):
+    """
+    渲染流水线与 server.iter_vlm_results 相同 (后台线程渲染，有界队列交付)；
+    取下一批次时在线程池中等待，各批次的 VLM 调用作为协程并发执行，结果按批次顺序返回。
+    """
+    if page_indices is None:
+        page_indices = list(range(session.page_count))
+    page_count = len(page_indices)
+    print(f"--- (眼睛) 共 {page_count} 页，自适应批次 (初始 {VLM_PAGE_CHUNK_SIZE} 页，"
+          f"范围 {VLM_CHUNK_MIN_SIZE}-{VLM_CHUNK_MAX_SIZE} 页，JPEG Quality={IMAGE_COMPRESSION_QUALITY}) ---")
+
+    chunk_sizer = AdaptiveChunkSizer(VLM_PAGE_CHUNK_SIZE, min_size=VLM_CHUNK_MIN_SIZE,
+                                     max_size=VLM_CHUNK_MAX_SIZE, fast_seconds=VLM_CHUNK_FAST_SECONDS)
+    if VLM_PAGE_FILTER_ENABLED:
+        page_indices, filter_report = await run_blocking(select_relevant_pages, session, page_indices)
+        print_filter_report(filter_report, page_count)
+
+    page_jpegs = iter_rendered_pages(session, IMAGE_COMPRESSION_QUALITY, workers=RENDER_WORKERS,
+                                     pixel_budget=VLM_PAGE_PIXEL_BUDGET, batch_pages=VLM_PAGE_CHUNK_SIZE,
+                                     page_indices=page_indices)
+    # (后台线程只预取页面；分块在空出在途名额、取下一批时才进行，批次大小总是 AIMD 的最新建议)
+    page_urls = prefetch(((i, jpeg_to_data_uri(jpeg_bytes)) for i, jpeg_bytes in zip(page_indices, page_jpegs)),
+                         maxsize=VLM_PIPELINE_QUEUE_SIZE * VLM_CHUNK_MAX_SIZE)
+    # (V26.17) 缓存命中的批次不记录耗时，AIMD 的批次大小会与上次不同：按上次的批次划分切分，边界才能对上
+    plan_key = vlm_chunk_plan_key(session, page_indices)
+    plan, _ = await run_blocking(VLM_CHUNK_CACHE.get, plan_key)
+    if plan:
+        print(f"--- (缓存) 按上次的批次划分切分: {plan} ---")
+    url_chunks = iter_adaptive_chunks(page_urls, chunk_sizer, plan)
+    in_flight = asyncio.Semaphore(VLM_MAX_IN_FLIGHT)
+    loop = asyncio.get_running_loop()
+
+    async def process_chunk(chunk_index, page_chunk):
+        try:
+            image_url_chunk = [url for _, url in page_chunk]
+            chunk_name = f"批次 {chunk_index + 1} ({describe_pages([i for i, _ in page_chunk])})"
+            print(f"\n--- (眼睛) 正在处理 {chunk_name} ---")
+
+            cache_key = vlm_chunk_cache_key(image_url_chunk)
+            cached_result, _ = await run_blocking(VLM_CHUNK_CACHE.get, cache_key)
+            if cached_result is not None:
+                print(f"--- (缓存) {chunk_name} 页面图像未变化，复用已有结果 ---")
+                return cached_result
+
+            async with upstream_slot():  # (V26.23) 计时从取得名额后开始，排队时间不影响自适应批次
+                started_at = loop.time()
+                result = await call_vlm_chunk(image_url_chunk, chunk_name, chunk_sizer)
+            if "error" not in result:  # (失败已在 call_vlm_chunk 中按尝试次数记录)
+                chunk_sizer.record_success(loop.time() - started_at)
+                await run_blocking(VLM_CHUNK_CACHE.put, cache_key, result)
+            return result
+        finally:
+            in_flight.release()
+
+    tasks = []
+    try:
+        while True:
+            # (先占一个在途名额再取下一批：批次大小按取出时 AIMD 的最新建议决定)
+            await in_flight.acquire()
+            page_chunk = await run_blocking(next, url_chunks, None)
+            if page_chunk is None:
+                in_flight.release()
+                break
+            tasks.append(asyncio.create_task(process_chunk(len(tasks), page_chunk)))
+            if any(task.done() and not task.cancelled() and task.exception() for task in tasks):
+                break  # (熔断等致命错误：停止渲染剩余批次)
+        results = await gather_or_cancel(*tasks)
+    finally:
+        url_chunks.close()
+        page_urls.close()
+    print(f"--- (自适应) 本文档各批次页数: {chunk_sizer.used_sizes} ---")
+    if chunk_sizer.used_sizes != plan:
+        await run_blocking(VLM_CHUNK_CACHE.put, plan_key, chunk_sizer.used_sizes)
+
+    if not results:
+        print("【VLM 错误】: 无法从 PDF 提取任何图像页面。")
+        return None
+    return results
+
+
+async def extract_mixed_pdf(session, text_pages, scanned_pages):
+    """文本页与扫描页两路并发；结果按各自的首页页码排序合并"""
+    text_page_ids = sorted(text_pages)
+    print(f"--- (路由) 文本模型: {describe_pages(text_page_ids)}；VLM: {describe_pages(scanned_pages)} ---")
+    text = await run_blocking(build_document_text, text_pages)
+    text_result, vlm_results = await gather_or_cancel(extract_text_scheduled(text),
+                                                      call_qwen_vlm_api(session, page_indices=scanned_pages))
+    vlm_results = vlm_results or []
+
+    if not text_result:
+        return vlm_results
+    if text_page_ids[0] < scanned_pages[0]:
+        return [text_result] + vlm_results
+    return vlm_results + [text_result]
+
+
+# --- 4. 提取流程 (与 server.run_extraction 对应) ---
+async def cached_extraction(upload):
+    """命中结果缓存时返回 (结果列表, 响应头)，否则返回 None"""
+    cache_key = result_cache_key(upload.digest)
+    cached_result, cache_tier = await run_blocking(RESULT_CACHE.get, cache_key)
+    if cached_result is None:
+        return None
+    print(f"--- (缓存) 命中 [{cache_tier}] {cache_key[:12]}，跳过检测与模型调用 ---")
+    return cached_result, {"X-Cache": f"HIT-{cache_tier}", "X-Cache-Key": cache_key}
+
+
+async def run_extraction(upload):
+    """返回 (结果列表, 响应头)；失败时抛出异常"""
+    # (请求中已查过一次；这里仍需检查：等待准入/合并期间相同内容的计算可能已经写入缓存)
+    cached = await cached_extraction(upload)
+    if cached is not None:
+        return cached
+    cache_key = result_cache_key(upload.digest)
+    print(f"--- (缓存) 未命中 {cache_key[:12]} ---")
+
+    session = await run_blocking(upload.open_session)
+    try:
+        pdf_type, text_pages, scanned_pages = await run_blocking(detect_pdf_type, session)
+
+        if pdf_type == "TEXT_PDF":
+            text = await run_blocking(build_document_text, text_pages)
+            extracted_data = await extract_text_scheduled(text)
+            if not extracted_data:
+                raise Exception("Qwen-Text 未能返回有效数据。")
+            extracted_data_list = [extracted_data]
+
+        elif pdf_type == "SCANNED_PDF":
+            extracted_data_list = await call_qwen_vlm_api(session)
+            if not extracted_data_list:
+                raise Exception("Qwen-VLM 未能返回有效数据。")
+
+        elif pdf_type == "MIXED_PDF":
+            extracted_data_list = await extract_mixed_pdf(session, text_pages, scanned_pages)
+            if not extracted_data_list:
+                raise Exception("Qwen-Text 与 Qwen-VLM 均未能返回有效数据。")
+
+        else:  # "ERROR"
+            raise Exception("无法检测或读取 PDF。")
+    finally:
+        await run_blocking(session.close)
+
+    if not any("error" in item for item in extracted_data_list):
+        await run_blocking(RESULT_CACHE.put, cache_key, extracted_data_list)
+    return extracted_data_list, {"X-Cache": "MISS", "X-Cache-Key": cache_key}
+
+
+async def extract_and_close(upload, pages, client, weight):
+    """(计算的 Task 入口) 结束后归还准入的页数额度并删除临时文件"""
+    CURRENT_DOCUMENT.set((client, weight, upload.digest))
+    try:
+        return await run_extraction(upload)
+    finally:
+        ADMISSION.release(pages)
+        await run_blocking(upload.close)
+
+
+async def extract_coalesced(upload, client, weight):
+    """
+    (V26.24) 返回 (结果列表, 响应头, 是否合并)；负责关闭 upload。
+    计算在独立的 Task 中运行 (await 时加 shield)：发起的请求断开，计算仍会完成，已合并的请求照常拿到结果。
+    (V26.23) 命中结果缓存时直接返回，不经过准入控制；新的计算按页数通过准入控制，饱和时抛出 AdmissionRejectedError
+    """
+    cached = await cached_extraction(upload)
+    if cached is not None:
+        await run_blocking(upload.close)
+        return cached[0], cached[1], False
+
+    key = result_cache_key(upload.digest)
+    pages = await run_blocking(upload.page_count)
+
+    def start():
+        ADMISSION.admit(pages)
+        print(f"--- (准入) {upload.name}: {pages} 页，客户端 {client} (权重 {weight}) ---")
+        return asyncio.create_task(extract_and_close(upload, pages, client, weight))
+
+    try:
+        task, coalesced = SINGLE_FLIGHT.join(key, start)
+    except AdmissionRejectedError:
+        await run_blocking(upload.close)
+        raise
+    if coalesced:
+        print(f"--- (合并) {upload.name} 与进行中的计算内容相同，等待其结果 ---")
+        await run_blocking(upload.close)
+    else:
+        def finish(done_task):
+            SINGLE_FLIGHT.done(key, done_task)
+            if not done_task.cancelled():
+                done_task.exception()  # (取出异常：所有请求都已断开时，避免 "exception was never retrieved")
+        task.add_done_callback(finish)
+    extracted_data_list, headers = await asyncio.shield(task)
+    return extracted_data_list, headers, coalesced
+
+
+# --- 5. ASGI 路由 ---
+async def receive_file_field(request, field="file"):
+    """
+    (V26.20) 边接收请求体边解析 multipart：field 字段的文件内容直接写入 UploadBuffer (边写边算哈希、超过阈值落盘)，
+    其他字段丢弃。请求体累计超过 UPLOAD_MAX_BYTES 时立即抛出 UploadTooLargeError (分块传输没有 Content-Length 也一样)。
+    返回 (文件名, UploadBuffer)；请求中没有该文件字段时返回 (None, None)。出错时关闭缓冲区 (删除临时文件)。
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        return None, None
+
+    # (解析器的回调是同步的：先记下事件，每收到一块数据后再统一处理)
+    events = []
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": lambda: events.append(("part", b"")),
+        "on_header_field": lambda data, start, end: events.append(("header_field", data[start:end])),
+        "on_header_value": lambda data, start, end: events.append(("header_value", data[start:end])),
+        "on_header_end": lambda: events.append(("header_end", b"")),
+        "on_headers_finished": lambda: events.append(("headers_finished", b"")),
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+    })
+    filename, buffer = None, None
+    header_field = header_value = disposition = b""
+    writing = False
+    received = 0
+    try:
+        async for block in request.stream():
+            received += len(block)
+            if received > UPLOAD_MAX_BYTES:
+                raise UploadTooLargeError(f"上传文件超过上限 {UPLOAD_MAX_BYTES // (1024 * 1024)} MB", UPLOAD_MAX_BYTES)
+            parser.write(block)
+            data = []
+            for kind, value in events:
+                if kind == "part":
+                    disposition, writing = b"", False
+                elif kind == "header_field":
+                    header_field += value
+                elif kind == "header_value":
+                    header_value += value
+                elif kind == "header_end":
+                    if header_field.lower() == b"content-disposition":
+                        disposition = header_value
+                    header_field = header_value = b""
+                elif kind == "headers_finished":
+                    _, options = parse_options_header(disposition)
+                    writing = (buffer is None and options.get(b"name") == field.encode()
+                               and b"filename" in options)
+                    if writing:
+                        filename = options[b"filename"].decode("utf-8", "replace")
+                        buffer = UploadBuffer(UPLOAD_MEMORY_MAX_BYTES, UPLOAD_MAX_BYTES)
+                elif kind == "data" and writing:
+                    data.append(value)
+            events.clear()
+            if data:
+                await run_blocking(buffer.write, b"".join(data))  # (落盘写入不阻塞事件循环)
+        parser.finalize()
+    except BaseException:
+        if buffer is not None:
+            buffer.close()
+        raise
+    return filename, buffer
+
+
+def client_identity(request):
+    """(V26.23) 返回 (客户端, 权重)：优先使用 X-Client-Id 令牌，否则使用来源 IP"""
+    client = request.headers.get(CLIENT_ID_HEADER) or (request.client.host if request.client else None)
+    return client, CLIENT_WEIGHTS.get(client, 1.0)
+
+
+async def handle_extraction(request):
+    print("\n" + "=" * 50)
+    print(f"--- 收到新的 /extract 请求 (async) ---")
+
+    # (V26.20) 按 Content-Length 提前拒绝超大上传，不读取请求体
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > UPLOAD_MAX_BYTES:
+        return upload_too_large_response()
+
+    try:
+        filename, buffer = await receive_file_field(request)
+    except UploadTooLargeError:
+        return upload_too_large_response()
+    if buffer is None:
+        print("【请求错误】: 'file' 字段未在请求中找到。")
+        return JSONResponse({"error": "请求中未包含 'file'。"}, status_code=400)
+    if not filename:
+        buffer.close()
+        return JSONResponse({"error": "未选择文件。"}, status_code=400)
+
+    try:
+        upload = receive_upload(buffer, filename, UPLOAD_MEMORY_MAX_BYTES, UPLOAD_MAX_BYTES)  # (直接接管，不复制)
+        client, weight = client_identity(request)
+        # (V26.24 由它关闭 upload)
+        extracted_data_list, headers, coalesced = await extract_coalesced(upload, client, weight)
+        if coalesced:
+            headers = dict(headers, **{"X-Coalesced": "1"})
+        return JSONResponse(extracted_data_list, headers=headers)
+
+    except UploadTooLargeError:
+        return upload_too_large_response()
+
+    except AdmissionRejectedError as e:
+        print(f"【服务器繁忙】: {e}")
+        return JSONResponse({"error": str(e), "retry_after": e.retry_after}, status_code=429,
+                            headers={"Retry-After": str(e.retry_after)})
+
+    except CircuitOpenError as e:
+        print(f"【服务器处理错误】: {e}")
+        retry_after = str(int(e.retry_after or BREAKER_RESET_TIMEOUT))
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": retry_after})
+
+    except Exception as e:
+        print(f"【服务器处理错误】: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+def upload_too_large_response():
+    message = f"上传文件超过上限 {UPLOAD_MAX_BYTES // (1024 * 1024)} MB。"
+    print(f"【请求错误】: {message}")
+    return JSONResponse({"error": message}, status_code=413)
+
+
+async def handle_stats(request):
+    stats = stats_snapshot()
+    stats["upstream_scheduler"] = UPSTREAM_SCHEDULER.snapshot()  # (V26.23)
+    stats["admission"] = ADMISSION.snapshot()
+    return JSONResponse(stats)
+
+
+app = Starlette(routes=[
+    Route("/extract", handle_extraction, methods=["POST"]),
+    Route("/stats", handle_stats, methods=["GET"]),
+])
+
+
+# --- 6. 启动 ---
+if __name__ == "__main__":
+    import uvicorn
+
+    print("--- 法律文书提取【后端服务器 V26.19 - asyncio 模式】 ---")
+    print(f"--- 正在加载 Qwen (Text: {QWEN_MODEL_NAME_TEXT}, VLM: {QWEN_MODEL_NAME_VISION}, 兼容模式) ---")
+    print(f"--- Prompt 版本: {PROMPT_VERSION} ---")
+    uvicorn.run(app, host="0.0.0.0", port=ASYNC_SERVER_PORT)
@@ -0,0 +1,96 @@
+"""
+(V26.1 新增) 页面编码基准测试：临时文件 (V22-V26) vs 内存 JPEG + Data URI (V26.1)
+
+用法:
+    python benchmarks/bench_page_encoding.py 某扫描件.pdf [重复次数]
+
+旧路径：渲染 -> 写 JPEG 到临时目录 -> (SDK) 读回文件上传 -> 删除
+新路径：渲染 -> 内存编码 JPEG -> base64 Data URI
+两条路径共用同一次渲染结果，只比较"编码 + 载荷准备"部分。
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from pdf_render import RENDER_ZOOM, jpeg_to_data_uri  # noqa: E402
+
+QUALITY = 85
+
+
+def render_all(file_path):
+    doc = fitz.open(file_path)
+    try:
+        images = []
+        for page in doc:
+            pix = page.get_pixmap(matrix=fitz.Matrix(RENDER_ZOOM, RENDER_ZOOM))
+            images.append(Image.frombytes("RGB", [pix.width, pix.height], pix.samples))
+        return images
+    finally:
+        doc.close()
+
+
+def legacy_temp_file_path(images, stem):
+    """(旧) 写临时文件 -> 读回 -> 删除，返回 (写入字节, 读取字节)"""
+    written = read = 0
+    temp_files = []
+    try:
+        for i, pil_image in enumerate(images):
+            tmp_file_path = f"{tempfile.gettempdir()}/_page{i + 1}_{stem}.jpg"
+            pil_image.save(tmp_file_path, "JPEG", quality=QUALITY)
+            temp_files.append(tmp_file_path)
+            written += os.path.getsize(tmp_file_path)
+            # (模拟 SDK 对 file:// 的处理：把文件完整读回再上传)
+            with open(tmp_file_path, "rb") as f:
+                read += len(f.read())
+    finally:
+        for tmp_file in temp_files:
+            os.unlink(tmp_file)
+    return written, read
+
+
+def in_memory_path(images):
+    """(新) 内存编码 + Data URI，返回载荷总字节数"""
+    payload = 0
+    for pil_image in images:
+        buffer = io.BytesIO()
+        pil_image.save(buffer, "JPEG", quality=QUALITY)
+        payload += len(jpeg_to_data_uri(buffer.getvalue()))
+    return payload
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    file_path = sys.argv[1]
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    images = render_all(file_path)
+    stem = Path(file_path).stem
+    print(f"--- 基准测试: {file_path} ({len(images)} 页, 重复 {repeats} 次) ---")
+
+    legacy_times, memory_times = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        written, read = legacy_temp_file_path(images, stem)
+        legacy_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        payload = in_memory_path(images)
+        memory_times.append(time.perf_counter() - start)
+
+    legacy_best, memory_best = min(legacy_times), min(memory_times)
+    print(f"临时文件路径: {legacy_best * 1000:.1f} ms | 磁盘写 {written / 1024:.0f} KB, 磁盘读 {read / 1024:.0f} KB")
+    print(f"内存路径:     {memory_best * 1000:.1f} ms | 磁盘写 0 KB, 磁盘读 0 KB, 载荷 {payload / 1024:.0f} KB (base64)")
+    print(f"加速比: {legacy_best / memory_best:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
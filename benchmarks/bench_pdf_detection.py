@@ -0,0 +1,80 @@
+"""
+(V26.15 新增) PDF 类型检测基准测试：逐页文本提取 (V20-V26.14) vs 生产环境的 detect_pdf_type
+
+用法:
+    python benchmarks/bench_pdf_detection.py 某扫描件.pdf [重复次数]
+    (需要 server.py 的运行环境：导入 server 模块)
+
+旧路径：逐页 page.get_text()，直到累计 100 字符 (扫描件会走完每一页)
+新路径：server.detect_pdf_type 端到端计时——前 SAMPLE_PAGES 页的结构检测，
+        提前退出前还要确认其余每一页都没有字体资源；不能提前退出时包括逐页分类
+"""
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from pdf_session import DocumentSession  # noqa: E402
+from pdf_structure import SAMPLE_PAGES, detect_structure  # noqa: E402
+from server import detect_pdf_type  # noqa: E402
+
+
+def legacy_detect(file_path):
+    """(旧) V20 的检测循环，返回 (类型, 解析过文本的页数)"""
+    doc = fitz.open(file_path)
+    try:
+        text_length = 0
+        pages_parsed = 0
+        for page in doc.pages():
+            text_length += len(page.get_text().strip())
+            pages_parsed += 1
+            if text_length > 100:
+                break
+        return ("TEXT_PDF" if text_length > 100 else "SCANNED_PDF"), pages_parsed
+    finally:
+        doc.close()
+
+
+def production_detect(file_path):
+    """(新) 与服务器相同的检测流程，返回 (类型, 文本页数, 扫描页数)；检测日志不打印，避免影响计时"""
+    with DocumentSession(file_path) as session, redirect_stdout(io.StringIO()):
+        pdf_type, text_pages, scanned_pages = detect_pdf_type(session)
+    return pdf_type, len(text_pages), len(scanned_pages)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    file_path = sys.argv[1]
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    with DocumentSession(file_path) as session:
+        page_count = session.page_count
+        verdict, confidence, inspected = detect_structure(session)  # (只用于说明，不计时)
+    print(f"--- 基准测试: {file_path} ({page_count} 页, 重复 {repeats} 次, 抽样 {SAMPLE_PAGES} 页) ---")
+
+    legacy_times, production_times = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        legacy_type, pages_parsed = legacy_detect(file_path)
+        legacy_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        pdf_type, text_count, scanned_count = production_detect(file_path)
+        production_times.append(time.perf_counter() - start)
+
+    legacy_best, production_best = min(legacy_times), min(production_times)
+    print(f"逐页文本提取:   {legacy_best * 1000:.1f} ms | 结果 {legacy_type}, 解析文本 {pages_parsed} 页")
+    print(f"detect_pdf_type: {production_best * 1000:.1f} ms | 结果 {pdf_type} "
+          f"(文本页 {text_count}, 扫描页 {scanned_count})；结构检测 {verdict or '不确定'} "
+          f"(置信度 {confidence:.2f}, 检查 {len(inspected)} 页)")
+    print(f"加速比: {legacy_best / production_best:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+(V26.19 新增) 服务器负载测试：Flask (server.py) vs asyncio (async_server.py)
+
+用法:
+    python benchmarks/mock_upstream.py --delay 5
+    set QWEN_COMPATIBLE_BASE_URL=http://127.0.0.1:8900/v1 后分别启动 python server.py 与 python async_server.py
+    (Flask 版另设 JOB_WORKERS=50 与 JOB_MAX_QUEUED=200：默认的 2 个工作线程 / 20 个排队名额在并发 50 时
+     大部分请求会被 503 拒绝，测到的是拒绝而不是两种引擎本身)
+    python benchmarks/bench_server_load.py 文本型.pdf http://127.0.0.1:5000/extract http://127.0.0.1:5001/extract \
+        [--requests 200] [--concurrency 50]
+
+- 请使用文本型 PDF：Flask 版的 VLM 走 DashScope 原生 SDK，不经过兼容模式，模拟上游接不住
+- 每个请求在 PDF 末尾追加一行不同的注释，内容哈希各不相同，结果缓存不会命中
+- 两个服务依次测试 (不同时施压)，输出成功数、吞吐量和延迟分位数；
+  被拒绝的请求 (429/503) 单独统计，不计入吞吐量和延迟
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+REJECTED_STATUSES = (429, 503)  # (准入控制 / 任务队列已满)
+
+
+def percentile(values, ratio):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+def run_load(url, pdf_bytes, total, concurrency):
+    """并发 concurrency 个连接，共发送 total 个请求，返回 (成功数, 总耗时, 各请求延迟, 状态码计数)"""
+    def send(index):
+        payload = pdf_bytes + f"\n% load-test {time.time_ns()} {index}\n".encode("ascii")
+        started = time.perf_counter()
+        try:
+            response = requests.post(url, files={"file": (f"load-{index}.pdf", payload, "application/pdf")},
+                                     timeout=900)
+            status = response.status_code
+        except requests.exceptions.RequestException as e:
+            status = type(e).__name__
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(send, range(total)))
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for status, _ in outcomes:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = [latency for status, latency in outcomes if status == 200]
+    return statuses.get(200, 0), elapsed, latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比 Flask 与 asyncio 服务模式的吞吐量和延迟")
+    parser.add_argument("pdf")
+    parser.add_argument("urls", nargs="+", help="一个或多个 /extract 地址")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    pdf_bytes = Path(args.pdf).read_bytes()
+    print(f"--- 负载测试: {args.pdf}, {args.requests} 个请求, 并发 {args.concurrency} ---")
+    for url in args.urls:
+        ok, elapsed, latencies, statuses = run_load(url, pdf_bytes, args.requests, args.concurrency)
+        print(f"\n{url}")
+        print(f"  成功 {ok}/{args.requests}, 状态码 {statuses}")
+        rejected = sum(statuses.get(status, 0) for status in REJECTED_STATUSES)
+        if rejected:
+            print(f"  【注意】: {rejected} 个请求被拒绝 (429/503)，未计入吞吐量和延迟；"
+                  f"Flask 版请调大 JOB_WORKERS / JOB_MAX_QUEUED 后重测")
+        print(f"  吞吐量 {ok / elapsed:.2f} 请求/秒 (总耗时 {elapsed:.1f} 秒)")
+        if latencies:
+            print(f"  延迟 p50 {percentile(latencies, 0.5):.2f} 秒, p95 {percentile(latencies, 0.95):.2f} 秒, "
+                  f"最大 {max(latencies):.2f} 秒")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+(V26.19 新增) 负载测试用的模拟上游：OpenAI 兼容模式的 /chat/completions
+
+每个请求固定等待 --delay 秒 (模拟模型推理耗时) 后返回一个字段齐全的 JSON 结果，不消耗真实配额。
+server.py / async_server.py 启动前设置 QWEN_COMPATIBLE_BASE_URL=http://127.0.0.1:8900/v1 即可指向这里。
+
+用法:
+    python benchmarks/mock_upstream.py [--port 8900] [--delay 5]
+"""
+import argparse
+import json
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from fast_extract import RESULT_KEYS  # noqa: E402
+
+
+def make_handler(delay):
+    content = json.dumps({key: None for key in RESULT_KEYS} | {"type": "模拟结果"}, ensure_ascii=False)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            time.sleep(delay)
+            body = json.dumps({
+                "id": "mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 1000, "completion_tokens": 200, "total_tokens": 1200},
+            }, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # (负载测试时不逐条打印)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容模式的模拟上游")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--delay", type=float, default=5.0, help="每个请求的模拟推理耗时 (秒)")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.delay))
+    server.daemon_threads = True
+    print(f"--- 模拟上游: http://127.0.0.1:{args.port}/v1 (每次调用 {args.delay} 秒) ---")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,26 @@
 import json
 import os
 import sys
-import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
-import openai
 from openai import OpenAI
 import dashscope
-import fitz  # PyMuPDF
-from PIL import Image
 import time
-import requests
-from http.client import RemoteDisconnected
+from pdf_render import classify_pages, iter_rendered_pages, jpeg_to_data_uri  # (V26 新增) 并行栅格化 + 内存编码
+from pdf_structure import SAMPLE_PAGES, detect_structure  # (V26.15 新增) 结构化类型检测
+from pdf_session import DocumentSession  # (V26.14 新增) 一次任务只打开一次 PDF
+from vlm_pipeline import (AdaptiveChunkSizer, describe_pages, dispatch_in_order, iter_adaptive_chunks,
+                          prefetch)  # (V26.3 新增) 渲染/推理流水线
+from page_filter import print_filter_report, select_relevant_pages  # (V26.7 新增) 页面相关性预筛选
+from text_pipeline import (format_compaction_stats, is_long_document, join_page_texts, merge_extractions,
+                           segment_prompt, split_into_segments)  # (V26.9 新增) 长文书分段提取; (V26.10) 文本压缩
+from json_stream import IncrementalJSONParser  # (V26.12 新增) 流式输出的增量 JSON 解析
+from fast_extract import (apply_known_fields, confident_fields, extract_fast_fields, fast_path_result,
+                          format_fast_fields, is_complete, known_fields_prompt)  # (V26.13 新增) 规则快速提取
+from prompt_cache import PromptStats, prompt_version  # (V26.11 新增) 前缀缓存友好布局 + Prompt 统计
+from result_cache import TieredCache, blobs_digest, content_key  # (V26.17 新增) VLM 批次级缓存
+from rate_control import (TokenBucket, RetryPolicy, CircuitBreaker, CircuitOpenError, UpstreamError,
+                          call_with_retry)  # (V26.4/V26.5 新增) 限流、退避重试、熔断
 import threading  # (新) 导入线程，防止GUI卡死
 import tkinter as tk  # (新) 导入 Tkinter
 from tkinter import filedialog, scrolledtext, messagebox, PanedWindow
@@ -29,6 +38,7 @@ if not API_KEY:
 QWEN_TEXT_CLIENT = OpenAI(
     api_key=API_KEY,
     base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+    max_retries=0,  # (V26.5) 重试统一由 call_with_retry 负责，避免 SDK 内部再重试一轮
 )
 QWEN_MODEL_NAME_TEXT = "qwen-plus-2025-01-25"
 dashscope.api_key = API_KEY
@@ -36,9 +46,40 @@ QWEN_MODEL_NAME_VISION = "qwen-vl-max"
 
 # --- 3. (V22 优化) VLM 处理常量 (不变) ---
 IMAGE_COMPRESSION_QUALITY = 85
-VLM_PAGE_CHUNK_SIZE = 3  # (3 页批次更稳定)
+VLM_PAGE_CHUNK_SIZE = 3  # (3 页批次更稳定；V26.6 起作为自适应批次的初始值)
 MAX_RETRIES = 3
 API_TIMEOUT = 600  # 10 分钟
+RENDER_WORKERS = min(4, os.cpu_count() or 1)  # (V26 新增) 栅格化进程数 (1 = 串行)
+VLM_PIPELINE_QUEUE_SIZE = 2  # (V26.3 新增) 渲染线程最多领先 VLM 调用的批次数 (按最大批次折算成页数)
+VLM_PAGE_PIXEL_BUDGET = 1280 * 28 * 28  # (V26.2 新增) 每页目标像素数 (qwen-vl 默认每图约 1280 个视觉 token；设为 None 则恢复固定 2 倍渲染)
+VLM_CHUNK_MIN_SIZE = 1  # (V26.6 新增) 自适应批次的下限 (页)
+VLM_CHUNK_MAX_SIZE = 6  # (V26.6 新增) 自适应批次的上限 (页)
+VLM_CHUNK_FAST_SECONDS = 45  # (V26.6 新增) 批次在此时间内成功即视为"快"，下一批 +1 页
+VLM_PAGE_FILTER_ENABLED = False  # (V26.7 新增) 跳过空白页/照片页/表格页 (首尾页始终保留)；误判会丢掉正文页，默认关闭
+VLM_MAX_IN_FLIGHT = 3  # (V26.4 新增) 同时在途的 VLM 批次数 (1 = 串行)
+VLM_REQUESTS_PER_MINUTE = 60  # (V26.4 新增) 与 DashScope 账号的 RPM 配额保持一致
+TEXT_SEGMENT_MAX_IN_FLIGHT = 3  # (V26.9 新增) 长文书各段同时在途的文本模型调用数
+STREAMING_ENABLED = True  # (V26.12 新增) 流式接收模型输出，每个字段一完成就显示到摘要窗口
+TEXT_COMPACTION_ENABLED = True  # (V26.10 新增) 去页眉/页脚/页码、拼回硬换行后再构建 Prompt
+FAST_PATH_MIN_CONFIDENCE = 0.8  # (V26.13 新增) 规则提取的字段达到此置信度才作为已知值
+STRUCTURE_MIN_CONFIDENCE = 0.9  # (V26.15 新增) 结构检测判定为扫描型且置信度达到此值时，不再逐页提取文本
+FAST_PATH_SKIP_LLM = False  # (V26.13 新增) True: 案号/法院/上诉期/日期全部高置信度命中时跳过文本模型
+VLM_CHUNK_CACHE_DIR = str(Path(__file__).resolve().parent / "vlm_chunk_cache")  # (V26.17 新增) 批次级缓存目录
+VLM_CHUNK_CACHE_MEMORY_ENTRIES = 512  # (V26.17 新增) 内存 LRU 最多保留的批次数
+VLM_CHUNK_CACHE_DISK_MAX_BYTES = 128 * 1024 * 1024  # (V26.17 新增) 磁盘上限，超出后按最久未访问淘汰
+VLM_CHUNK_CACHE_TTL = 30 * 86400  # (V26.17 新增) 有效期 (秒)
+
+# (V26.4 新增) 令牌桶：所有批次合计不超过 RPM 配额
+VLM_RATE_LIMITER = TokenBucket(VLM_REQUESTS_PER_MINUTE, burst=VLM_MAX_IN_FLIGHT)
+RETRY_BASE_DELAY = 2  # (V26.5 新增) 指数退避的基础等待秒数 (全抖动)
+RETRY_MAX_DELAY = 60  # (V26.5 新增) 单次退避的最长等待秒数
+BREAKER_FAILURE_THRESHOLD = 5  # (V26.5 新增) 连续失败多少次后熔断
+BREAKER_RESET_TIMEOUT = 60  # (V26.5 新增) 熔断后多少秒放行一个试探请求
+
+# (V26.5 新增) 文本与 VLM 两个调用点共用的重试策略和熔断器
+RETRY_POLICY = RetryPolicy(MAX_RETRIES, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY)
+UPSTREAM_BREAKER = CircuitBreaker("DashScope", failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                                  reset_timeout=BREAKER_RESET_TIMEOUT)
 
 # --- 4. (V23 - 最终版) 您的 "完整提取" Prompt ---
 SYSTEM_PROMPT = """你是一个极其严谨、注重细节的法律文书提取机器人。
@@ -105,13 +146,29 @@ JSON Output:
 现在，请【严格遵守上述所有规则，尤其是“法院陷阱”规则】，处理我提供的文件。
 """
 
-# --- 5. (不变) 辅助函数：分块器 ---
-def chunk_list(lst, n):
-    for i in range(0, len(lst), n):
-        yield lst[i:i + n]
+# (V26.11 新增) 静态 Prompt 在两条路径上都作为 system 消息放在最前面 (逐字节不变，便于上游前缀缓存)；
+# VLM 的任务说明放在图像之后
+VLM_TASK_PROMPT = "--- 真实任务：...请严格分析我提供的【这几页】图像..."
+PROMPT_VERSION = prompt_version(SYSTEM_PROMPT, VLM_TASK_PROMPT)
+TEXT_PROMPT_STATS = PromptStats(QWEN_MODEL_NAME_TEXT, PROMPT_VERSION, SYSTEM_PROMPT)
+VLM_PROMPT_STATS = PromptStats(QWEN_MODEL_NAME_VISION, PROMPT_VERSION, SYSTEM_PROMPT)
 
+# (V26.17 新增) VLM 批次级缓存：重新扫描/修订过的 PDF 中，图像未变化的批次直接复用已有 JSON
+VLM_CHUNK_CACHE = TieredCache(VLM_CHUNK_CACHE_DIR, memory_entries=VLM_CHUNK_CACHE_MEMORY_ENTRIES,
+                              disk_max_bytes=VLM_CHUNK_CACHE_DISK_MAX_BYTES, ttl_seconds=VLM_CHUNK_CACHE_TTL)
 
-# --- 6. (新) 辅助函数：JSON 到“易读摘要”的转换器 ---
+
+def vlm_chunk_cache_key(image_url_chunk):
+    return content_key(blobs_digest(image_url_chunk), QWEN_MODEL_NAME_VISION, PROMPT_VERSION)
+
+
+def vlm_chunk_plan_key(session, page_indices):
+    """(V26.17) 文档内容 + 送进 VLM 的页码 -> 上次运行的批次划分 (AIMD 的批次大小随调用耗时变化，重跑时按上次的边界切分)"""
+    return content_key(session.digest, ",".join(map(str, page_indices)), "chunk-plan", QWEN_MODEL_NAME_VISION,
+                       PROMPT_VERSION)
+
+
+# --- 5. (新) 辅助函数：JSON 到“易读摘要”的转换器 ---
 def format_json_for_display(data: dict) -> str:
     """(新) 将提取的 JSON 转换为易于复制的文本摘要"""
     lines = []
@@ -173,7 +230,42 @@ def format_json_for_display(data: dict) -> str:
     return "\n".join(lines)
 
 
-# --- 7. (新) GUI 日志重定向 ---
+# (V26.12 新增) 流式模式下逐字段显示：标签与 format_json_for_display 保持一致
+FIELD_LABELS = {
+    "type": "涉诉类型", "case_number": "案号", "cause_of_action": "案由", "court_name": "受理法院",
+    "appeal_court": "上诉法院", "date_received": "收到裁判时间", "appeal_deadline": "上诉截止日",
+    "third_party": "第三人", "presiding_judge": "主审法官", "execution_judge": "执行法官",
+}
+PARTY_LABELS = {
+    "plaintiff": ("原告信息", {"name": "原告名称", "address": "原告地址", "legal_rep": "法定代表人",
+                               "authorized_agent": "委托代理人", "agent_price": "代理费"}),
+    "defendant": ("被告信息", {"name": "被告名称", "address": "被告地址", "legal_rep": "法定代表人",
+                               "authorized_agent": "委托代理人"}),
+}
+LONG_TEXT_LABELS = {"claims": "诉讼请求", "facts_and_reasons": "事实和理由", "judgment_main": "一审裁判主文"}
+
+
+def format_field_for_display(key, value) -> str:
+    """将单个顶层字段转换为摘要文本 (空字符串返回 "")"""
+    if value == "":
+        return ""
+    if key in PARTY_LABELS and isinstance(value, dict):
+        title, labels = PARTY_LABELS[key]
+        lines = [f"\n--- {title} ---"]
+        for sub_key, label in labels.items():
+            sub_value = value.get(sub_key)
+            if sub_value is None:
+                lines.append(f"  {label}: null")
+            elif sub_value:
+                lines.append(f"  {label}: {sub_value}")
+        return "\n".join(lines)
+    if key in LONG_TEXT_LABELS:
+        return f"\n--- {LONG_TEXT_LABELS[key]} ---\n{value}" if value else ""
+    label = FIELD_LABELS.get(key, key)
+    return f"{label}: null" if value is None else f"{label}: {value}"
+
+
+# --- 6. (新) GUI 日志重定向 ---
 class TextRedirector:
     """将 print 语句重定向到 tkinter Text 控件"""
 
@@ -203,7 +295,7 @@ class TextRedirector:
         pass
 
 
-# --- 8. (新) Tkinter 应用主类 ---
+# --- 7. (新) Tkinter 应用主类 ---
 class App:
     def __init__(self, root):
         self.root = root
@@ -256,8 +348,10 @@ class App:
         print("--- 欢迎使用 V24 演示版 ---")
         print(f"--- Qwen (大脑) 模型: {QWEN_MODEL_NAME_TEXT} ---")
         print(f"--- Qwen (眼睛) 模型: {QWEN_MODEL_NAME_VISION} ---")
-        print(f"--- VLM 批次大小: {VLM_PAGE_CHUNK_SIZE} 页 ---")
+        print(f"--- VLM 批次大小: {VLM_PAGE_CHUNK_SIZE} 页 (自适应 {VLM_CHUNK_MIN_SIZE}-{VLM_CHUNK_MAX_SIZE} 页) ---")
         print(f"--- VLM 图像质量: {IMAGE_COMPRESSION_QUALITY}% ---")
+        print(f"--- VLM 并发: 最多 {VLM_MAX_IN_FLIGHT} 个批次, 限流 {VLM_REQUESTS_PER_MINUTE} 次/分钟 ---")
+        print(f"--- Prompt 版本: {PROMPT_VERSION} ---")
         print("请点击按钮选择一个 PDF 文件开始。\n")
 
     def select_file(self):
@@ -296,23 +390,24 @@ class App:
         threading.Thread(target=self.run_extraction_logic, daemon=True).start()
 
     # (新) 线程安全的 GUI 更新函数
-    def display_results(self, data, chunk_name=""):
-        """(新) 线程安全地更新两个窗口"""
+    def display_results(self, data, chunk_name="", show_summary=True):
+        """(新) 线程安全地更新两个窗口 (V26.12: 流式模式下摘要已逐字段显示过，show_summary=False)"""
         if not data:
             print(f"--- {chunk_name} 未返回有效数据。---")
             return
 
         # 1. 更新“摘要”窗口
-        try:
-            formatted_text = format_json_for_display(data)
-            self.summary_widget.config(state='normal')
-            if chunk_name:
-                self.summary_widget.insert(tk.END, f"--- {chunk_name} 的摘要 ---\n")
-            self.summary_widget.insert(tk.END, formatted_text + "\n\n")
-            self.summary_widget.see(tk.END)
-            self.summary_widget.config(state='disabled')
-        except Exception as e:
-            print(f"【GUI 错误】 格式化摘要时出错: {e}\n")
+        if show_summary:
+            try:
+                formatted_text = format_json_for_display(data)
+                self.summary_widget.config(state='normal')
+                if chunk_name:
+                    self.summary_widget.insert(tk.END, f"--- {chunk_name} 的摘要 ---\n")
+                self.summary_widget.insert(tk.END, formatted_text + "\n\n")
+                self.summary_widget.see(tk.END)
+                self.summary_widget.config(state='disabled')
+            except Exception as e:
+                print(f"【GUI 错误】 格式化摘要时出错: {e}\n")
 
         # 2. 更新“日志”窗口 (打印原始 JSON)
         title = f" 最终提取结果 (格式化) {chunk_name} "
@@ -320,206 +415,438 @@ class App:
         print(json.dumps(data, indent=2, ensure_ascii=False))
         print("\n" + "=" * 50)
 
+    # (V26.12 新增) 流式摘要：每个批次在摘要窗口中有自己的一段，字段完成一个就追加一个
+    def open_stream_section(self, chunk_name):
+        """
+        (可在后台线程调用) 预留一段摘要区域，返回 on_field(键, 值) 回调
+        回调带有 reset()：清空本段已显示的字段 (每次重试前、以及最终失败时调用，避免字段重复或留下半截结果)
+        """
+        mark = f"stream_{id(object())}"
+        self.root.after(0, self.create_stream_section, mark, chunk_name)
+
+        def on_field(key, value):
+            self.root.after(0, self.append_stream_field, mark, key, value)
+
+        def reset():
+            self.root.after(0, self.clear_stream_section, mark)
+
+        on_field.reset = reset
+        return on_field
+
+    def create_stream_section(self, mark, chunk_name):
+        self.summary_widget.config(state='normal')
+        self.summary_widget.insert(tk.END, f"--- {chunk_name} 的摘要 ---\n\n")
+        # (标记放在末尾空行之前；右侧重力：插入的字段排在标记之前，标记随之后移)
+        # (起点标记为左侧重力，停在本段第一个字段之前，reset 时删除两个标记之间的内容)
+        self.summary_widget.mark_set(mark, tk.END + "-2c")
+        self.summary_widget.mark_gravity(mark, tk.RIGHT)
+        self.summary_widget.mark_set(mark + "_start", tk.END + "-2c")
+        self.summary_widget.mark_gravity(mark + "_start", tk.LEFT)
+        self.summary_widget.config(state='disabled')
+
+    def clear_stream_section(self, mark):
+        self.summary_widget.config(state='normal')
+        self.summary_widget.delete(mark + "_start", mark)
+        self.summary_widget.config(state='disabled')
+
+    def append_stream_field(self, mark, key, value):
+        text = format_field_for_display(key, value)
+        if not text:
+            return
+        self.summary_widget.config(state='normal')
+        self.summary_widget.insert(mark, text + "\n")
+        self.summary_widget.see(mark)
+        self.summary_widget.config(state='disabled')
+
     # (新) 线程安全的按钮重置
     def reset_button(self):
         """(新) (线程安全) 重置“运行”按钮的状态"""
         self.run_btn.config(state="normal", text="2. 开始提取 (文本型或扫描型)")
 
-    # --- 9. (新) 后台核心逻辑 (V22) ---
+    # --- 8. (新) 后台核心逻辑 (V22) ---
     # (这些函数现在是 App 的一部分，以便它们可以调用 self.root.after)
 
-    def call_qwen_text_api(self, raw_text):
-        """(V22) 使用 OpenAI SDK 调用 Qwen 纯文本模型"""
+    def call_qwen_text_api(self, raw_text, user_content=None, on_field=None, known_fields=None):
+        """
+        (V22) 使用 OpenAI SDK 调用 Qwen 纯文本模型 (V26.9: user_content 用于长文书分段调用)
+        (V26.12) 传入 on_field 时流式接收，每个顶层字段完成后立即回调 on_field(键, 值)
+        (V26.13) known_fields: 规则已确定的字段，放在用户消息开头
+        """
         messages = [
             {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": f"法律文书原文(从PDF提取的纯文本):\n{raw_text}"}
+            {"role": "user", "content": known_fields_prompt(known_fields or {}) +
+                                    (user_content or f"法律文书原文(从PDF提取的纯文本):\n{raw_text}")}
         ]
         print(f"--- (大脑) 正在调用 {QWEN_MODEL_NAME_TEXT} (纯文本 API) ---\n")
-        try:
-            completion = QWEN_TEXT_CLIENT.chat.completions.create(
+
+        def request_completion():
+            """返回 (模型输出文本, 用量)"""
+            if on_field is None:
+                completion = QWEN_TEXT_CLIENT.chat.completions.create(
+                    model=QWEN_MODEL_NAME_TEXT,
+                    messages=messages,
+                    response_format={"type": "json_object"},
+                    temperature=0.0
+                )
+                return completion.choices[0].message.content, completion.usage
+
+            stream = QWEN_TEXT_CLIENT.chat.completions.create(
                 model=QWEN_MODEL_NAME_TEXT,
                 messages=messages,
                 response_format={"type": "json_object"},
-                temperature=0.0
+                temperature=0.0,
+                stream=True,
+                stream_options={"include_usage": True}
             )
-            model_output_string = completion.choices[0].message.content
+            on_field.reset()  # (重试时清空上一次尝试已显示的字段)
+            parser = IncrementalJSONParser()
+            parts, usage = [], None
+            for chunk in stream:
+                usage = chunk.usage or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    for key, value in parser.feed(chunk.choices[0].delta.content):
+                        on_field(key, value)
+            return "".join(parts), usage
+
+        try:
+            # (V26.5) 指数退避重试 + 熔断
+            model_output_string, usage = call_with_retry(request_completion, RETRY_POLICY, UPSTREAM_BREAKER,
+                                                         name=QWEN_MODEL_NAME_TEXT)
+            print(TEXT_PROMPT_STATS.record(messages, usage) + "\n")
             return json.loads(model_output_string)
         except Exception as e:
             print(f"【Qwen 文本 API 错误】: {e}\n")
             return None
 
-    def call_qwen_vlm_api(self, file_path):
-        """(V22 - 压缩、分块、重试、Bug修复)"""
-        print(f"--- (眼睛) 正在使用 PyMuPDF+Pillow 将 {file_path} 转换为压缩 JPEG... ---\n")
-        temp_files = []
-        doc = None
+    def build_document_text(self, text_pages):
+        """(V26.10 新增) 按页码顺序拼接文本页；启用压缩时打印节省的 token 数"""
+        text, compaction = join_page_texts(text_pages, compact=TEXT_COMPACTION_ENABLED)
+        if compaction:
+            print(format_compaction_stats(compaction) + "\n")
+        return text
+
+    def extract_text_document(self, raw_text, on_field=None):
+        """
+        (V26.9 新增) 短文书单次调用；长文书按章节边界分段，各段并行提取后合并
+        (V26.12) on_field 只用于单次调用 (分段结果要合并后才完整，不逐字段显示)
+        (V26.13) 先用规则提取固定格式的字段，作为已知值交给模型，并回填模型返回的 null
+        """
+        matches = extract_fast_fields(raw_text)
+        print(format_fast_fields(matches) + "\n")
+        known_fields = confident_fields(matches, FAST_PATH_MIN_CONFIDENCE)
+        if FAST_PATH_SKIP_LLM and is_complete(known_fields):
+            print("--- (规则) 全部规则字段高置信度命中，跳过文本模型 ---\n")
+            result = fast_path_result(known_fields)
+            if on_field:
+                for key, value in result.items():
+                    on_field(key, value)
+            return result
+
+        if not is_long_document(raw_text):
+            result = self.call_qwen_text_api(raw_text, on_field=on_field, known_fields=known_fields)
+            backfilled = [key for key in known_fields if isinstance(result, dict) and result.get(key) in (None, "")]
+            result = apply_known_fields(result, known_fields)
+            if on_field and backfilled:
+                # (摘要中已显示模型返回的 null：按回填后的结果重新显示本段)
+                on_field.reset()
+                for key, value in result.items():
+                    on_field(key, value)
+            return result
+
+        segments = split_into_segments(raw_text)
+        print(f"--- (大脑) 长文书模式：全文切分为 {len(segments)} 段，"
+              f"最多 {TEXT_SEGMENT_MAX_IN_FLIGHT} 段并行提取 ---\n")
+
+        def extract_segment(indexed_segment):
+            index, segment = indexed_segment
+            return self.call_qwen_text_api(segment, user_content=segment_prompt(segment, index, len(segments)),
+                                           known_fields=known_fields)
+
+        results = list(dispatch_in_order(enumerate(segments), extract_segment, TEXT_SEGMENT_MAX_IN_FLIGHT))
+        failed = sum(1 for result in results if result is None)
+        if failed:
+            print(f"【长文书警告】: {failed}/{len(segments)} 段提取失败，合并结果可能不完整。\n")
+        return apply_known_fields(merge_extractions(results), known_fields)
+
+    def call_vlm_chunk(self, image_url_chunk, chunk_name, chunk_sizer=None, on_field=None):
+        """
+        (V26.3 重构) 调用 VLM 处理一个批次，成功返回 JSON 字典，失败返回 None
+        (V26.12) 传入 on_field 时流式接收 (incremental_output)，字段完成即回调
+        """
+        # (V26.11) 静态 Prompt 放在 system 消息 (前缀)，图像和任务说明放在其后
+        content = [{"image": url} for url in image_url_chunk]
+        content.append({"text": VLM_TASK_PROMPT})
+        messages = [
+            {"role": "system", "content": [{"text": SYSTEM_PROMPT}]},
+            {"role": "user", "content": content}
+        ]
+
+        def before_attempt(attempt):
+            waited = VLM_RATE_LIMITER.acquire()
+            if waited > 0:
+                print(f"--- (限流) {chunk_name} 等待令牌 {waited:.1f} 秒 ---\n")
+            print(f"--- (眼睛) 正在调用 VLM API ({chunk_name}, Attempt {attempt + 1}/{MAX_RETRIES})... ---\n")
+
+        def check_status(response):
+            if response.status_code != 200:
+                raise UpstreamError(f"{response.code} - {response.message}",
+                                    status_code=response.status_code, code=response.code)
+
+        def request_vlm():
+            """返回 (模型输出文本, 用量)"""
+            if on_field is None:
+                response = dashscope.MultiModalConversation.call(
+                    model=QWEN_MODEL_NAME_VISION,
+                    messages=messages,
+                    temperature=0.0,
+                    timeout=API_TIMEOUT
+                )
+                check_status(response)
+                model_output_content = response.output.choices[0].message.content
+                return "".join(item['text'] for item in model_output_content if 'text' in item), response.usage
+
+            responses = dashscope.MultiModalConversation.call(
+                model=QWEN_MODEL_NAME_VISION,
+                messages=messages,
+                temperature=0.0,
+                timeout=API_TIMEOUT,
+                stream=True,
+                incremental_output=True
+            )
+            on_field.reset()  # (重试时清空上一次尝试已显示的字段)
+            parser = IncrementalJSONParser()
+            parts, usage = [], None
+            for response in responses:
+                check_status(response)
+                usage = response.usage or usage
+                for item in response.output.choices[0].message.content:
+                    if 'text' in item:
+                        parts.append(item['text'])
+                        for key, value in parser.feed(item['text']):
+                            on_field(key, value)
+            return "".join(parts), usage
+
+        def attempt_vlm():
+            """(V26.6) 每次失败的尝试 (包括最后一次) 在这里给自适应批次记录且只记录一次失败"""
+            try:
+                return request_vlm()
+            except Exception:
+                if chunk_sizer:
+                    chunk_sizer.record_failure()
+                raise
+
+        try:
+            # (V26.5) 指数退避重试 + 熔断 (替代固定的 time.sleep(5))
+            model_output_string, usage = call_with_retry(attempt_vlm, RETRY_POLICY, UPSTREAM_BREAKER,
+                                                         name=chunk_name, before_attempt=before_attempt)
+            print(f"--- (眼睛) VLM API 调用成功 ({chunk_name}) ---\n")
+            print(VLM_PROMPT_STATS.record(messages, usage) + "\n")
+        except CircuitOpenError:
+            raise  # (上游不健康：放弃剩余批次)
+        except Exception as e:
+            print(f"【Qwen VLM API 错误】 ({chunk_name}): {e}\n")
+            print(f"--- 批次 {chunk_name} 【失败】，已放弃重试。---\n")
+            return None
+
+        if not model_output_string:
+            print(f"【VLM 错误】 ({chunk_name}): VLM 返回的内容中没有找到文本。\n")
+            return None
+
+        json_match = model_output_string[model_output_string.find('{'): model_output_string.rfind('}') + 1]
+        if not json_match:
+            print(f"【VLM 错误】 ({chunk_name}): VLM 未返回有效的 JSON 结构。\n")
+            return None
+
+        return json.loads(json_match)
+
+    def call_qwen_vlm_api(self, session, page_indices=None):
+        """
+        (V22 - 压缩、分块、重试、Bug修复; V26.3 渲染与 VLM 调用流水线并行)
+        (V26.8) page_indices 不为 None 时只处理这些页 (混合型 PDF 的扫描页)
+        (V26.14) session 为本次任务的 DocumentSession，筛选和串行渲染复用同一个已打开的文档
+        """
+        print(f"--- (眼睛) 正在使用 PyMuPDF+Pillow 将 {session.name} 转换为压缩 JPEG... ---\n")
         all_success = True
         try:
-            doc = fitz.open(file_path)
-            all_image_urls = []
-            for i, page in enumerate(doc):
-                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-                pil_image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                tmp_file_path = f"{tempfile.gettempdir()}/_page{i + 1}_{Path(file_path).stem}.jpg"
-                pil_image.save(tmp_file_path, "JPEG", quality=IMAGE_COMPRESSION_QUALITY)
-                temp_files.append(tmp_file_path)
-                all_image_urls.append(f"file://{Path(tmp_file_path).resolve()}")
-
-            if not all_image_urls:
+            if page_indices is None:
+                page_indices = list(range(session.page_count))
+            page_count = len(page_indices)
+            if not page_count:
                 print("【VLM 错误】: 无法从 PDF 提取任何图像页面。\n")
                 return False
 
-            print(f"--- (眼睛) 成功提取 {len(all_image_urls)} 页图像 (JPEG Quality={IMAGE_COMPRESSION_QUALITY}) ---\n")
-
-            url_chunks = list(chunk_list(all_image_urls, VLM_PAGE_CHUNK_SIZE))
-            print(f"--- (眼睛) 已将任务分为 {len(url_chunks)} 个批次 (每批 {VLM_PAGE_CHUNK_SIZE} 页) ---\n")
-
-            for chunk_index, image_url_chunk in enumerate(url_chunks):
-                chunk_name = f"批次 {chunk_index + 1}/{len(url_chunks)} (第 {chunk_index * VLM_PAGE_CHUNK_SIZE + 1} - {chunk_index * VLM_PAGE_CHUNK_SIZE + len(image_url_chunk)} 页)"
+            print(f"--- (眼睛) 共 {page_count} 页，自适应批次 (初始 {VLM_PAGE_CHUNK_SIZE} 页，"
+                  f"范围 {VLM_CHUNK_MIN_SIZE}-{VLM_CHUNK_MAX_SIZE} 页，JPEG Quality={IMAGE_COMPRESSION_QUALITY}) ---\n")
+
+            # (V26.6) AIMD：调用快则加大批次，超时/失败则减半，减少简单文档的往返次数
+            chunk_sizer = AdaptiveChunkSizer(VLM_PAGE_CHUNK_SIZE, min_size=VLM_CHUNK_MIN_SIZE,
+                                             max_size=VLM_CHUNK_MAX_SIZE, fast_seconds=VLM_CHUNK_FAST_SECONDS)
+
+            # (V26.7) 预筛选：只把与提取字段相关的页面送进 VLM
+            if VLM_PAGE_FILTER_ENABLED:
+                page_indices, filter_report = select_relevant_pages(session, page_indices)
+                print_filter_report(filter_report, page_count)
+
+            # (V26) 多进程并行栅格化：每个子进程自己打开 PDF，渲染自己的页码区间
+            # (V26.1) JPEG 只存在于内存中，以 base64 Data URI 内联发送，不再写临时文件
+            # (V26.3) 渲染在后台线程中进行 (生产者)，VLM 调用 (消费者) 与之重叠
+            page_jpegs = iter_rendered_pages(session, IMAGE_COMPRESSION_QUALITY, workers=RENDER_WORKERS,
+                                             pixel_budget=VLM_PAGE_PIXEL_BUDGET, batch_pages=VLM_PAGE_CHUNK_SIZE,
+                                             page_indices=page_indices)
+            # (后台线程只预取页面；分块在空出在途名额、取下一批时才进行，批次大小总是 AIMD 的最新建议)
+            page_urls = prefetch(((i, jpeg_to_data_uri(jpeg_bytes)) for i, jpeg_bytes in zip(page_indices, page_jpegs)),
+                                 maxsize=VLM_PIPELINE_QUEUE_SIZE * VLM_CHUNK_MAX_SIZE)
+            # (V26.17) 缓存命中的批次不记录耗时，AIMD 的批次大小会与上次不同：按上次的批次划分切分，边界才能对上
+            plan_key = vlm_chunk_plan_key(session, page_indices)
+            plan, _ = VLM_CHUNK_CACHE.get(plan_key)
+            if plan:
+                print(f"--- (缓存) 按上次的批次划分切分: {plan} ---")
+            url_chunks = iter_adaptive_chunks(page_urls, chunk_sizer, plan)
+
+            def reserve_sections(url_chunks):
+                """(V26.12) 分发批次时 (按页码顺序) 就预留摘要区域：先完成的批次 (例如缓存命中) 也不会排到前面的批次之前"""
+                for chunk_index, page_chunk in enumerate(url_chunks):
+                    chunk_name = f"批次 {chunk_index + 1} ({describe_pages([i for i, _ in page_chunk])})"
+                    yield chunk_name, page_chunk, self.open_stream_section(chunk_name) if STREAMING_ENABLED else None
+
+            def process_chunk(reserved_chunk):
+                chunk_name, page_chunk, on_field = reserved_chunk
+                image_url_chunk = [url for _, url in page_chunk]
                 print("\n" + "=" * 50)
                 print(f"--- (眼睛) 正在处理 {chunk_name} ---\n")
 
-                full_user_prompt_text = f"{SYSTEM_PROMPT}\n\n--- 真实任务：...请严格分析我提供的【这几页】图像..."
-                content = [{"image": url} for url in image_url_chunk]
-                content.append({"text": full_user_prompt_text})
-                messages = [{"role": "user", "content": content}]
-
-                response = None
-                for attempt in range(MAX_RETRIES):
-                    try:
-                        print(f"--- (眼睛) 正在调用 VLM API (Attempt {attempt + 1}/{MAX_RETRIES})... ---\n")
-                        response = dashscope.MultiModalConversation.call(
-                            model=QWEN_MODEL_NAME_VISION,
-                            messages=messages,
-                            temperature=0.0,
-                            timeout=API_TIMEOUT
-                        )
-                        if response.status_code == 200:
-                            print(f"--- (眼睛) VLM API 调用成功 (Attempt {attempt + 1}) ---\n")
-                            break
-                        else:
-                            print(
-                                f"【Qwen VLM API 错误】 ({chunk_name}, Attempt {attempt + 1}): {response.code} - {response.message}\n")
-                            if attempt < MAX_RETRIES - 1: time.sleep(5)
-
-                    except (requests.exceptions.ConnectionError, RemoteDisconnected, Exception) as e:
-                        print(f"【VLM API 网络/SDK 错误】 ({chunk_name}, Attempt {attempt + 1}): {e}\n")
-                        if attempt < MAX_RETRIES - 1: time.sleep(5)
-
-                if response is None or response.status_code != 200:
-                    print(f"--- 批次 {chunk_name} 【失败】，已达到最大重试次数。---\n")
+                # (V26.17) 页面图像与之前某次完全相同：复用结果，不调用 VLM，也不影响自适应批次
+                cache_key = vlm_chunk_cache_key(image_url_chunk)
+                cached_data, _ = VLM_CHUNK_CACHE.get(cache_key)
+                if cached_data is not None:
+                    print(f"--- (缓存) {chunk_name} 页面图像未变化，复用已有结果 ---\n")
+                    if on_field:
+                        for key, value in cached_data.items():  # (填入预留的摘要区域)
+                            on_field(key, value)
+                    return chunk_name, cached_data, STREAMING_ENABLED
+
+                started_at = time.monotonic()
+                extracted_data = self.call_vlm_chunk(image_url_chunk, chunk_name, chunk_sizer, on_field)
+                if extracted_data is None:
+                    if on_field:
+                        on_field.reset()  # (最终失败：不留下半截字段)
+                else:  # (失败已在 call_vlm_chunk 中按尝试次数记录)
+                    chunk_sizer.record_success(time.monotonic() - started_at)
+                    VLM_CHUNK_CACHE.put(cache_key, extracted_data)
+                return chunk_name, extracted_data, STREAMING_ENABLED
+
+            # (V26.4) 最多 VLM_MAX_IN_FLIGHT 个批次同时调用 VLM，结果按批次顺序显示
+            for chunk_name, extracted_data, streamed in dispatch_in_order(reserve_sections(url_chunks), process_chunk,
+                                                                          VLM_MAX_IN_FLIGHT):
+                if extracted_data is None:
                     all_success = False
                     continue
 
-                model_output_content = response.output.choices[0].message.content
-                model_output_string = ""
-                for item in model_output_content:
-                    if 'text' in item: model_output_string += item['text']
-
-                if not model_output_string:
-                    print(f"【VLM 错误】 ({chunk_name}): VLM 返回的内容中没有找到文本。\n")
-                    all_success = False
-                    continue
-
-                json_match = model_output_string[model_output_string.find('{'): model_output_string.rfind('}') + 1]
-                if not json_match:
-                    print(f"【VLM 错误】 ({chunk_name}): VLM 未返回有效的 JSON 结构。\n")
-                    all_success = False
-                    continue
-
-                # (新) 线程安全地调用 GUI 更新
-                extracted_data = json.loads(json_match)
-                self.root.after(0, self.display_results, extracted_data, chunk_name)
+                # (新) 线程安全地调用 GUI 更新 (V26.12: 流式模式下摘要已逐字段显示在预留的区域中)
+                self.root.after(0, self.display_results, extracted_data, chunk_name, not streamed)
 
+            print(f"--- (自适应) 本文档各批次页数: {chunk_sizer.used_sizes} ---\n")
+            if chunk_sizer.used_sizes != plan:
+                VLM_CHUNK_CACHE.put(plan_key, chunk_sizer.used_sizes)
             return all_success
 
+        except CircuitOpenError as e:
+            print(f"【熔断】: {e}，剩余批次已取消。\n")
+            return False
         except Exception as e:
             print(f"【VLM 图像转换/处理异常】: {e}\n")
             return False
 
-        finally:
-            if doc:
-                try:
-                    doc.close()
-                except:
-                    pass
-            print("--- (清理) 正在删除所有临时图像文件... ---")
-            cleaned_count = 0
-            for tmp_file in temp_files:
-                try:
-                    os.unlink(tmp_file)
-                    cleaned_count += 1
-                except Exception as e:
-                    print(f"【警告】: 无法删除临时文件 {tmp_file}: {e}\n")
-            print(f"--- (清理) 成功删除 {cleaned_count}/{len(temp_files)} 个文件 ---\n")
-
-    def detect_pdf_type(self, filepath):
-        """(V20 - PyMuPDF 版) 检测 PDF 是“文本型”还是“扫描型”"""
-        print(f"--- (检测) 正在使用 PyMuPDF 打开 {filepath} ---\n")
-        doc = None
+    def detect_pdf_type(self, session):
+        """
+        (V20 - PyMuPDF 版; V26.8 逐页分类) 检测 PDF 是“文本型”、“扫描型”还是“混合型”
+        返回 (类型, 文本页 {页码: 文本}, 扫描页页码列表)
+        (V26.15) 结构检测有把握判定为扫描型时提前返回；否则退回逐页分类
+        """
+        print(f"--- (检测) 正在使用 PyMuPDF 检测 {session.name} ---\n")
         try:
-            doc = fitz.open(filepath)
-            text_length = 0
-            for page in doc:
-                text_length += len(page.get_text().strip())
-                if text_length > 100:  break
-
-            if text_length > 100:
-                print(f"--- (检测) PDF 是【文本型】(找到 {text_length} 字符) ---\n")
-                return "TEXT_PDF"
-            else:
+            # (V26.15) 先看前几页的结构 (字体/文本操作符/图像覆盖率)；整页图像的扫描件直接判定，提前退出
+            # (只有其余页也都没有字体资源时才提前退出：前几页扫描、后面打字的文书仍需逐页分类，文本页走文本模型)
+            verdict, confidence, _ = detect_structure(session)
+            print(f"--- (检测) 结构检测: {verdict or '不确定'} (置信度 {confidence:.2f}) ---\n")
+            if verdict == "SCANNED_PDF" and confidence >= STRUCTURE_MIN_CONFIDENCE:
+                if not any(session.page_has_fonts(i) for i in range(SAMPLE_PAGES, session.page_count)):
+                    print(f"--- (检测) PDF 是【扫描型】(前 {SAMPLE_PAGES} 页均为整页图像，其余页没有文字层) ---\n")
+                    return "SCANNED_PDF", {}, list(range(session.page_count))
+                print(f"--- (检测) 前 {SAMPLE_PAGES} 页为整页图像，但后续页有文字层，改为逐页分类 ---\n")
+
+            text_pages, scanned_pages = classify_pages(session)
+            text_length = sum(len(text.strip()) for text in text_pages.values())
+
+            if text_length <= 100:
                 print(f"--- (检测) PDF 是【扫描型】(仅找到 {text_length} 字符) ---\n")
-                return "SCANNED_PDF"
+                return "SCANNED_PDF", {}, list(range(len(text_pages) + len(scanned_pages)))
+            if not scanned_pages:
+                print(f"--- (检测) PDF 是【文本型】(找到 {text_length} 字符) ---\n")
+                return "TEXT_PDF", text_pages, []
+            print(f"--- (检测) PDF 是【混合型】({len(text_pages)} 页文本, {len(scanned_pages)} 页扫描) ---\n")
+            return "MIXED_PDF", text_pages, scanned_pages
         except Exception as e:
             print(f"【PyMuPDF 检测错误】: {e}\n")
-            return "ERROR"
-        finally:
-            if doc:
-                doc.close()
-
-    # --- 10. (新) 后台“管道” (在线程中运行) ---
+            return "ERROR", {}, []
+
+    def run_text_pages(self, text_pages):
+        """(V26.8 新增) 混合型 PDF 的文本页：拼接后调用文本模型并显示"""
+        text = self.build_document_text(text_pages)
+        self.extract_and_display_text(text, f"(文本页 {describe_pages(sorted(text_pages))})")
+
+    def extract_and_display_text(self, text, title):
+        """(V26.12 新增) 文本路径：启用流式时逐字段显示，完成后把完整 JSON 打印到日志"""
+        streaming = STREAMING_ENABLED and not is_long_document(text)
+        on_field = self.open_stream_section(title) if streaming else None
+        extracted_data = self.extract_text_document(text, on_field=on_field)
+        if on_field and extracted_data is None:
+            on_field.reset()  # (最终失败：不留下半截字段)
+        self.root.after(0, self.display_results, extracted_data, title, not streaming)
+
+    # --- 9. (新) 后台“管道” (在线程中运行) ---
     def run_extraction_logic(self):
             """主执行函数 (“混合 VLM 实验室” PyMuPDF 版)"""
+            session = None
             try:
                 # 1. 智能检测 PDF 类型
-                pdf_type = self.detect_pdf_type(self.filepath)
+                # (V26.14) 整个任务只打开这一次 PDF，检测/文本/筛选/渲染共用同一个会话
+                session = DocumentSession(self.filepath)
+                pdf_type, text_pages, scanned_pages = self.detect_pdf_type(session)
 
                 if pdf_type == "TEXT_PDF":
                     # (流程一) 文本型 PDF
-                    print(f"--- (大脑) 正在使用 PyMuPDF 提取 {self.filepath} 的全部文本... ---\n")
-                    doc = None
-                    try:
-                        doc = fitz.open(self.filepath)
-
-                        # --------------------------------------------------
-                        # (V24.1 修复)
-                        # 错误：full_text_list = [page.get_text() for page in doc.pages]
-                        # 修复：
-                        full_text_list = [page.get_text() for page in doc.pages()]  # <-- 已添加 () 括号
-                        # --------------------------------------------------
-
-                        text = "\n".join(full_text_list)
-                    except Exception as e:
-                        print(f"【PyMuPDF 提取错误】: {e}\n")
-                        return  # (在 finally 中重置按钮)
-                    finally:
-                        if doc: doc.close()
-
-                    extracted_data = self.call_qwen_text_api(text)
+                    # (V26.8) 检测时已逐页取得文本，无需再次打开 PDF
+                    text = self.build_document_text(text_pages)
 
                     # (新) 文本型只显示一次
-                    self.root.after(0, self.display_results, extracted_data, "(文本型 PDF)")
+                    self.extract_and_display_text(text, "(文本型 PDF)")
 
                 elif pdf_type == "SCANNED_PDF":
                     # (流程二) 扫描型 PDF
                     # (VLM 函数现在自己负责循环和打印)
-                    vlm_success = self.call_qwen_vlm_api(self.filepath)
+                    vlm_success = self.call_qwen_vlm_api(session)
 
                     if vlm_success:
                         print("\n--- 所有 VLM 批处理任务均已尝试。 ---")
                     else:
                         print("\n--- VLM 任务处理中有错误发生。 ---")
 
+                elif pdf_type == "MIXED_PDF":
+                    # (流程三) (V26.8 新增) 混合型 PDF：文本页走文本模型 (后台线程)，扫描页走 VLM，两路并行
+                    print(f"--- (路由) 文本模型: {describe_pages(sorted(text_pages))}；"
+                          f"VLM: {describe_pages(scanned_pages)} ---\n")
+                    text_thread = threading.Thread(target=self.run_text_pages, args=(text_pages,), daemon=True)
+                    text_thread.start()
+                    vlm_success = self.call_qwen_vlm_api(session, page_indices=scanned_pages)
+                    text_thread.join()
+
+                    if vlm_success:
+                        print("\n--- 文本页与所有 VLM 批处理任务均已尝试。 ---")
+                    else:
+                        print("\n--- VLM 任务处理中有错误发生。 ---")
+
                 else:
                     print("--- PDF 处理失败，脚本终止。 ---")
 
@@ -528,10 +855,12 @@ class App:
             except Exception as e:
                 print(f"【未捕获的全局错误】: {e}\n")
             finally:
+                if session:
+                    session.close()
                 # (不变) 无论成功还是失败，都重置按钮
                 self.root.after(0, self.reset_button)
 
-# --- 11. (新) 启动 Tkinter 应用 ---
+# --- 10. (新) 启动 Tkinter 应用 ---
 if __name__ == "__main__":
     # (旧的 main() 已被移除)
     root = tk.Tk()
@@ -0,0 +1,129 @@
+"""
+(V26.22 新增) 上游调用的全局公平调度
+
+所有文档的 VLM 批次与文本模型调用共用 slots 个名额。名额空出时，不按先来后到分配，
+而是在各队列 (一个文档、一个客户端……由调用方决定 key) 之间轮转：
+一份 300 页的扫描件排了 100 个批次，也只能和其他文档轮流取得名额，小文档不会被饿死。
+实现为步幅调度 (stride scheduling)：每个队列有一个虚拟时间，每取得一个名额前进 1/weight，
+总是把名额交给虚拟时间最小的队列；weight 越大，分到的名额越多。
+同一队列内还可以按 member 再分组 (例如同一客户端的多个文档)：队列分到的名额在各 member 之间轮转，
+一个客户端同时处理多少个文档都只占一个队列，不会因此多分名额。
+(V26.23) async_slot 供 asyncio 服务模式使用：等待名额时不阻塞事件循环，等待中被取消时退出队列 (或归还已分到的名额)。
+"""
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+
+class _LoopEvent:
+    """(async_slot) 与 threading.Event 相同的 set() 接口：从任意线程唤醒事件循环中等待的协程"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def set(self):
+        self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class FairScheduler:
+    """(线程安全) 用法: with scheduler.slot(key[, weight, member]): 调用上游...；asyncio 中用 async with scheduler.async_slot(...)"""
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.in_use = 0
+        self.queues = {}  # (key -> {member -> 等待中的 (Event, weight)}，member 按轮转顺序排列)
+        self.passes = {}  # (key -> 虚拟时间)
+        self.virtual_time = 0.0  # (最近一次分配时的虚拟时间；新队列从这里起步，不能靠之前空闲积攒优先权)
+        self.granted = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, key=None, weight=1.0, member=None):
+        """阻塞直到 key 分到一个名额 (key 内按 member 轮转)；退出 with 时归还"""
+        ready = threading.Event()
+        self._enqueue(ready, key, weight, member)
+        ready.wait()
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def async_slot(self, key=None, weight=1.0, member=None):
+        """(asyncio) 与 slot 相同，但在事件循环中等待名额"""
+        ready = _LoopEvent(asyncio.get_running_loop())
+        self._enqueue(ready, key, weight, member)
+        try:
+            await ready.future
+        except asyncio.CancelledError:
+            if not self._withdraw(ready, key, member):
+                self._release()  # (取消时已经分到名额：归还)
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _enqueue(self, ready, key, weight, member):
+        with self.lock:
+            if key not in self.queues:
+                self.queues[key] = OrderedDict()
+                self.passes[key] = self.virtual_time
+            self.queues[key].setdefault(member, deque()).append((ready, weight))
+            self._dispatch()
+
+    def _withdraw(self, ready, key, member):
+        """把还在排队的 ready 移出队列；已经分到名额时返回 False"""
+        with self.lock:
+            waiting = self.queues.get(key, {}).get(member)
+            entry = next((entry for entry in waiting or () if entry[0] is ready), None)
+            if entry is None:
+                return False
+            waiting.remove(entry)
+            if not waiting:
+                del self.queues[key][member]
+                if not self.queues[key]:
+                    del self.queues[key]
+                    del self.passes[key]
+            return True
+
+    def _release(self):
+        with self.lock:
+            self.in_use -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """有空余名额时，交给虚拟时间最小的队列中轮到的 member 的最早请求 (调用方持有 self.lock)"""
+        while self.in_use < self.slots and self.queues:
+            key = min(self.queues, key=self.passes.__getitem__)
+            members = self.queues[key]
+            member, waiting = next(iter(members.items()))
+            ready, weight = waiting.popleft()
+            if waiting:
+                members.move_to_end(member)  # (下一个名额轮到同一队列的其他 member)
+            else:
+                del members[member]
+            self.virtual_time = self.passes[key]
+            self.passes[key] += 1.0 / max(weight, 1e-6)
+            if not self.queues[key]:
+                del self.queues[key]
+                del self.passes[key]  # (队列清空后不再保留进度；再次排队时从当前虚拟时间起步)
+            self.in_use += 1
+            self.granted += 1
+            ready.set()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "slots": self.slots,
+                "in_use": self.in_use,
+                "waiting": sum(len(waiting) for members in self.queues.values() for waiting in members.values()),
+                "waiting_queues": len(self.queues),
+                "granted": self.granted,
+            }
@@ -0,0 +1,98 @@
+"""
+(V26.13 新增) 规则快速提取：从文字层直接取出格式固定的字段
+
+server.py 与 court_documents_extraction_withQWEN.py 共用此模块。
+案号、受理法院、上诉期、落款日期的写法非常固定，用预编译的正则即可在微秒级取出。
+结果带置信度：高置信度的字段作为"已知值"告诉文本模型，并在模型返回 null 时回填；
+开启 FAST_PATH_SKIP_LLM 时，这几个字段全部高置信度命中的文书可以完全跳过文本模型。
+"""
+import re
+
+# --- 1. 常量 ---
+HEAD_CHARS = 600  # (案号、受理法院只在文书开头查找)
+TAIL_RATIO = 0.3  # (落款日期应出现在文书最后 30% 的位置)
+
+# (与 SYSTEM_PROMPT 黄金范例一致的完整字段列表；跳过模型时其余字段填 null)
+RESULT_KEYS = ("type", "plaintiff", "defendant", "third_party", "claims", "facts_and_reasons", "court_name",
+               "appeal_court", "cause_of_action", "case_number", "presiding_judge", "execution_judge",
+               "date_received", "appeal_deadline", "judgment_main")
+FAST_FIELDS = ("case_number", "court_name", "appeal_deadline", "date_received")
+
+_CN_NUM = "〇○零一二三四五六七八九十百"
+CASE_NUMBER_PATTERN = re.compile(r"[（(]\s*(?:19|20)\d{2}\s*[）)]\s*[\u4e00-\u9fff\d]{1,16}?\d+\s*号")
+COURT_NAME_PATTERN = re.compile(r"(?<![\u4e00-\u9fff])([\u4e00-\u9fff]{2,25}?人民法院)")
+APPEAL_DEADLINE_PATTERN = re.compile(rf"(?:判决书|裁定书|决定书)?送达之日起\s*[{_CN_NUM}\d]+\s*日内")
+DATE_PATTERN = re.compile(rf"[{_CN_NUM}]{{4}}年[{_CN_NUM}]{{1,2}}月[{_CN_NUM}]{{1,3}}日|"
+                          r"(?:19|20)\d{2}年\d{1,2}月\d{1,2}日")
+_SPACES = re.compile(r"\s+")
+
+
+# --- 2. 提取 ---
+def _distinct(matches):
+    """去掉空白差异后去重，保持出现顺序"""
+    seen = {}
+    for match in matches:
+        seen.setdefault(_SPACES.sub("", match), match.strip())
+    return list(seen.values())
+
+
+def _pick(values, unique_confidence, ambiguous_confidence, last=False):
+    if not values:
+        return None
+    value = values[-1] if last else values[0]
+    return value, unique_confidence if len(values) == 1 else ambiguous_confidence
+
+
+def extract_fast_fields(text):
+    """返回 {字段: (值, 置信度 0~1)}，只包含匹配到的字段"""
+    head = text[:HEAD_CHARS]
+    found = {
+        "case_number": _pick(_distinct(CASE_NUMBER_PATTERN.findall(head)), 0.95, 0.6),
+        "court_name": _pick(_distinct(COURT_NAME_PATTERN.findall(head)), 0.9, 0.6),
+        "appeal_deadline": _pick(_distinct(APPEAL_DEADLINE_PATTERN.findall(text)), 0.95, 0.7),
+    }
+
+    # (落款日期：取最后一个日期；只有它出现在文书末尾时才算高置信度)
+    dates = list(DATE_PATTERN.finditer(text))
+    if dates:
+        near_end = dates[-1].start() >= len(text) * (1 - TAIL_RATIO)
+        found["date_received"] = (dates[-1].group(), 0.85 if near_end else 0.5)
+    return {field: match for field, match in found.items() if match}
+
+
+def confident_fields(matches, min_confidence):
+    """只保留置信度达到阈值的字段，返回 {字段: 值}"""
+    return {field: value for field, (value, confidence) in matches.items() if confidence >= min_confidence}
+
+
+def is_complete(fields):
+    return all(field in fields for field in FAST_FIELDS)
+
+
+# --- 3. 与文本模型衔接 ---
+def known_fields_prompt(fields):
+    """作为用户消息的前缀，告诉模型这些字段已由规则确定"""
+    if not fields:
+        return ""
+    lines = "\n".join(f"- {field}: {value}" for field, value in fields.items())
+    return f"以下字段已从原文中按固定格式确定，请直接采用 (逐字保持不变):\n{lines}\n\n"
+
+
+def apply_known_fields(result, fields):
+    """模型对这些字段返回 null 或遗漏时，用规则提取的值回填"""
+    if not isinstance(result, dict):
+        return result
+    for field, value in fields.items():
+        if result.get(field) in (None, ""):
+            result[field] = value
+    return result
+
+
+def fast_path_result(fields):
+    """跳过模型时的结果：完整字段结构，规则未覆盖的字段为 null"""
+    return {key: fields.get(key) for key in RESULT_KEYS}
+
+
+def format_fast_fields(matches):
+    parts = [f"{field}={value} ({confidence:.2f})" for field, (value, confidence) in matches.items()]
+    return f"--- (规则) 快速提取 {len(matches)}/{len(FAST_FIELDS)} 个字段: {'; '.join(parts) or '无'} ---"
@@ -0,0 +1,215 @@
+"""
+(V26.18 新增) 异步任务：提交后立即返回任务 ID，由有界的工作线程池在后台处理
+
+长扫描件不再依赖一条持续十几分钟的 HTTP 连接：客户端 POST /jobs 拿到任务 ID，
+之后轮询 GET /jobs/<id> 查看状态、进度 (已完成批次 / 总批次) 和结果。
+- 同时运行的任务数 = workers，排队中的任务数不超过 max_queued (超出时拒绝提交)
+- 已结束的任务保留 retention_seconds 秒供客户端取回结果，之后自动清理
+(V26.21) 每个批次完成时发布一条记录，流式端点通过 Job.follow() 逐条转发给客户端
+(V26.23) 排队的任务不再先来先运行：按客户端分队列，空出的工作线程按权重在各客户端之间轮转
+(一个客户端一次提交 20 个任务，其他客户端的任务不必排在它们全部之后)
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fair_scheduler import FairScheduler
+
+
+class QueueFullError(Exception):
+    """排队中的任务数已达上限"""
+
+
+# --- 1. 单个任务 ---
+class Job:
+    """
+    (线程安全) 任务状态: queued -> running -> done / failed
+    进度以"批次"计：文本模型调用算 1 个批次，VLM 每个批次算 1 个。
+    自适应批次会在运行中改变批次大小，所以 chunks_total 在完成前是估算值；pages_total/pages_done 是准确的。
+    """
+
+    def __init__(self, name, client=None, weight=1.0):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.client = client  # (V26.23) 提交者 (IP 或客户端令牌)，任务调度按它分队列
+        self.weight = weight  # (V26.23) 该客户端的调度权重 (工作线程与上游名额)
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.pages_total = 0
+        self.pages_done = 0
+        self.chunks_planned = 0
+        self.chunks_done = 0
+        self.result = None
+        self.headers = {}  # (例如 X-Cache；同步 /extract 原样放进响应头)
+        self.error = None
+        self.exception = None
+        self.records = []  # (V26.21) 已发布的批次结果，按完成顺序
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.finished = threading.Event()
+
+    def add_work(self, pages, chunks):
+        """登记即将处理的页数和 (预计) 批次数"""
+        with self.lock:
+            self.pages_total += pages
+            self.chunks_planned += chunks
+
+    def chunk_done(self, pages, name=None, data=None):
+        """(V26.21) 传入 data 时同时发布该批次的结果"""
+        with self.changed:
+            self.pages_done += pages
+            self.chunks_done += 1
+            if data is not None:
+                self._publish(name, data)
+
+    def publish(self, name, data):
+        """发布一条不计入进度的结果 (例如整份文书命中结果缓存)"""
+        with self.changed:
+            self._publish(name, data)
+
+    def _publish(self, name, data):
+        self.records.append({"type": "chunk", "name": name, "data": data})
+        self.changed.notify_all()
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def follow(self, start=0, heartbeat=None):
+        """
+        (V26.21) 从第 start 条开始逐条产出已发布的记录，新记录发布后立即产出，任务结束后返回。
+        heartbeat 秒内没有新记录时产出 None (调用方据此发送保活数据)。
+        """
+        index = start
+        while True:
+            with self.changed:
+                if index >= len(self.records) and not self.finished.is_set():
+                    self.changed.wait(heartbeat)
+                pending = self.records[index:]
+                ended = self.finished.is_set()
+            index += len(pending)
+            if pending:
+                yield from pending
+            elif ended:
+                return
+            else:
+                yield None
+
+    def snapshot(self, include_result=True):
+        with self.lock:
+            data = {
+                "id": self.id,
+                "name": self.name,
+                "status": self.status,
+                "progress": {
+                    "chunks_done": self.chunks_done,
+                    "chunks_total": max(self.chunks_planned, self.chunks_done) if self.status != "done"
+                    else self.chunks_done,
+                    "pages_done": self.pages_done,
+                    "pages_total": self.pages_total,
+                },
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+            if self.status == "failed":
+                data["error"] = self.error
+                retry_after = getattr(self.exception, "retry_after", None)
+                if retry_after:
+                    data["retry_after"] = retry_after
+            if include_result and self.status == "done":
+                data["result"] = self.result
+                data["cache"] = self.headers.get("X-Cache")
+            return data
+
+
+# --- 2. 任务管理器 ---
+class JobManager:
+    """
+    (线程安全) 有界工作线程池 + 任务表
+    (V26.23) 每个任务提交后占一个线程等待 scheduler 名额 (workers 个)，名额按客户端公平分配；
+    线程数 = workers + max_queued，排队中的任务都能立即进入等待，不会卡在线程池自己的 FIFO 队列里
+    """
+
+    def __init__(self, workers=2, max_queued=20, retention_seconds=3600):
+        self.max_queued = max_queued
+        self.retention_seconds = retention_seconds
+        self.scheduler = FairScheduler(workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers + max_queued, thread_name_prefix="job")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, name, fn, *args, client=None, weight=1.0):
+        """
+        fn(job, *args) 在工作线程中运行，返回 (结果, 响应头)。
+        排队任务已满时抛出 QueueFullError (调用方负责清理 args 中的临时文件)。
+        (V26.23) client 相同的任务共用一个调度队列；weight 越大，该客户端分到的工作线程越多。
+        """
+        with self.lock:
+            self._purge()
+            queued = sum(1 for job in self.jobs.values() if job.status == "queued")
+            if queued >= self.max_queued:
+                raise QueueFullError(f"排队任务已达上限 ({self.max_queued})，请稍后再试")
+            job = Job(name, client=client, weight=weight)
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job, fn, args)
+        return job
+
+    def run_now(self, name, fn, *args, client=None, weight=1.0):
+        """
+        在调用线程中立即运行 fn(job, *args)，不排队、不占工作线程，返回已结束的任务 (查询、流式接收与普通任务相同)。
+        只用于毫秒级的工作，例如命中结果缓存。
+        """
+        job = Job(name, client=client, weight=weight)
+        with self.lock:
+            self._purge()
+            self.jobs[job.id] = job
+        self._execute(job, fn, args)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job, fn, args):
+        with self.scheduler.slot(job.client, job.weight):
+            self._execute(job, fn, args)
+
+    def _execute(self, job, fn, args):
+        with job.lock:
+            job.status = "running"
+            job.started_at = time.time()
+        try:
+            result, headers = fn(job, *args)
+            with job.lock:
+                job.result = result
+                job.headers = headers
+                job.status = "done"
+        except Exception as e:
+            with job.lock:
+                job.error = str(e)
+                job.exception = e
+                job.status = "failed"
+        finally:
+            with job.changed:
+                job.finished_at = time.time()
+                job.finished.set()
+                job.changed.notify_all()
+
+    def _purge(self):
+        """删除结束超过 retention_seconds 的任务 (调用方持有 self.lock)"""
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished_at and now - job.finished_at > self.retention_seconds]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def snapshot(self):
+        with self.lock:
+            counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+            for job in self.jobs.values():
+                counts[job.status] += 1
+            counts["waiting_clients"] = self.scheduler.snapshot()["waiting_queues"]  # (V26.23)
+            return counts
@@ -0,0 +1,61 @@
+"""
+(V26.12 新增) 增量 JSON 解析器
+
+模型以流式返回 JSON 时，每收到一段文本就 feed() 一次；
+顶层对象中的某个字段 (键 + 完整的值) 一结束，就立刻把 (键, 值) 交出来，
+不必等整个 JSON 生成完毕。第一个 '{' 之前的内容 (例如 Markdown 标记) 会被忽略。
+"""
+import json
+
+
+class IncrementalJSONParser:
+    """逐字符跟踪 字符串/转义/嵌套深度，在顶层的 ',' 或 '}' 处切出一个完整字段"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0  # (已扫描到的位置)
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.member_start = None  # (当前顶层字段在 buffer 中的起点)
+        self.done = False
+
+    def feed(self, text):
+        """追加一段文本，返回这段文本中新完成的顶层字段列表 [(键, 值), ...]"""
+        self.buffer += text
+        fields = []
+        while self.position < len(self.buffer) and not self.done:
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                if self.depth > 0:
+                    self.in_string = True
+            elif char == "{" or (char == "[" and self.depth > 0):
+                self.depth += 1
+                if self.depth == 1:
+                    self.member_start = self.position + 1
+            elif char in "}]" and self.depth > 0:
+                if self.depth == 1:
+                    fields.extend(self._take_member(self.position))
+                    self.done = True
+                self.depth -= 1
+            elif char == "," and self.depth == 1:
+                fields.extend(self._take_member(self.position))
+                self.member_start = self.position + 1
+            self.position += 1
+        return fields
+
+    def _take_member(self, end):
+        member = self.buffer[self.member_start:end].strip()
+        if not member:
+            return []
+        try:
+            return list(json.loads("{" + member + "}").items())
+        except json.JSONDecodeError:
+            return []  # (格式不完整的字段跳过，最终结果仍以完整 JSON 为准)
@@ -0,0 +1,101 @@
+"""
+(V26.7 新增) 页面相关性预筛选
+
+在分块之前，用 PyMuPDF 渲染低分辨率灰度缩略图，根据版面/图像统计给每页打分，
+跳过空白页、照片页、表格页 (疑似证据清单) 等与提取字段无关的页面。
+首尾若干页 (案号、法院、上诉期通常在这里) 始终保留。
+默认关闭 (VLM_PAGE_FILTER_ENABLED)：误判会静默丢掉诉讼请求、判决主文所在的中间页。
+统计以页面自身的背景灰度为基准 (灰底/泛黄纸张不会被当成照片)，贴着页面边缘的黑边 (扫描仪黑带) 不计入横线。
+"""
+import fitz  # PyMuPDF
+import numpy as np
+
+# --- 1. 常量 ---
+THUMB_WIDTH = 240  # (缩略图宽度，像素)
+INK_THRESHOLD = 160  # (白纸上灰度低于此值算"墨迹"；背景较暗时按背景灰度等比例降低)
+DARK_THRESHOLD = 60  # (灰度低于此值为深色笔画，不算中间灰阶)
+BACKGROUND_TOLERANCE = 30  # (与背景灰度 (页面中位数) 相差不超过此值的像素视为背景)
+BLANK_INK_RATIO = 0.003  # (墨迹占比低于此值视为空白页)
+PHOTO_MIDTONE_RATIO = 0.35  # (既非背景、也非深色笔画的像素占比高于此值视为照片/图片页)
+TABLE_RULE_RATIO = 0.03  # (横线行占比高于此值视为表格页)
+RULE_ROW_INK_RATIO = 0.5  # (一行中墨迹占比超过此值，视为一条横线)
+KEEP_HEAD_PAGES = 2
+KEEP_TAIL_PAGES = 2
+MIN_SCORE = 0.5  # (低于此分数的页面跳过)
+
+
+# --- 2. 单页打分 ---
+def rule_rows(ink):
+    """
+    每一行是否为横线 (布尔数组)。贴着页面边缘的墨迹不算：
+    从上/下边缘连续的整行黑带 (扫描仪黑边) 直接排除，每行从左/右边缘开始的连续墨迹也不计入。
+    """
+    height, width = ink.shape
+    # (每行从左/右边缘开始的连续墨迹长度)
+    left = np.where(ink.all(axis=1), width, np.argmin(ink, axis=1))
+    right = np.where(ink.all(axis=1), width, np.argmin(ink[:, ::-1], axis=1))
+    inner = ink.sum(axis=1) - np.minimum(left + right, width)
+    rows = inner > RULE_ROW_INK_RATIO * width
+
+    # (上/下边缘的黑带：从边缘起连续的"墨迹过半"行)
+    dark_rows = ink.mean(axis=1) > RULE_ROW_INK_RATIO
+    top = int(np.argmin(dark_rows)) if not dark_rows.all() else height
+    bottom = int(np.argmin(dark_rows[::-1])) if not dark_rows.all() else height
+    rows[:top] = False
+    rows[height - bottom:] = False
+    return rows
+
+
+def score_page(page):
+    """返回 (分数 0~1, 原因, 统计信息)"""
+    zoom = THUMB_WIDTH / max(page.rect.width, 1.0)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+
+    background = float(np.median(gray))
+    ink = gray < INK_THRESHOLD * background / 255.0
+    ink_ratio = float(ink.mean())
+    midtone_ratio = float(((gray >= DARK_THRESHOLD) & (np.abs(gray - background) > BACKGROUND_TOLERANCE)).mean())
+    rule_ratio = float(rule_rows(ink).mean())
+    stats = {"background": background, "ink": ink_ratio, "midtone": midtone_ratio, "rules": rule_ratio,
+             "images": len(page.get_image_info())}
+
+    if ink_ratio < BLANK_INK_RATIO:
+        return 0.0, "空白页", stats
+    if midtone_ratio > PHOTO_MIDTONE_RATIO:
+        return 0.2, "照片/图片页", stats
+    if rule_ratio > TABLE_RULE_RATIO:
+        return 0.3, "表格页 (疑似证据清单)", stats
+    return 1.0, "正文页", stats
+
+
+# --- 3. 整份文档筛选 ---
+def select_relevant_pages(session, page_indices=None, min_score=MIN_SCORE):
+    """
+    返回 (要发送的页码列表, 报告列表)。报告中每项为 (页码, 分数, 原因, 是否发送)。
+    page_indices 为 None 时筛选全部页面。
+    (V26.14) session 为 DocumentSession，复用已打开的文档。
+    """
+    if page_indices is None:
+        page_indices = list(range(session.page_count))
+    keep_always = set(page_indices[:KEEP_HEAD_PAGES]) | set(page_indices[-KEEP_TAIL_PAGES:])
+
+    selected, report = [], []
+    for i in page_indices:
+        with session.lock:
+            score, reason, _ = score_page(session.doc.load_page(i))
+        send = i in keep_always or score >= min_score
+        if send:
+            selected.append(i)
+        report.append((i, score, reason if i not in keep_always else f"{reason} (首尾页保留)", send))
+    return selected, report
+
+
+def print_filter_report(report, total_pages):
+    """打印每份文档的 发送/跳过 报告，便于核对召回率"""
+    sent = [i + 1 for i, _, _, send in report if send]
+    skipped = [(i + 1, score, reason) for i, score, reason, send in report if not send]
+    print(f"--- (筛选) 共 {total_pages} 页：发送 {len(sent)} 页，跳过 {len(skipped)} 页 ---")
+    print(f"--- (筛选) 发送页码: {sent} ---")
+    for page_no, score, reason in skipped:
+        print(f"--- (筛选) 跳过第 {page_no} 页: {reason} (分数 {score:.1f}) ---")
@@ -3,6 +3,7 @@ import os
 import sys
 from pathlib import Path
 import threading
+import time
 import tkinter as tk
 from tkinter import filedialog, scrolledtext, messagebox, PanedWindow
 import requests  # (新) 客户端只使用 requests
@@ -11,6 +12,15 @@ import requests  # (新) 客户端只使用 requests
 # 【【【重要】】】
 # 您必须将 '127.0.0.1' 替换为您运行 `backend_server.py` 那台服务器的【真实内网 IP】
 BACKEND_SERVER_URL = "http://127.0.0.1:5000/extract"
+BACKEND_JOBS_URL = BACKEND_SERVER_URL.rsplit("/", 1)[0] + "/jobs"  # (V26.18 新增) 异步任务 API
+UPLOAD_TIMEOUT = 120  # (V26.18 新增) 上传并提交任务的超时 (秒)；提取本身不再占用这条连接
+STREAM_READ_TIMEOUT = 60  # (V26.21 新增) 流式接收时多久收不到任何数据视为断线 (服务器每 15 秒发送保活空行)
+STREAM_MAX_RECONNECTS = 5  # (V26.21 新增) 断线后最多重连几次 (从已收到的位置续传)
+STREAM_RECONNECT_DELAY = 3  # (V26.21 新增) 重连前等待的秒数
+SUBMIT_MAX_RETRIES = 8  # (V26.23 新增) 服务器繁忙 (429 / 503) 时最多重新提交几次
+SUBMIT_MAX_WAIT = 600  # (V26.23 新增) 单次等待的上限 (秒)，即使服务器估算的等待时间更长
+SUBMIT_DEFAULT_WAIT = 30  # (V26.23 新增) 服务器没有给出 Retry-After 时的等待秒数
+CLIENT_ID = os.getenv("PANJUESHU_CLIENT_ID", "")  # (V26.23 新增) 可选的客户端令牌；不设置时服务器按 IP 区分
 
 
 # --- (已删除) ---
@@ -209,6 +219,66 @@ class App:
     def reset_button(self):
         self.run_btn.config(state="normal", text="2. 开始提取 (文本型或扫描型)")
 
+    def stream_job(self, job_id):
+        """
+        (V26.21 新增) 以 NDJSON 流式接收任务结果：每个批次一完成就交给 display_results 显示。
+        断线后带上已收到的条数重连，服务器从断点继续发送。返回最后一条 done / error 记录。
+        """
+        stream_url = f"{BACKEND_JOBS_URL}/{job_id}/stream"
+        received = 0
+        reconnects = 0
+        while True:
+            try:
+                with requests.get(stream_url, params={"after": received}, stream=True,
+                                  timeout=(UPLOAD_TIMEOUT, STREAM_READ_TIMEOUT)) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line:
+                            continue  # (保活空行)
+                        record = json.loads(line)
+                        if record["type"] != "chunk":
+                            return record
+                        received += 1
+                        # (新) 线程安全地调用 GUI 更新
+                        self.root.after(0, self.display_results, record["data"], record["name"])
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                reconnects += 1
+                if reconnects > STREAM_MAX_RECONNECTS:
+                    raise
+                print(f"--- (流式) 连接中断: {e}；{STREAM_RECONNECT_DELAY} 秒后第 {reconnects} 次重连 ---")
+                time.sleep(STREAM_RECONNECT_DELAY)
+
+    def submit_job(self, file_path):
+        """
+        (V26.23 新增) 上传文件并提交任务，返回任务 ID。
+        服务器繁忙时 (429 排队页数已满 / 503 任务队列已满) 按 Retry-After 给出的预计等待时间等待后重新上传。
+        """
+        headers = {"X-Client-Id": CLIENT_ID} if CLIENT_ID else {}
+        for attempt in range(SUBMIT_MAX_RETRIES + 1):
+            with open(file_path, 'rb') as f:
+                files_payload = {'file': (Path(file_path).name, f, 'application/pdf')}
+                print(f"--- 正在上传文件到: {BACKEND_JOBS_URL} ---")
+                response = requests.post(BACKEND_JOBS_URL, files=files_payload, headers=headers,
+                                         timeout=UPLOAD_TIMEOUT)
+            if response.status_code not in (429, 503) or attempt == SUBMIT_MAX_RETRIES:
+                break
+            try:
+                wait = min(int(response.headers.get("Retry-After", SUBMIT_DEFAULT_WAIT)), SUBMIT_MAX_WAIT)
+            except ValueError:
+                wait = SUBMIT_DEFAULT_WAIT
+            try:
+                reason = response.json().get("error", "")
+            except ValueError:
+                reason = response.text
+            print(f"--- (服务器繁忙) {reason}")
+            print(f"--- 预计等待 {wait} 秒后重新提交 (第 {attempt + 1}/{SUBMIT_MAX_RETRIES} 次) ---")
+            time.sleep(wait)
+        response.raise_for_status()
+        job = response.json()
+        if job.get("coalesced"):
+            print("--- (合并) 服务器上有相同文件正在处理，本次直接共用其结果 ---")
+        return job["id"]
+
     # --- 5. (重大修改) 核心逻辑 (现在只负责“发送”) ---
     def run_extraction_logic(self):
         """
@@ -219,28 +289,23 @@ class App:
             INPUT_FILE_PATH = self.filepath
             print(f"--- 正在打开文件: {Path(INPUT_FILE_PATH).name} ---")
 
-            with open(INPUT_FILE_PATH, 'rb') as f:
-                files_payload = {'file': (Path(INPUT_FILE_PATH).name, f, 'application/pdf')}
-                print(f"--- 正在上传文件到: {BACKEND_SERVER_URL} ---")
-
-                # (VLM 可能需要非常久, 15分钟超时)
-                response = requests.post(BACKEND_SERVER_URL, files=files_payload, timeout=900)
-
-                response.raise_for_status()
-
-                # (新) 服务器现在【总是】返回一个列表
-                results_list = response.json()
+            # (V26.18) 提交任务后立即返回任务 ID，不再为一个长扫描件保持 15 分钟的连接
+            # (V26.23) 服务器繁忙时按其估算的时间等待并自动重试
+            job_id = self.submit_job(INPUT_FILE_PATH)
 
-            print(f"\n--- 后端服务器成功返回 {len(results_list)} 个结果 ---")
+            print(f"--- (任务) 已提交，任务 ID: {job_id}，等待各批次结果... ---")
 
-            # (新) 循环打印所有结果
-            for i, result_data in enumerate(results_list):
-                chunk_name = ""
-                if len(results_list) > 1:
-                    chunk_name = f"(批次 {i + 1}/{len(results_list)})"
+            # (V26.21) 各批次结果按完成顺序逐条到达并立即显示，不再等全部完成
+            final = self.stream_job(job_id)
+            if final["type"] == "error":
+                print(f"【服务器处理错误】: {final.get('error', '未知错误')}")
+                if final.get("retry_after"):
+                    print(f"         上游服务暂不可用，请约 {int(final['retry_after'])} 秒后重试。\n")
+                return
 
-                # (新) 线程安全地调用 GUI 更新
-                self.root.after(0, self.display_results, result_data, chunk_name)
+            print(f"\n--- 后端服务器成功返回 {final['count']} 个结果 ---")
+            if final.get("cache"):
+                print(f"--- 服务器缓存: {final['cache']} ---")  # (V26.16 新增) HIT-memory / HIT-disk / MISS
 
             print("\n【任务结束】")
 
@@ -258,7 +323,7 @@ class App:
             except:
                 print(f"         原始响应: {e.response.text}\n")
         except requests.exceptions.Timeout:
-            print("【客户端错误】: 请求超时（超过 15 分钟）。")
+            print("【客户端错误】: 请求超时（上传或查询任务状态时服务器无响应）。")
         except Exception as e:
             print(f"【未捕获的客户端错误】: {e}\n")
 
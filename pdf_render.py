@@ -0,0 +1,244 @@
+"""
+(V26 新增) PDF 页面栅格化工具
+
+server.py 与 court_documents_extraction_withQWEN.py 共用此模块。
+进程池中的工作函数必须放在可导入的模块里 (Windows 使用 spawn 启动子进程)。
+(V26.14) 主进程一侧统一通过 DocumentSession 访问文档，不再重复打开 PDF。
+"""
+import base64
+import io
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image
+
+from pdf_session import open_document
+
+# --- 1. 常量 ---
+RENDER_ZOOM = 2  # (与 V22 的 fitz.Matrix(2, 2) 保持一致)
+MIN_PAGES_FOR_POOL = 4  # (页数太少时，进程池的调度开销大于收益，直接串行)
+RENDER_BATCH_PAGES = 3  # (V26.3) 每个子进程任务渲染的页数，越小则首批结果越早产出
+PAGE_TEXT_MIN_CHARS = 30  # (V26.8) 文字层少于此字符数且含图像的页，视为扫描页
+
+# (V26.2 新增) 页面预处理参数
+MIN_RENDER_ZOOM = 1.0  # (再低，小号字就糊了)
+MAX_RENDER_ZOOM = 2.0
+GRAY_CHANNEL_TOLERANCE = 24  # (RGB 三通道差值不超过此值，视为"无色"像素)
+GRAY_MAX_COLOR_RATIO = 0.002  # (彩色像素占比低于此值，整页按灰度处理)
+INK_THRESHOLD = 200  # (亮度低于此值算"有墨迹")
+INK_MIN_RATIO = 0.002  # (一行/一列墨迹占比低于此值，视为扫描噪点)
+MARGIN_PADDING = 16  # (裁边后保留的留白像素)
+COMPARE_LEGACY_JPEG = False  # (日志对照，仅调试用) 每页再按 V22 方式 (固定 2 倍 RGB) 渲染编码一次，统计实际节省的上传字节；开启后渲染耗时约翻倍
+
+_POOL = None
+_POOL_WORKERS = 0
+_POOL_LOCK = threading.Lock()
+
+
+# --- 2. (V26.2 新增) 页面预处理：自适应分辨率 + 灰度 + 裁边 ---
+def pick_render_zoom(page_rect, pixel_budget):
+    """根据页面物理尺寸 (pt) 和目标像素预算选择缩放倍数"""
+    area = max(page_rect.width * page_rect.height, 1.0)
+    zoom = (pixel_budget / area) ** 0.5
+    return min(max(zoom, MIN_RENDER_ZOOM), MAX_RENDER_ZOOM)
+
+
+def find_content_box(samples):
+    """(向量化) 用行/列的墨迹统计找出内容区域，返回 (top, bottom, left, right)；空白页返回 None"""
+    height, width = samples.shape[:2]
+    ink = samples.min(axis=2) < INK_THRESHOLD
+    rows = np.flatnonzero(ink.sum(axis=1) > max(1, width * INK_MIN_RATIO))
+    cols = np.flatnonzero(ink.sum(axis=0) > max(1, height * INK_MIN_RATIO))
+    if rows.size == 0 or cols.size == 0:
+        return None
+    return (max(rows[0] - MARGIN_PADDING, 0), min(rows[-1] + 1 + MARGIN_PADDING, height),
+            max(cols[0] - MARGIN_PADDING, 0), min(cols[-1] + 1 + MARGIN_PADDING, width))
+
+
+def is_monochrome(samples):
+    """(向量化) 抽样判断页面是否为黑白/灰度页"""
+    sub = samples[::4, ::4].astype(np.int16)
+    spread = sub.max(axis=2) - sub.min(axis=2)
+    return (spread > GRAY_CHANNEL_TOLERANCE).mean() < GRAY_MAX_COLOR_RATIO
+
+
+def prepare_page(page, quality, pixel_budget):
+    """渲染并预处理单页，返回 (JPEG bytes, 统计信息)"""
+    zoom = pick_render_zoom(page.rect, pixel_budget)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    samples = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+    mono = is_monochrome(samples)
+    box = find_content_box(samples)
+    if box:
+        top, bottom, left, right = box
+        samples = samples[top:bottom, left:right]
+
+    pil_image = Image.fromarray(samples)
+    if mono:
+        pil_image = pil_image.convert("L")
+    buffer = io.BytesIO()
+    pil_image.save(buffer, "JPEG", quality=quality)
+    jpeg_bytes = buffer.getvalue()
+
+    # (对照) V22 固定 2 倍 RGB 渲染的像素缓冲字节数；上传字节以实际编码的 JPEG 对比
+    legacy_raw = int(page.rect.width * RENDER_ZOOM) * int(page.rect.height * RENDER_ZOOM) * 3
+    stats = {
+        "zoom": zoom,
+        "mono": mono,
+        "size": pil_image.size,
+        "raw_bytes": pil_image.width * pil_image.height * (1 if mono else 3),
+        "legacy_raw_bytes": legacy_raw,
+        "jpeg_bytes": len(jpeg_bytes),
+        "legacy_jpeg_bytes": len(_render_page(page, quality)[0]) if COMPARE_LEGACY_JPEG else None,
+    }
+    return jpeg_bytes, stats
+
+
+# --- 3. 工作函数：每个进程自己打开 PDF，只渲染自己负责的页码 ---
+# (V26.1) 直接在内存中编码 JPEG，返回 bytes，不再写临时文件
+def _render_page(page, quality, pixel_budget=None):
+    if pixel_budget:
+        return prepare_page(page, quality, pixel_budget)
+    pix = page.get_pixmap(matrix=fitz.Matrix(RENDER_ZOOM, RENDER_ZOOM))
+    pil_image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    buffer = io.BytesIO()
+    pil_image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue(), None
+
+
+def _iter_pages(source, page_indices, quality, pixel_budget=None):
+    doc = open_document(source)  # (V26.20) 文件路径或内存中的 PDF 字节
+    try:
+        for i in page_indices:
+            yield _render_page(doc.load_page(i), quality, pixel_budget)
+    finally:
+        doc.close()
+
+
+def _iter_session_pages(session, page_indices, quality, pixel_budget=None):
+    """(V26.14) 串行渲染：直接使用会话中已打开的文档"""
+    for i in page_indices:
+        with session.lock:
+            result = _render_page(session.doc.load_page(i), quality, pixel_budget)
+        yield result
+
+
+def _render_pages(source, page_indices, quality, pixel_budget=None):
+    return list(_iter_pages(source, page_indices, quality, pixel_budget))
+
+
+def _saving(legacy, current):
+    """返回 "节省 X KB (Y%)" 描述"""
+    ratio = (legacy - current) / legacy * 100 if legacy else 0
+    return f"节省 {(legacy - current) / 1024:.0f} KB ({ratio:.0f}%)"
+
+
+def _log_page_stats(index, stats):
+    mode = "灰度" if stats["mono"] else "彩色"
+    width, height = stats["size"]
+    upload = f"上传 JPEG {stats['jpeg_bytes'] / 1024:.0f} KB"
+    if stats["legacy_jpeg_bytes"]:
+        upload += f" (V22 方式 {stats['legacy_jpeg_bytes'] / 1024:.0f} KB，" \
+                  f"{_saving(stats['legacy_jpeg_bytes'], stats['jpeg_bytes'])})"
+    print(f"--- (预处理) 第 {index + 1} 页: 缩放 {stats['zoom']:.2f}x, {mode}, {width}x{height}, {upload}, "
+          f"像素缓冲{_saving(stats['legacy_raw_bytes'], stats['raw_bytes'])} ---")
+
+
+def _get_pool(workers):
+    """(进程池复用) 懒加载一个全局进程池，避免每个请求都重新启动子进程"""
+    global _POOL, _POOL_WORKERS
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_WORKERS != workers:
+            if _POOL is not None:
+                _POOL.shutdown(wait=False)
+            _POOL = ProcessPoolExecutor(max_workers=workers)
+            _POOL_WORKERS = workers
+        return _POOL
+
+
+# --- 4. 主入口 ---
+def iter_rendered_pages(session, quality, workers=1, pixel_budget=None, batch_pages=RENDER_BATCH_PAGES,
+                        page_indices=None):
+    """
+    (V26.3 新增) 逐页产出内存中的 JPEG bytes，【严格按页码顺序】。
+    渲染完一页 (或一小批) 就立刻交给调用方，不必等整份 PDF 渲染完毕。
+    workers <= 1 或页数很少时，在当前线程串行渲染。
+    (V26.2) 传入 pixel_budget 时启用页面预处理 (自适应分辨率/灰度/裁边)。
+    (V26.7) 传入 page_indices 时只渲染这些页 (例如预筛选后保留的页)。
+    (V26.14) session 为 DocumentSession：串行时复用其已打开的文档，多进程时子进程按 session.file_path 打开。
+    (V26.20) 内存上传的会话没有文件路径，子进程改为接收 PDF 字节 (只有小于落盘阈值的上传才会在内存中)。
+    """
+    if page_indices is None:
+        page_indices = list(range(session.page_count))
+
+    if workers <= 1 or len(page_indices) < MIN_PAGES_FOR_POOL:
+        results = _iter_session_pages(session, page_indices, quality, pixel_budget)
+    else:
+        print(f"--- (眼睛) 使用 {workers} 个进程并行渲染 {len(page_indices)} 页 ---")
+        results = _iter_pool_results(session.source, page_indices, quality, workers, pixel_budget, batch_pages)
+
+    # (子进程的 print 不会出现在 GUI/服务器日志里，统一在主进程打印)
+    totals = {"jpeg_bytes": 0, "legacy_jpeg_bytes": 0, "raw_bytes": 0, "legacy_raw_bytes": 0}
+    for i, (jpeg_bytes, stats) in zip(page_indices, results):
+        if stats:
+            _log_page_stats(i, stats)
+            for key in totals:
+                totals[key] += stats[key] or 0
+        yield jpeg_bytes
+    if pixel_budget and page_indices:
+        upload = f"上传 JPEG 共 {totals['jpeg_bytes'] / 1024 / 1024:.1f} MB"
+        if totals["legacy_jpeg_bytes"]:
+            upload += f"，{_saving(totals['legacy_jpeg_bytes'], totals['jpeg_bytes'])}"
+        print(f"--- (预处理) {upload}；像素缓冲{_saving(totals['legacy_raw_bytes'], totals['raw_bytes'])} ---")
+
+
+def _iter_pool_results(source, page_indices, quality, workers, pixel_budget, batch_pages):
+    """按小批次提交到进程池，滑动窗口限制在途任务数，按提交顺序产出"""
+    pool = _get_pool(workers)
+    batches = iter([page_indices[start:start + batch_pages] for start in range(0, len(page_indices), batch_pages)])
+    pending = deque()
+
+    def submit_next():
+        batch_indices = next(batches, None)
+        if batch_indices:
+            pending.append(pool.submit(_render_pages, source, batch_indices, quality, pixel_budget))
+
+    for _ in range(workers * 2):
+        submit_next()
+    try:
+        while pending:
+            # (关键) 总是等待最早提交的任务，保证输出页码顺序固定
+            batch = pending.popleft().result()
+            submit_next()
+            yield from batch
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+# --- 5. (V26.1 新增) 内联图像载荷 ---
+def jpeg_to_data_uri(jpeg_bytes):
+    """将 JPEG bytes 转为 base64 Data URI，可直接作为 VLM 的 {"image": ...} 传入"""
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg_bytes).decode("ascii")
+
+
+# --- 6. (V26.8 新增) 逐页分类：文本页 / 扫描页 ---
+def classify_pages(session, min_chars=PAGE_TEXT_MIN_CHARS):
+    """
+    文字层少于 min_chars 且含图像的页 -> 扫描页；其余页 -> 文本页 (保留其文本)。
+    返回 (文本页 {页码: 文本}, 扫描页页码列表)，页码从 0 开始。
+    (V26.14) 逐页文本缓存在 session 中，后续步骤不再重新解析。
+    (V26.15) 没有字体资源的页 (典型的扫描页) 直接视为无文字，跳过文本解析。
+    """
+    text_pages, scanned_pages = {}, []
+    for i in range(session.page_count):
+        text = session.page_text(i) if session.page_has_fonts(i) else ""
+        if len(text.strip()) < min_chars and session.page_has_images(i):
+            scanned_pages.append(i)
+        else:
+            text_pages[i] = text
+    return text_pages, scanned_pages
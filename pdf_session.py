@@ -0,0 +1,91 @@
+"""
+(V26.14 新增) 文档会话：一次请求只打开一次 PDF
+
+server.py 与 court_documents_extraction_withQWEN.py 共用此模块。
+检测、文本提取、页面筛选、(串行) 渲染都通过同一个 DocumentSession 访问文档；
+逐页文本和图像信息在第一次用到时解析并缓存，之后不再重复解析。
+(多进程渲染时，子进程仍需按 source 自己打开 PDF：fitz.Document 不能跨进程传递)
+(V26.20) source 可以是文件路径，也可以是内存中的 PDF 字节 (PyMuPDF stream 模式，不落盘)
+"""
+import hashlib
+import threading
+
+import fitz  # PyMuPDF
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def open_document(source):
+    """source 为 PDF 字节时用 stream 模式打开，否则按文件路径打开"""
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+class DocumentSession:
+    """
+    (线程安全) fitz.Document 本身不是线程安全的，所有访问都经过 self.lock。
+    用法: with DocumentSession(path) as session: ...
+    (V26.20) 或 DocumentSession(pdf_bytes, name="上传文件名")；此时 file_path 为 None
+    (V26.17) digest 为内容的 SHA-256 (上传时已算好)；不传时在第一次用到时计算
+    """
+
+    def __init__(self, source, name=None, digest=None):
+        self.source = source
+        self.file_path = None if isinstance(source, (bytes, bytearray)) else source
+        self.name = name or self.file_path or "(内存中的 PDF)"
+        self.doc = open_document(source)
+        self.lock = threading.RLock()
+        self._texts = {}
+        self._has_images = {}
+        self._has_fonts = {}
+        self._digest = digest
+
+    @property
+    def page_count(self):
+        return self.doc.page_count
+
+    @property
+    def digest(self):
+        with self.lock:
+            if self._digest is None:
+                hasher = hashlib.sha256()
+                if self.file_path is None:
+                    hasher.update(self.source)
+                else:
+                    with open(self.file_path, "rb") as f:
+                        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                            hasher.update(block)
+                self._digest = hasher.hexdigest()
+            return self._digest
+
+    def page_text(self, index):
+        """第 index 页的文字层 (首次访问时解析，之后走缓存)"""
+        with self.lock:
+            if index not in self._texts:
+                self._texts[index] = self.doc.load_page(index).get_text()
+            return self._texts[index]
+
+    def page_has_images(self, index):
+        with self.lock:
+            if index not in self._has_images:
+                self._has_images[index] = bool(self.doc.load_page(index).get_images())
+            return self._has_images[index]
+
+    def page_has_fonts(self, index):
+        """(V26.15) 只读字体资源，不解析内容流；没有字体的页不可能有文字层"""
+        with self.lock:
+            if index not in self._has_fonts:
+                self._has_fonts[index] = bool(self.doc.load_page(index).get_fonts())
+            return self._has_fonts[index]
+
+    def close(self):
+        with self.lock:
+            if not self.doc.is_closed:
+                self.doc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
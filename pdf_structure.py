@@ -0,0 +1,63 @@
+"""
+(V26.15 新增) 结构化 PDF 类型检测：不做全文文本提取
+
+只看页面的结构信息：字体资源、内容流中是否有文本操作符 (BT ... ET)、图像覆盖页面的比例。
+检查前几页就给出结论 (提前退出)，并附带置信度；置信度不足时由调用方退回逐页分类。
+"""
+import re
+
+# --- 1. 常量 ---
+SAMPLE_PAGES = 3  # (只检查前 3 页)
+SCAN_MIN_COVERAGE = 0.5  # (图像覆盖页面面积的比例超过此值，且没有文本操作符，视为扫描页)
+SCAN_FULL_COVERAGE = 0.9  # (覆盖率达到此值时，扫描页判断的把握为 100%)
+
+_TEXT_OPERATOR = re.compile(rb"\bBT\b")
+
+
+# --- 2. 单页结构 ---
+def inspect_page(page):
+    """返回单页结构信息：是否有文本操作符、字体数、图像覆盖率"""
+    page_area = max(page.rect.width * page.rect.height, 1.0)
+    covered = 0.0
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        covered += max(x1 - x0, 0) * max(y1 - y0, 0)
+    return {
+        "text_ops": bool(_TEXT_OPERATOR.search(page.read_contents())),
+        "fonts": len(page.get_fonts()),
+        "image_coverage": min(covered / page_area, 1.0),
+    }
+
+
+def page_kind(structure):
+    """返回 (类型, 把握 0~1)，类型为 "text" / "scanned" / "blank" """
+    if structure["text_ops"] and structure["fonts"]:
+        return "text", 1.0
+    if structure["image_coverage"] >= SCAN_MIN_COVERAGE:
+        return "scanned", min(structure["image_coverage"] / SCAN_FULL_COVERAGE, 1.0)
+    if structure["text_ops"]:
+        return "text", 0.5  # (有文本操作符却没有字体资源：少见，把握减半)
+    return "blank", 1.0
+
+
+# --- 3. 整份文档 ---
+def detect_structure(session, sample_pages=SAMPLE_PAGES):
+    """
+    检查前 sample_pages 页 (提前退出)，返回 (类型, 置信度, 检查过的页面 {页码: 类型})。
+    类型为 "TEXT_PDF" / "SCANNED_PDF"；抽样页类型不一致或全是空白页时为 None，置信度为 0。
+    """
+    kinds = {}
+    certainties = []
+    for i in range(min(sample_pages, session.page_count)):
+        with session.lock:
+            kind, certainty = page_kind(inspect_page(session.doc.load_page(i)))
+        kinds[i] = kind
+        if kind != "blank":
+            certainties.append((kind, certainty))
+
+    distinct = {kind for kind, _ in certainties}
+    if len(distinct) != 1:
+        return None, 0.0, kinds
+    verdict = "TEXT_PDF" if distinct == {"text"} else "SCANNED_PDF"
+    confidence = sum(certainty for _, certainty in certainties) / len(certainties)
+    return verdict, confidence, kinds
@@ -0,0 +1,102 @@
+"""
+(V26.11 新增) 前缀缓存友好的 Prompt 布局 + Prompt 体积/缓存命中统计
+
+server.py 与 court_documents_extraction_withQWEN.py 共用此模块。
+静态的 SYSTEM_PROMPT (规则 + 黄金范例) 在文本路径和 VLM 路径上都放在消息的最前面，
+且逐字节不变；可变内容 (文书原文、图像) 一律放在其后。
+这样上游的上下文缓存 (前缀缓存) 才能在重复调用之间命中。
+"""
+import hashlib
+import json
+import threading
+
+
+# --- 1. Prompt 版本 ---
+def prompt_version(*parts):
+    """静态 Prompt 的内容哈希 (12 位)。任何一个字节变化，版本号都会变化"""
+    digest = hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+    return digest[:12]
+
+
+# --- 2. 消息体积 ---
+def measure_messages(messages):
+    """返回 (文本字节数, 图像载荷字节数)。图像以 Data URI 内联，单独统计"""
+    text_bytes = image_bytes = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            text_bytes += len(content.encode("utf-8"))
+            continue
+        for item in content:
+            if "image" in item:
+                image_bytes += len(item["image"])
+            elif item.get("type") == "image_url":  # (V26.19) OpenAI 兼容模式的图像消息
+                image_bytes += len(item["image_url"]["url"])
+            else:
+                text_bytes += len(json.dumps(item, ensure_ascii=False).encode("utf-8"))
+    return text_bytes, image_bytes
+
+
+# --- 3. 用量解析 (兼容 OpenAI 兼容模式与 DashScope 原生 SDK) ---
+def _field(obj, name):
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    try:
+        return getattr(obj, name, None)
+    except KeyError:  # (DashScope 的响应对象在缺少属性时抛 KeyError)
+        return None
+
+
+def read_usage(usage):
+    """返回 (输入 token 数, 缓存命中 token 数)；上游未报告时为 0"""
+    input_tokens = _field(usage, "prompt_tokens") or _field(usage, "input_tokens") or 0
+    cached_tokens = 0
+    for details_name in ("prompt_tokens_details", "input_tokens_details"):
+        cached_tokens = cached_tokens or _field(_field(usage, details_name), "cached_tokens") or 0
+    return input_tokens, cached_tokens
+
+
+# --- 4. 累计统计 ---
+class PromptStats:
+    """(线程安全) 按调用点累计 Prompt 字节数、输入 token 数和缓存命中 token 数"""
+
+    def __init__(self, name, version, static_prefix):
+        self.name = name
+        self.version = version
+        self.static_bytes = len(static_prefix.encode("utf-8"))
+        self.calls = 0
+        self.text_bytes = 0
+        self.image_bytes = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.lock = threading.Lock()
+
+    def record(self, messages, usage):
+        """记录一次成功调用，返回本次的日志行"""
+        text_bytes, image_bytes = measure_messages(messages)
+        input_tokens, cached_tokens = read_usage(usage)
+        with self.lock:
+            self.calls += 1
+            self.text_bytes += text_bytes
+            self.image_bytes += image_bytes
+            self.input_tokens += input_tokens
+            self.cached_tokens += cached_tokens
+        return (f"--- (Prompt) {self.name} v{self.version}: 静态前缀 {self.static_bytes / 1024:.1f} KB, "
+                f"本次文本 {text_bytes / 1024:.1f} KB, 图像 {image_bytes / 1024:.0f} KB, "
+                f"输入 {input_tokens} token, 缓存命中 {cached_tokens} token ---")
+
+    def snapshot(self):
+        with self.lock:
+            hit_ratio = self.cached_tokens / self.input_tokens if self.input_tokens else 0.0
+            return {
+                "version": self.version,
+                "static_prefix_bytes": self.static_bytes,
+                "calls": self.calls,
+                "text_bytes": self.text_bytes,
+                "image_bytes": self.image_bytes,
+                "input_tokens": self.input_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cache_hit_ratio": round(hit_ratio, 3),
+            }
@@ -0,0 +1,239 @@
+"""
+(V26.4 新增) 上游模型调用的流量控制工具
+
+server.py 与 court_documents_extraction_withQWEN.py 共用此模块。
+(V26.5) 新增指数退避重试策略与全进程共享的熔断器。
+(V26.19) 令牌桶与重试入口增加 asyncio 版本，供 async_server.py 使用。
+"""
+import asyncio
+import random
+import threading
+import time
+
+# --- 0. 常量 ---
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+# --- 1. 令牌桶限流器 ---
+class TokenBucket:
+    """
+    (线程安全) 令牌桶：每分钟补充 rate_per_minute 个令牌，最多积攒 burst 个。
+    每次调用上游 API 之前 acquire() 一个令牌，令牌不足时阻塞等待。
+    应在进程内共享同一个实例，才能让所有并发请求合计不超过账号配额。
+    """
+
+    def __init__(self, rate_per_minute, burst=1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _take(self):
+        """有令牌时取走一个并返回 0，否则返回还需等待的秒数"""
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """取走一个令牌，返回为此等待的秒数"""
+        waited = 0.0
+        while True:
+            wait = self._take()
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self):
+        """(V26.19) acquire() 的 asyncio 版本：等待期间不占用线程"""
+        waited = 0.0
+        while True:
+            wait = self._take()
+            if not wait:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+
+# --- 2. (V26.5 新增) 上游错误类型 ---
+class UpstreamError(Exception):
+    """上游返回了非 200 响应 (例如 DashScope 的 response.status_code != 200)"""
+
+    def __init__(self, message, status_code=None, code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态：上游不健康，直接快速失败"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_retryable(error):
+    """网络/超时/限流/5xx 可重试；4xx 参数错误、熔断等不可重试"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if str(getattr(error, "code", "") or "").startswith("Throttling"):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        return True  # (没有状态码：连接断开、超时、SDK 内部异常)
+    return status_code in RETRYABLE_STATUS_CODES
+
+
+def get_retry_after(error):
+    """读取 retry-after 提示 (秒)：优先读异常自带的值，其次读 HTTP 响应头"""
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if headers:
+            if headers.get("retry-after-ms"):
+                value = float(headers.get("retry-after-ms")) / 1000
+            else:
+                value = headers.get("retry-after")
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except (TypeError, ValueError):
+        return None  # (HTTP 日期格式的 retry-after 不解析，回退到指数退避)
+
+
+# --- 3. (V26.5 新增) 指数退避 + 全抖动 ---
+class RetryPolicy:
+    """第 n 次失败后等待 uniform(0, min(max_delay, base_delay * 2^n)) 秒；上游给出 retry-after 时至少等待该时长"""
+
+    def __init__(self, max_attempts=3, base_delay=2.0, max_delay=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+# --- 4. (V26.5 新增) 熔断器 ---
+class CircuitBreaker:
+    """
+    (线程安全) 连续 failure_threshold 次可重试失败后"打开"，reset_timeout 秒内所有调用快速失败；
+    超时后进入"半开"状态，只放行一个试探请求：成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(
+                        f"上游 {self.name} 暂不可用 (熔断中，约 {remaining:.0f} 秒后重试)", retry_after=remaining)
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self.trial_in_flight:
+                    raise CircuitOpenError(f"上游 {self.name} 暂不可用 (正在试探恢复)", retry_after=self.reset_timeout)
+                self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                print(f"--- (熔断) {self.name} 已恢复，熔断器关闭 ---")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"【熔断】: {self.name} 连续失败 {self.failures} 次，{self.reset_timeout:.0f} 秒内快速失败")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+# --- 5. (V26.5 新增) 统一的重试入口 ---
+def call_with_retry(func, policy, breaker=None, name="", before_attempt=None):
+    """
+    调用 func()，按 policy 重试可重试的异常，最终失败时抛出最后一次的异常。
+    breaker 打开时抛出 CircuitOpenError；before_attempt(attempt) 在每次尝试前调用 (例如限流、打印日志)。
+    """
+    for attempt in range(policy.max_attempts):
+        if breaker:
+            breaker.before_call()
+        if before_attempt:
+            before_attempt(attempt)
+        try:
+            result = func()
+        except Exception as e:
+            delay = _record_failure(e, attempt, policy, breaker, name)
+            if delay is None:
+                raise
+            time.sleep(delay)
+        else:
+            if breaker:
+                breaker.record_success()
+            return result
+
+
+async def call_with_retry_async(func, policy, breaker=None, name="", before_attempt=None):
+    """(V26.19) call_with_retry 的 asyncio 版本：func() 与 before_attempt(attempt) 都是协程函数"""
+    for attempt in range(policy.max_attempts):
+        if breaker:
+            breaker.before_call()
+        if before_attempt:
+            await before_attempt(attempt)
+        try:
+            result = await func()
+        except Exception as e:
+            delay = _record_failure(e, attempt, policy, breaker, name)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+        else:
+            if breaker:
+                breaker.record_success()
+            return result
+
+
+def _record_failure(error, attempt, policy, breaker, name):
+    """记录一次失败 (熔断计数)；不应再重试时返回 None，否则返回退避秒数"""
+    retryable = is_retryable(error)
+    if breaker and retryable:
+        breaker.record_failure()
+    elif breaker:
+        breaker.record_success()  # (4xx 说明上游能正常响应，不计入熔断)
+    if not retryable or attempt == policy.max_attempts - 1:
+        return None
+    delay = policy.backoff(attempt, get_retry_after(error))
+    print(f"--- (重试) {name} 第 {attempt + 1}/{policy.max_attempts} 次失败: {error}；{delay:.1f} 秒后重试 ---")
+    return delay
@@ -0,0 +1,187 @@
+"""
+(V26.16 新增) 内容寻址的结果缓存：内存 LRU + 磁盘持久化
+(V26.17) 同一个 TieredCache 也用于 VLM 批次级缓存 (键为批次内各页图像的哈希)
+
+同一份判决书常被不同同事多次上传。缓存键由上传内容的 SHA-256、模型名称和 Prompt 版本组成，
+任何一个变化都会得到新的键，不需要手动失效。
+- 内存层：OrderedDict 实现的 LRU，按条目数淘汰
+- 磁盘层：每个键一个 JSON 文件，按总字节数淘汰 (最久未访问的先删)；
+  启动时扫描一次目录，之后增量记录各文件的大小和访问顺序，写入时不再遍历整个目录
+- 两层共用同一个 TTL，过期条目视为未命中并删除
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+# --- 1. 缓存键 ---
+def blobs_digest(blobs):
+    """(V26.17) 多段内容 (例如一个批次中各页的图像) 合并成一个 SHA-256"""
+    digest = hashlib.sha256()
+    for blob in blobs:
+        digest.update(blob if isinstance(blob, bytes) else blob.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def content_key(content_digest, *parts):
+    """内容哈希 + 模型名称/Prompt 版本等 -> 缓存键"""
+    return hashlib.sha256("\x00".join((content_digest,) + parts).encode("utf-8")).hexdigest()
+
+
+# --- 2. 两级缓存 ---
+class TieredCache:
+    """(线程安全) 内存 LRU + 磁盘目录；值必须可以 JSON 序列化"""
+
+    def __init__(self, directory, memory_entries=64, disk_max_bytes=256 * 1024 * 1024, ttl_seconds=7 * 86400):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.memory = OrderedDict()  # (键 -> (写入时间, 值))
+        self.disk = OrderedDict()  # (键 -> 文件字节数，按最后访问时间从旧到新)
+        self.disk_bytes = 0
+        self.lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan_disk()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _expired(self, stored_at):
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    def get(self, key):
+        """返回 (值, 命中层 "memory"/"disk")；未命中返回 (None, None)"""
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and not self._expired(entry[0]):
+                self.memory.move_to_end(key)
+                self.hits_memory += 1
+                if key in self.disk:
+                    # (内存命中同样刷新磁盘层的访问顺序和时间，热点条目不会先被磁盘淘汰)
+                    self.disk.move_to_end(key)
+                    self._touch(self._path(key))
+                return entry[1], "memory"
+            self.memory.pop(key, None)
+
+        entry = self._read_disk(key)
+        with self.lock:
+            if entry is None:
+                self._forget_disk(key)
+                self.misses += 1
+                return None, None
+            if key in self.disk:
+                self.disk.move_to_end(key)
+            self.hits_disk += 1
+            self._remember(key, entry["stored_at"], entry["value"])
+            return entry["value"], "disk"
+
+    def put(self, key, value):
+        stored_at = time.time()
+        with self.lock:
+            self._remember(key, stored_at, value)
+        size = self._write_disk(key, stored_at, value)
+        if size is None:
+            return
+        with self.lock:
+            self._forget_disk(key)
+            self.disk[key] = size
+            self.disk_bytes += size
+            self._evict_disk()
+
+    def _remember(self, key, stored_at, value):
+        self.memory[key] = (stored_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(entry["stored_at"]):
+            self._remove(path)
+            return None
+        self._touch(path)  # (记录访问时间，重启后的扫描据此恢复淘汰顺序)
+        return entry
+
+    def _write_disk(self, key, stored_at, value):
+        """返回写入的字节数；写入失败返回 None"""
+        # (先写临时文件再原子替换，避免并发读到半个文件)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"stored_at": stored_at, "value": value}, f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self._path(key))
+            return size
+        except OSError as e:
+            print(f"【缓存警告】: 无法写入磁盘缓存: {e}")
+            self._remove(tmp_path)
+            return None
+
+    def _scan_disk(self):
+        """启动时扫描一次磁盘目录，按最后访问时间从旧到新登记已有条目"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+        with self.lock:
+            for _, key, size in sorted(entries):
+                self.disk[key] = size
+                self.disk_bytes += size
+            self._evict_disk()
+
+    def _forget_disk(self, key):
+        """(调用方持有锁) 从磁盘登记中移除 key"""
+        size = self.disk.pop(key, None)
+        if size is not None:
+            self.disk_bytes -= size
+
+    def _evict_disk(self):
+        """(调用方持有锁) 总大小超过上限时，按最后访问时间从旧到新删除"""
+        while self.disk_bytes > self.disk_max_bytes and self.disk:
+            key, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            self._remove(self._path(key))
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "memory_entries": len(self.memory),
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_bytes,
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+            }
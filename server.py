@@ -1,18 +1,34 @@
 import json
+import math
 import os
 import sys
-import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
-import openai
 from openai import OpenAI
 import dashscope
-import fitz  # PyMuPDF
-from PIL import Image
 import time
-import requests
-from http.client import RemoteDisconnected
-from flask import Flask, request, jsonify  # (新) 导入 Flask
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pdf_render import classify_pages, iter_rendered_pages, jpeg_to_data_uri  # (V26 新增) 并行栅格化 + 内存编码
+from pdf_structure import SAMPLE_PAGES, detect_structure  # (V26.15 新增) 结构化类型检测
+from vlm_pipeline import (AdaptiveChunkSizer, describe_pages, dispatch_in_order, iter_adaptive_chunks,
+                          prefetch)  # (V26.3 新增) 渲染/推理流水线
+from page_filter import print_filter_report, select_relevant_pages  # (V26.7 新增) 页面相关性预筛选
+from text_pipeline import (format_compaction_stats, is_long_document, join_page_texts, merge_extractions,
+                           segment_prompt, split_into_segments)  # (V26.9 新增) 长文书分段提取; (V26.10) 文本压缩
+from fast_extract import (apply_known_fields, confident_fields, extract_fast_fields, fast_path_result,
+                          format_fast_fields, is_complete, known_fields_prompt)  # (V26.13 新增) 规则快速提取
+from prompt_cache import PromptStats, prompt_version  # (V26.11 新增) 前缀缓存友好布局 + Prompt 统计
+from result_cache import TieredCache, blobs_digest, content_key  # (V26.16 新增) 内容寻址结果缓存
+from upload_store import (BatchTooLargeError, UploadBuffer, UploadTooLargeError, receive_upload,
+                          receive_zip_uploads)  # (V26.20 新增) 内存上传 + 超大文件落盘; (V26.22) 批量
+from job_queue import Job, JobManager, QueueFullError  # (V26.18 新增) 异步任务 API
+from fair_scheduler import FairScheduler  # (V26.22 新增) 上游调用名额在文档之间轮转
+from admission import AdmissionController, AdmissionRejectedError  # (V26.23 新增) 按页数的准入控制
+from single_flight import SingleFlight  # (V26.24 新增) 相同内容的进行中请求合并
+from rate_control import (TokenBucket, RetryPolicy, CircuitBreaker, CircuitOpenError, UpstreamError,
+                          call_with_retry)  # (V26.4/V26.5 新增) 限流、退避重试、熔断
+from flask import Flask, Request, Response, request, jsonify  # (新) 导入 Flask
 
 # --- 1. (关键) 服务器端加载 Keys 和 Prompt ---
 load_dotenv()
@@ -23,9 +39,12 @@ if not API_KEY:
     sys.exit(1)
 
 # --- 2. 初始化【两个】Qwen 客户端 (在服务器上) ---
+# (V26.19) 兼容模式地址可由环境变量覆盖 (负载测试时指向本地模拟上游)
+QWEN_COMPATIBLE_BASE_URL = os.getenv("QWEN_COMPATIBLE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
 QWEN_TEXT_CLIENT = OpenAI(
     api_key=API_KEY,
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+    base_url=QWEN_COMPATIBLE_BASE_URL,
+    max_retries=0,  # (V26.5) 重试统一由 call_with_retry 负责，避免 SDK 内部再重试一轮
 )
 QWEN_MODEL_NAME_TEXT = "qwen-plus-2025-01-25"
 dashscope.api_key = API_KEY
@@ -33,9 +52,61 @@ QWEN_MODEL_NAME_VISION = "qwen-vl-max"
 
 # --- 3. (V22 优化) VLM 处理常量 ---
 IMAGE_COMPRESSION_QUALITY = 85
-VLM_PAGE_CHUNK_SIZE = 3  # (3 页批次更稳定)
+VLM_PAGE_CHUNK_SIZE = 3  # (3 页批次更稳定；V26.6 起作为自适应批次的初始值)
 MAX_RETRIES = 3
 API_TIMEOUT = 600  # 10 分钟
+RENDER_WORKERS = min(4, os.cpu_count() or 1)  # (V26 新增) 栅格化进程数 (1 = 串行)
+VLM_PIPELINE_QUEUE_SIZE = 2  # (V26.3 新增) 渲染线程最多领先 VLM 调用的批次数 (按最大批次折算成页数)
+VLM_PAGE_PIXEL_BUDGET = 1280 * 28 * 28  # (V26.2 新增) 每页目标像素数 (qwen-vl 默认每图约 1280 个视觉 token；设为 None 则恢复固定 2 倍渲染)
+VLM_CHUNK_MIN_SIZE = 1  # (V26.6 新增) 自适应批次的下限 (页)
+VLM_CHUNK_MAX_SIZE = 6  # (V26.6 新增) 自适应批次的上限 (页)
+VLM_CHUNK_FAST_SECONDS = 45  # (V26.6 新增) 批次在此时间内成功即视为"快"，下一批 +1 页
+VLM_PAGE_FILTER_ENABLED = False  # (V26.7 新增) 跳过空白页/照片页/表格页 (首尾页始终保留)；误判会丢掉正文页，默认关闭
+VLM_MAX_IN_FLIGHT = 3  # (V26.4 新增) 单个文档同时在途的 VLM 批次数 (1 = 串行)
+VLM_REQUESTS_PER_MINUTE = 60  # (V26.4 新增) 与 DashScope 账号的 RPM 配额保持一致
+TEXT_SEGMENT_MAX_IN_FLIGHT = 3  # (V26.9 新增) 长文书各段同时在途的文本模型调用数
+TEXT_COMPACTION_ENABLED = True  # (V26.10 新增) 去页眉/页脚/页码、拼回硬换行后再构建 Prompt
+FAST_PATH_MIN_CONFIDENCE = 0.8  # (V26.13 新增) 规则提取的字段达到此置信度才作为已知值
+STRUCTURE_MIN_CONFIDENCE = 0.9  # (V26.15 新增) 结构检测判定为扫描型且置信度达到此值时，不再逐页提取文本
+FAST_PATH_SKIP_LLM = False  # (V26.13 新增) True: 案号/法院/上诉期/日期全部高置信度命中时跳过文本模型
+
+RESULT_CACHE_DIR = str(Path(__file__).resolve().parent / "result_cache")  # (V26.16 新增) 结果缓存的磁盘目录
+RESULT_CACHE_MEMORY_ENTRIES = 128  # (V26.16 新增) 内存 LRU 最多保留的文书数
+RESULT_CACHE_DISK_MAX_BYTES = 512 * 1024 * 1024  # (V26.16 新增) 磁盘缓存总大小上限
+RESULT_CACHE_TTL = 30 * 86400  # (V26.16 新增) 缓存有效期 (秒)
+
+VLM_CHUNK_CACHE_DIR = str(Path(__file__).resolve().parent / "vlm_chunk_cache")  # (V26.17 新增) 批次级缓存目录
+VLM_CHUNK_CACHE_MEMORY_ENTRIES = 512  # (V26.17 新增) 内存 LRU 最多保留的批次数
+VLM_CHUNK_CACHE_DISK_MAX_BYTES = 128 * 1024 * 1024  # (V26.17 新增) 磁盘上限，超出后按最久未访问淘汰
+VLM_CHUNK_CACHE_TTL = 30 * 86400  # (V26.17 新增) 有效期 (秒)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # (V26.18 新增) 同时运行的提取任务数 (/extract 与 /jobs 共用；负载测试时可用环境变量调大)
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "20"))  # (V26.18 新增) 最多排队的任务数，超出时返回 503
+JOB_QUEUE_RETRY_AFTER = 30  # (V26.18 新增) 队列已满时建议客户端等待的秒数
+JOB_RETENTION_SECONDS = 3600  # (V26.18 新增) 已结束的任务保留多久供客户端取回结果
+UPLOAD_MEMORY_MAX_BYTES = 16 * 1024 * 1024  # (V26.20 新增) 不超过此大小的上传只保留在内存中 (PyMuPDF stream 模式)
+UPLOAD_MAX_BYTES = 200 * 1024 * 1024  # (V26.20 新增) 上传大小上限，超出时返回 413
+STREAM_HEARTBEAT_SECONDS = 15  # (V26.21 新增) 流式响应在没有新结果时发送保活数据的间隔 (秒)
+UPSTREAM_MAX_IN_FLIGHT = 6  # (V26.22 新增) 全部文档合计同时进行的上游调用数 (VLM 批次 / 文本提取)
+BATCH_MAX_DOCUMENTS = 300  # (V26.22 新增) 一次批量提取最多的 PDF 数
+BATCH_MAX_ACTIVE_DOCUMENTS = 6  # (V26.22 新增) 批量提取时同时处理的文档数 (名额在它们之间轮转)
+BATCH_MAX_BYTES = 2 * 1024 * 1024 * 1024  # (V26.22 新增) 批量上传的请求体上限
+BATCH_MEMORY_MAX_BYTES = 1024 * 1024  # (V26.22 新增) 批量上传时每个 PDF 留在内存中的上限 (300 份 x 16 MB 放不进内存)
+ADMISSION_MAX_QUEUED_PAGES = 1500  # (V26.23 新增) 全部任务 (排队 + 处理中) 合计的页数上限，超出时返回 429
+ADMISSION_DEFAULT_PAGES_PER_MINUTE = 60  # (V26.23 新增) 还没有处理记录时，估算等待时间用的处理速度
+CLIENT_ID_HEADER = "X-Client-Id"  # (V26.23 新增) 客户端令牌；没有时按来源 IP 区分客户端 (同一 NAT 后的用户共用一个队列)
+CLIENT_WEIGHTS = {}  # (V26.23 新增) 客户端 (令牌或 IP) -> 调度权重，未列出的为 1；例如 {"10.0.3.21": 2}
+
+# (V26.4 新增) 全进程共享的令牌桶：所有并发请求合计不超过 RPM 配额
+VLM_RATE_LIMITER = TokenBucket(VLM_REQUESTS_PER_MINUTE, burst=VLM_MAX_IN_FLIGHT)
+RETRY_BASE_DELAY = 2  # (V26.5 新增) 指数退避的基础等待秒数 (全抖动)
+RETRY_MAX_DELAY = 60  # (V26.5 新增) 单次退避的最长等待秒数
+BREAKER_FAILURE_THRESHOLD = 5  # (V26.5 新增) 连续失败多少次后熔断
+BREAKER_RESET_TIMEOUT = 60  # (V26.5 新增) 熔断后多少秒放行一个试探请求
+
+# (V26.5 新增) 文本与 VLM 两个调用点共用的重试策略，以及全进程共享的熔断器
+RETRY_POLICY = RetryPolicy(MAX_RETRIES, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY)
+UPSTREAM_BREAKER = CircuitBreaker("DashScope", failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                                  reset_timeout=BREAKER_RESET_TIMEOUT)
 
 # --- 4. (V23 - 最终版) 您的 "完整提取" Prompt ---
 SYSTEM_PROMPT = """你是一个极其严谨、注重细节的法律文书提取机器人。
@@ -102,245 +173,881 @@ JSON Output:
 现在，请【严格遵守上述所有规则，尤其是“法院陷阱”规则】，处理我提供的文件。
 """
 
+# (V26.11 新增) 静态 Prompt 在两条路径上都作为 system 消息放在最前面 (逐字节不变，便于上游前缀缓存)；
+# VLM 的任务说明放在图像之后
+VLM_TASK_PROMPT = "--- 真实任务：...请严格分析我提供的【这几页】图像..."
+PROMPT_VERSION = prompt_version(SYSTEM_PROMPT, VLM_TASK_PROMPT)
+TEXT_PROMPT_STATS = PromptStats(QWEN_MODEL_NAME_TEXT, PROMPT_VERSION, SYSTEM_PROMPT)
+VLM_PROMPT_STATS = PromptStats(QWEN_MODEL_NAME_VISION, PROMPT_VERSION, SYSTEM_PROMPT)
 
-# --- 5. (不变) 辅助函数：分块器 ---
-def chunk_list(lst, n):
-    for i in range(0, len(lst), n):
-        yield lst[i:i + n]
+# (V26.17 新增) VLM 批次级缓存：重新扫描/修订过的 PDF 中，图像未变化的批次直接复用已有 JSON
+VLM_CHUNK_CACHE = TieredCache(VLM_CHUNK_CACHE_DIR, memory_entries=VLM_CHUNK_CACHE_MEMORY_ENTRIES,
+                              disk_max_bytes=VLM_CHUNK_CACHE_DISK_MAX_BYTES, ttl_seconds=VLM_CHUNK_CACHE_TTL)
 
 
-# --- 6. (不变) Qwen-max (纯文本) API 调用 ---
-def call_qwen_text_api(raw_text):
-    messages = [
+def vlm_chunk_cache_key(image_url_chunk):
+    return content_key(blobs_digest(image_url_chunk), QWEN_MODEL_NAME_VISION, PROMPT_VERSION)
+
+
+def vlm_chunk_plan_key(session, page_indices):
+    """(V26.17) 文档内容 + 送进 VLM 的页码 -> 上次运行的批次划分 (AIMD 的批次大小随调用耗时变化，重跑时按上次的边界切分)"""
+    return content_key(session.digest, ",".join(map(str, page_indices)), "chunk-plan", QWEN_MODEL_NAME_VISION,
+                       PROMPT_VERSION)
+
+
+# (V26.22 新增) 全局调度器：所有文档的上游调用共用 UPSTREAM_MAX_IN_FLIGHT 个名额
+# (V26.23) 按客户端分队列 (带客户端的权重)，同一客户端的多个文档 (例如一个批量任务) 在队列内轮转
+UPSTREAM_SCHEDULER = FairScheduler(UPSTREAM_MAX_IN_FLIGHT)
+
+
+def upstream_slot(progress):
+    """progress 所属客户端的上游名额，在该客户端的文档之间轮转 (progress 为 None 时所有调用共用一个队列)"""
+    if progress is None:
+        return UPSTREAM_SCHEDULER.slot()
+    return UPSTREAM_SCHEDULER.slot(progress.client, progress.weight, member=progress.id)
+
+
+def scheduled(progress, func, *args):
+    """取得 progress 所属文档的名额后调用 func"""
+    with upstream_slot(progress):
+        return func(*args)
+
+
+# (V26.16 新增) 结果缓存：键 = 上传内容 SHA-256 + 模型名称 + Prompt 版本 + 影响输出的开关
+RESULT_CACHE = TieredCache(RESULT_CACHE_DIR, memory_entries=RESULT_CACHE_MEMORY_ENTRIES,
+                           disk_max_bytes=RESULT_CACHE_DISK_MAX_BYTES, ttl_seconds=RESULT_CACHE_TTL)
+
+
+def result_cache_key(content_digest):
+    """
+    (V26.20) content_digest 为上传内容的 SHA-256 (接收上传时已顺带算好)
+    规则快速路径、文本压缩、页面预筛选、渲染参数也会改变结果，一并计入键：
+    例如关闭 FAST_PATH_SKIP_LLM 之后，不会再命中跳过模型时缓存的 (只有少数字段的) 结果
+    """
+    settings = (f"skip_llm={FAST_PATH_SKIP_LLM}@{FAST_PATH_MIN_CONFIDENCE},compaction={TEXT_COMPACTION_ENABLED},"
+                f"page_filter={VLM_PAGE_FILTER_ENABLED},pixels={VLM_PAGE_PIXEL_BUDGET},quality={IMAGE_COMPRESSION_QUALITY}")
+    return content_key(content_digest, QWEN_MODEL_NAME_TEXT, QWEN_MODEL_NAME_VISION, PROMPT_VERSION, settings)
+
+
+# (V26.24 新增) 进行中的提取按结果缓存键登记：结果写入缓存之前到达的相同上传直接等待同一次计算
+SINGLE_FLIGHT = SingleFlight()
+
+
+# --- 5. (不变) Qwen-max (纯文本) API 调用 ---
+def build_text_messages(raw_text, user_content=None, known_fields=None):
+    """
+    (V26.9) user_content 不为 None 时替代默认的用户消息 (长文书分段调用)
+    (V26.13) known_fields: 规则已确定的字段，放在用户消息开头
+    (V26.19) 单独成函数，async_server.py 复用同一消息布局 (前缀缓存)
+    """
+    return [
         {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": f"法律文书原文(从PDF提取的纯文本):\n{raw_text}"}
+        {"role": "user", "content": known_fields_prompt(known_fields or {}) +
+                                (user_content or f"法律文书原文(从PDF提取的纯文本):\n{raw_text}")}
     ]
+
+
+def call_qwen_text_api(raw_text, user_content=None, known_fields=None):
+    messages = build_text_messages(raw_text, user_content, known_fields)
     print(f"--- (大脑) 正在调用 {QWEN_MODEL_NAME_TEXT} (纯文本 API) ---")
-    try:
-        completion = QWEN_TEXT_CLIENT.chat.completions.create(
+
+    def request_completion():
+        return QWEN_TEXT_CLIENT.chat.completions.create(
             model=QWEN_MODEL_NAME_TEXT,
             messages=messages,
             response_format={"type": "json_object"},
             temperature=0.0
         )
+
+    try:
+        # (V26.5) 指数退避重试 + 熔断
+        completion = call_with_retry(request_completion, RETRY_POLICY, UPSTREAM_BREAKER, name=QWEN_MODEL_NAME_TEXT)
+        print(TEXT_PROMPT_STATS.record(messages, completion.usage))
         model_output_string = completion.choices[0].message.content
         return json.loads(model_output_string)
+    except CircuitOpenError:
+        raise  # (交给 handle_extraction 返回 503)
     except Exception as e:
         print(f"【Qwen 文本 API 错误】: {e}")
         return None
 
 
-# --- 7. (重大修改) Qwen-VL-Max (VLM) API 调用 ---
+# (V26.10 新增) 文本路径的全文构建 (含压缩预处理)
+def build_document_text(text_pages):
+    """按页码顺序拼接文本页；启用压缩时打印节省的 token 数"""
+    text, compaction = join_page_texts(text_pages, compact=TEXT_COMPACTION_ENABLED)
+    if compaction:
+        print(format_compaction_stats(compaction))
+    return text
+
+
+# (V26.9 新增) 长文书：按章节边界分段，各段并行提取后合并
+def extract_text_document(raw_text):
+    """
+    短文书单次调用 call_qwen_text_api；长文书走分段 map-reduce，返回合并后的 JSON
+    (V26.13) 先用规则提取固定格式的字段，作为已知值交给模型，并回填模型返回的 null
+    """
+    matches = extract_fast_fields(raw_text)
+    print(format_fast_fields(matches))
+    known_fields = confident_fields(matches, FAST_PATH_MIN_CONFIDENCE)
+    if FAST_PATH_SKIP_LLM and is_complete(known_fields):
+        print("--- (规则) 全部规则字段高置信度命中，跳过文本模型 ---")
+        return fast_path_result(known_fields)
+
+    if not is_long_document(raw_text):
+        return apply_known_fields(call_qwen_text_api(raw_text, known_fields=known_fields), known_fields)
+
+    segments = split_into_segments(raw_text)
+    print(f"--- (大脑) 长文书模式：全文切分为 {len(segments)} 段，"
+          f"最多 {TEXT_SEGMENT_MAX_IN_FLIGHT} 段并行提取 ---")
+
+    def extract_segment(indexed_segment):
+        index, segment = indexed_segment
+        return call_qwen_text_api(segment, user_content=segment_prompt(segment, index, len(segments)),
+                                  known_fields=known_fields)
+
+    results = list(dispatch_in_order(enumerate(segments), extract_segment, TEXT_SEGMENT_MAX_IN_FLIGHT))
+    failed = sum(1 for result in results if result is None)
+    if failed:
+        print(f"【长文书警告】: {failed}/{len(segments)} 段提取失败，合并结果可能不完整。")
+    return apply_known_fields(merge_extractions(results), known_fields)
+
+
+# --- 6. (重大修改) Qwen-VL-Max (VLM) API 调用 ---
+# (V26.3 重构) 单个批次的 VLM 调用，供流水线消费者使用
+def call_vlm_chunk(image_url_chunk, chunk_name, chunk_sizer=None):
+    """调用 VLM 处理一个批次，返回该批次的 JSON 结果 (失败时返回带 "error" 的字典)"""
+    # (V26.11) 静态 Prompt 放在 system 消息 (前缀)，图像和任务说明放在其后
+    content = [{"image": url} for url in image_url_chunk]
+    content.append({"text": VLM_TASK_PROMPT})
+    messages = [
+        {"role": "system", "content": [{"text": SYSTEM_PROMPT}]},
+        {"role": "user", "content": content}
+    ]
+
+    def before_attempt(attempt):
+        waited = VLM_RATE_LIMITER.acquire()
+        if waited > 0:
+            print(f"--- (限流) {chunk_name} 等待令牌 {waited:.1f} 秒 ---")
+        print(f"--- (眼睛) 正在调用 VLM API ({chunk_name}, Attempt {attempt + 1}/{MAX_RETRIES})... ---")
+
+    def request_vlm():
+        response = dashscope.MultiModalConversation.call(
+            model=QWEN_MODEL_NAME_VISION,
+            messages=messages,
+            temperature=0.0,
+            timeout=API_TIMEOUT
+        )
+        if response.status_code != 200:
+            raise UpstreamError(f"{response.code} - {response.message}",
+                                status_code=response.status_code, code=response.code)
+        return response
+
+    def attempt_vlm():
+        """(V26.6) 每次失败的尝试 (包括最后一次) 在这里给自适应批次记录且只记录一次失败"""
+        try:
+            return request_vlm()
+        except Exception:
+            if chunk_sizer:
+                chunk_sizer.record_failure()
+            raise
+
+    try:
+        # (V26.5) 指数退避重试 + 熔断 (替代固定的 time.sleep(5))
+        response = call_with_retry(attempt_vlm, RETRY_POLICY, UPSTREAM_BREAKER, name=chunk_name,
+                                   before_attempt=before_attempt)
+    except CircuitOpenError:
+        raise  # (上游不健康：放弃剩余批次，交给 handle_extraction 返回 503)
+    except Exception as e:
+        print(f"【VLM API 错误】 ({chunk_name}): {e}")
+        print(f"--- 批次 {chunk_name} 【失败】，已放弃重试。---")
+        return {"error": f"批次 {chunk_name} 处理失败。"}
+
+    print(VLM_PROMPT_STATS.record(messages, response.usage))
+    model_output_content = response.output.choices[0].message.content
+    model_output_string = ""
+    for item in model_output_content:
+        if 'text' in item: model_output_string += item['text']
+    return parse_vlm_output(model_output_string, chunk_name)
+
+
+def parse_vlm_output(model_output_string, chunk_name):
+    """(V26.19) 从 VLM 输出中截取 JSON 对象 (DashScope 原生 SDK 与兼容模式共用)"""
+    json_match = model_output_string[model_output_string.find('{'): model_output_string.rfind('}') + 1]
+    if not json_match:
+        print(f"【VLM 错误】 ({chunk_name}): VLM 未返回有效的 JSON 结构。")
+        return {"error": f"批次 {chunk_name} VLM 未返回 JSON。"}
+
+    return json.loads(json_match)
+
+
+def iter_vlm_results(session, page_indices=None, progress=None):
+    """
+    (V26.3 新增) 流水线：后台线程渲染+编码 (生产者)，VLM 调用 (消费者) 与之重叠。
+    批次 N 调用 VLM 时，批次 N+1 仍在渲染；结果按页码顺序逐批 yield。
+    (V26.8) page_indices 不为 None 时只处理这些页 (混合型 PDF 的扫描页)。
+    (V26.14) session 为本次请求的 DocumentSession，筛选和串行渲染复用同一个已打开的文档。
+    (V26.18) progress 为 Job 时，每完成一个批次更新一次进度。
+    (V26.21) 同时发布该批次的结果，流式响应立即转发给客户端 (按完成顺序)。
+    """
+    if page_indices is None:
+        page_indices = list(range(session.page_count))
+    page_count = len(page_indices)
+    print(f"--- (眼睛) 共 {page_count} 页，自适应批次 (初始 {VLM_PAGE_CHUNK_SIZE} 页，"
+          f"范围 {VLM_CHUNK_MIN_SIZE}-{VLM_CHUNK_MAX_SIZE} 页，JPEG Quality={IMAGE_COMPRESSION_QUALITY}) ---")
+
+    # (V26.6) AIMD：调用快则加大批次，超时/失败则减半，减少简单文档的往返次数
+    chunk_sizer = AdaptiveChunkSizer(VLM_PAGE_CHUNK_SIZE, min_size=VLM_CHUNK_MIN_SIZE,
+                                     max_size=VLM_CHUNK_MAX_SIZE, fast_seconds=VLM_CHUNK_FAST_SECONDS)
+
+    # (V26.7) 预筛选：只把与提取字段相关的页面送进 VLM
+    if VLM_PAGE_FILTER_ENABLED:
+        page_indices, filter_report = select_relevant_pages(session, page_indices)
+        print_filter_report(filter_report, page_count)
+    if progress:
+        progress.add_work(len(page_indices), math.ceil(len(page_indices) / VLM_PAGE_CHUNK_SIZE))
+
+    # (V26) 多进程并行栅格化：每个子进程自己打开 PDF，渲染自己的页码区间
+    # (V26.1) JPEG 只存在于内存中，以 base64 Data URI 内联发送，不再写临时文件
+    page_jpegs = iter_rendered_pages(session, IMAGE_COMPRESSION_QUALITY, workers=RENDER_WORKERS,
+                                     pixel_budget=VLM_PAGE_PIXEL_BUDGET, batch_pages=VLM_PAGE_CHUNK_SIZE,
+                                     page_indices=page_indices)
+    # (后台线程只预取页面；分块在空出在途名额、取下一批时才进行，批次大小总是 AIMD 的最新建议)
+    page_urls = prefetch(((i, jpeg_to_data_uri(jpeg_bytes)) for i, jpeg_bytes in zip(page_indices, page_jpegs)),
+                         maxsize=VLM_PIPELINE_QUEUE_SIZE * VLM_CHUNK_MAX_SIZE)
+    # (V26.17) 缓存命中的批次不记录耗时，AIMD 的批次大小会与上次不同：按上次的批次划分切分，边界才能对上
+    plan_key = vlm_chunk_plan_key(session, page_indices)
+    plan, _ = VLM_CHUNK_CACHE.get(plan_key)
+    if plan:
+        print(f"--- (缓存) 按上次的批次划分切分: {plan} ---")
+    url_chunks = iter_adaptive_chunks(page_urls, chunk_sizer, plan)
+
+    def process_chunk(indexed_chunk):
+        chunk_index, page_chunk = indexed_chunk
+        image_url_chunk = [url for _, url in page_chunk]
+        chunk_name = f"批次 {chunk_index + 1} ({describe_pages([i for i, _ in page_chunk])})"
+        print(f"\n--- (眼睛) 正在处理 {chunk_name} ---")
+
+        # (V26.17) 页面图像与之前某次完全相同：复用结果，不调用 VLM，也不影响自适应批次
+        cache_key = vlm_chunk_cache_key(image_url_chunk)
+        cached_result, _ = VLM_CHUNK_CACHE.get(cache_key)
+        if cached_result is not None:
+            print(f"--- (缓存) {chunk_name} 页面图像未变化，复用已有结果 ---")
+            result = cached_result
+        else:
+            # (V26.22) 先排队取得名额 (与其他文档轮转)，计时从取得名额后开始，排队时间不影响自适应批次
+            with upstream_slot(progress):
+                started_at = time.monotonic()
+                result = call_vlm_chunk(image_url_chunk, chunk_name, chunk_sizer)
+            if "error" not in result:  # (失败已在 call_vlm_chunk 中按尝试次数记录)
+                chunk_sizer.record_success(time.monotonic() - started_at)
+                VLM_CHUNK_CACHE.put(cache_key, result)
+
+        if progress:
+            progress.chunk_done(len(page_chunk), chunk_name, result)
+        return result
+
+    # (V26.4) 最多 VLM_MAX_IN_FLIGHT 个批次同时调用 VLM，结果按批次顺序重新组装
+    yield from dispatch_in_order(enumerate(url_chunks), process_chunk, VLM_MAX_IN_FLIGHT)
+    print(f"--- (自适应) 本文档各批次页数: {chunk_sizer.used_sizes} ---")
+    if chunk_sizer.used_sizes != plan:
+        VLM_CHUNK_CACHE.put(plan_key, chunk_sizer.used_sizes)
+
+
 # (此函数不再“打印”，而是“返回一个列表”)
-def call_qwen_vlm_api(file_path):
+def call_qwen_vlm_api(session, page_indices=None, progress=None):
     """
-    (V22 逻辑 - V25 修改)
-    1. 将 PDF 转为压缩 JPEG
+    (V22 逻辑 - V26.3 修改)
+    1. 将 PDF 转为压缩 JPEG (后台流水线)
     2. 分块
-    3. 循环调用 VLM API
+    3. 循环调用 VLM API (与渲染重叠)
     4. (新) 将所有结果收集到一个列表中并返回
     """
-    print(f"--- (眼睛) 正在使用 PyMuPDF+Pillow 将 {file_path} 转换为压缩 JPEG... ---")
-    temp_files = []
-    doc = None
+    print(f"--- (眼睛) 正在使用 PyMuPDF+Pillow 将 {session.name} 转换为压缩 JPEG... ---")
     all_results = []  # (新) 用于收集所有 JSON 结果
 
     try:
-        doc = fitz.open(file_path)
-        all_image_urls = []
-
-        for i, page in enumerate(doc):
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            pil_image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            tmp_file_path = f"{tempfile.gettempdir()}/_page{i + 1}_{Path(file_path).stem}.jpg"
-            pil_image.save(tmp_file_path, "JPEG", quality=IMAGE_COMPRESSION_QUALITY)
-            temp_files.append(tmp_file_path)
-            all_image_urls.append(f"file://{Path(tmp_file_path).resolve()}")
-
-        if not all_image_urls:
+        for chunk_result in iter_vlm_results(session, page_indices, progress):
+            # (新) 收集结果，而不是打印
+            all_results.append(chunk_result)
+
+        if not all_results:
             print("【VLM 错误】: 无法从 PDF 提取任何图像页面。")
             return None  # (返回 None 表示失败)
 
-        print(f"--- (眼睛) 成功提取 {len(all_image_urls)} 页图像 (JPEG Quality={IMAGE_COMPRESSION_QUALITY}) ---")
-
-        url_chunks = list(chunk_list(all_image_urls, VLM_PAGE_CHUNK_SIZE))
-        print(f"--- (眼睛) 已将任务分为 {len(url_chunks)} 个批次 (每批 {VLM_PAGE_CHUNK_SIZE} 页) ---")
-
-        for chunk_index, image_url_chunk in enumerate(url_chunks):
-            chunk_name = f"批次 {chunk_index + 1}/{len(url_chunks)}"
-            print(f"\n--- (眼睛) 正在处理 {chunk_name} ---")
-
-            full_user_prompt_text = f"{SYSTEM_PROMPT}\n\n--- 真实任务：...请严格分析我提供的【这几页】图像..."
-            content = [{"image": url} for url in image_url_chunk]
-            content.append({"text": full_user_prompt_text})
-            messages = [{"role": "user", "content": content}]
-
-            response = None
-            for attempt in range(MAX_RETRIES):
-                try:
-                    print(f"--- (眼睛) 正在调用 VLM API (Attempt {attempt + 1}/{MAX_RETRIES})... ---")
-                    response = dashscope.MultiModalConversation.call(
-                        model=QWEN_MODEL_NAME_VISION,
-                        messages=messages,
-                        temperature=0.0,
-                        timeout=API_TIMEOUT
-                    )
-                    if response.status_code == 200:
-                        break  # 成功
-                    else:
-                        print(
-                            f"【VLM API 错误】 ({chunk_name}, Attempt {attempt + 1}): {response.code} - {response.message}")
-                        if attempt < MAX_RETRIES - 1: time.sleep(5)
-                except (requests.exceptions.ConnectionError, RemoteDisconnected, Exception) as e:
-                    print(f"【VLM API 网络/SDK 错误】 ({chunk_name}, Attempt {attempt + 1}): {e}")
-                    if attempt < MAX_RETRIES - 1: time.sleep(5)
-
-            if response is None or response.status_code != 200:
-                print(f"--- 批次 {chunk_name} 【失败】，已达到最大重试次数。---")
-                all_results.append({"error": f"批次 {chunk_name} 处理失败。"})
-                continue
-
-            model_output_content = response.output.choices[0].message.content
-            model_output_string = ""
-            for item in model_output_content:
-                if 'text' in item: model_output_string += item['text']
-
-            json_match = model_output_string[model_output_string.find('{'): model_output_string.rfind('}') + 1]
-            if not json_match:
-                print(f"【VLM 错误】 ({chunk_name}): VLM 未返回有效的 JSON 结构。")
-                all_results.append({"error": f"批次 {chunk_name} VLM 未返回 JSON。"})
-                continue
-
-            # (新) 收集结果，而不是打印
-            all_results.append(json.loads(json_match))
-
         return all_results  # (新) 返回所有分块的结果列表
 
+    except CircuitOpenError:
+        raise
     except Exception as e:
         print(f"【VLM 图像转换/处理异常】: {e}")
         return None  # (返回 None 表示严重失败)
-    finally:
-        if doc: doc.close()
-        print("--- (清理) 正在删除所有临时图像文件... ---")
-        for tmp_file in temp_files:
-            try:
-                os.unlink(tmp_file)
-            except:
-                pass
-
-
-# --- 8. (不变) PyMuPDF 检测器 ---
-def detect_pdf_type(filepath):
-    """(V20 - PyMuPDF 版) 检测 PDF 是“文本型”还是“扫描型”"""
-    print(f"--- (检测) 正在使用 PyMuPDF 打开 {filepath} ---")
-    doc = None
+
+
+# --- 7. (V26.8 修改) PyMuPDF 检测器：逐页分类 ---
+def detect_pdf_type(session):
+    """
+    (V20 - PyMuPDF 版; V26.8 逐页分类) 检测 PDF 是“文本型”、“扫描型”还是“混合型”
+    返回 (类型, 文本页 {页码: 文本}, 扫描页页码列表)
+    (V26.15) 结构检测有把握判定为扫描型时提前返回；否则退回逐页分类
+    """
+    print(f"--- (检测) 正在使用 PyMuPDF 检测 {session.name} ---")
     try:
-        doc = fitz.open(filepath)
-        text_length = 0
-        for page in doc.pages():  # (V24.1 修复) 已添加 ()
-            text_length += len(page.get_text().strip())
-            if text_length > 100:  break
+        # (V26.15) 先看前几页的结构 (字体/文本操作符/图像覆盖率)；整页图像的扫描件直接判定，提前退出
+        # (只有其余页也都没有字体资源时才提前退出：前几页扫描、后面打字的文书仍需逐页分类，文本页走文本模型)
+        verdict, confidence, _ = detect_structure(session)
+        print(f"--- (检测) 结构检测: {verdict or '不确定'} (置信度 {confidence:.2f}) ---")
+        if verdict == "SCANNED_PDF" and confidence >= STRUCTURE_MIN_CONFIDENCE:
+            if not any(session.page_has_fonts(i) for i in range(SAMPLE_PAGES, session.page_count)):
+                print(f"--- (检测) PDF 是【扫描型】(前 {SAMPLE_PAGES} 页均为整页图像，其余页没有文字层) ---")
+                return "SCANNED_PDF", {}, list(range(session.page_count))
+            print(f"--- (检测) 前 {SAMPLE_PAGES} 页为整页图像，但后续页有文字层，改为逐页分类 ---")
 
-        if text_length > 100:
-            print(f"--- (检测) PDF 是【文本型】(找到 {text_length} 字符) ---")
-            return "TEXT_PDF"
-        else:
+        text_pages, scanned_pages = classify_pages(session)
+        text_length = sum(len(text.strip()) for text in text_pages.values())
+
+        if text_length <= 100:
             print(f"--- (检测) PDF 是【扫描型】(仅找到 {text_length} 字符) ---")
-            return "SCANNED_PDF"
+            return "SCANNED_PDF", {}, list(range(len(text_pages) + len(scanned_pages)))
+        if not scanned_pages:
+            print(f"--- (检测) PDF 是【文本型】(找到 {text_length} 字符) ---")
+            return "TEXT_PDF", text_pages, []
+        print(f"--- (检测) PDF 是【混合型】({len(text_pages)} 页文本, {len(scanned_pages)} 页扫描) ---")
+        return "MIXED_PDF", text_pages, scanned_pages
     except Exception as e:
         print(f"【PyMuPDF 检测错误】: {e}")
-        return "ERROR"
-    finally:
-        if doc:
-            doc.close()
+        return "ERROR", {}, []
 
 
-# --- 9. (新) Flask 服务器核心 ---
-app = Flask(__name__)
+def extract_mixed_pdf(session, text_pages, scanned_pages, progress=None):
+    """
+    (V26.8 新增) 混合型 PDF：文本页拼接后调用文本模型，同时扫描页走 VLM 流水线。
+    结果按各自的首页页码排序合并。
+    """
+    text_page_ids = sorted(text_pages)
+    print(f"--- (路由) 文本模型: {describe_pages(text_page_ids)}；VLM: {describe_pages(scanned_pages)} ---")
+    text = build_document_text(text_pages)
+    if progress:
+        progress.add_work(len(text_pages), 1)
 
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        text_future = executor.submit(scheduled, progress, extract_text_document, text)
+        vlm_results = call_qwen_vlm_api(session, page_indices=scanned_pages, progress=progress) or []
+        text_result = text_future.result()
+    if progress:
+        progress.chunk_done(len(text_pages), f"文本页 ({describe_pages(text_page_ids)})", text_result)
 
-# (V25.2 - 文件锁修复)
-# 我们将替换整个 @app.route("/extract") 函数
-@app.route("/extract", methods=["POST"])
-def handle_extraction():
-    """这是客户端将调用的唯一 API 端点 (已修复 Windows 文件锁)"""
-    print("\n" + "=" * 50)
-    print(f"--- 收到新的 /extract 请求 ---")
+    if not text_result:
+        return vlm_results
+    if text_page_ids[0] < scanned_pages[0]:
+        return [text_result] + vlm_results
+    return vlm_results + [text_result]
 
-    if 'file' not in request.files:
-        print("【请求错误】: 'file' 字段未在请求中找到。")
-        return jsonify({"error": "请求中未包含 'file'。"}), 400
 
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({"error": "未选择文件。"}), 400
+# --- 8. (V26.18 修改) 提取流程：同步 /extract 与异步 /jobs 共用 ---
+def cached_extraction(upload):
+    """(V26.16) 命中结果缓存时返回 (结果列表, 响应头)，否则返回 None"""
+    cache_key = result_cache_key(upload.digest)
+    cached_result, cache_tier = RESULT_CACHE.get(cache_key)
+    if cached_result is None:
+        return None
+    print(f"--- (缓存) 命中 [{cache_tier}] {cache_key[:12]}，跳过检测与模型调用 ---")
+    return cached_result, {"X-Cache": f"HIT-{cache_tier}", "X-Cache-Key": cache_key}
 
-    # --- (V25.2 修复开始) ---
-    # 我们不再使用 'with' 语句
-    # 1. 手动创建一个【不自动删除】的临时文件
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    tmp_path = tmp.name
 
-    try:
-        # 2. 保存客户端上传的内容
-        file.save(tmp_path)
+def publish_cached(job, cached_result, headers):
+    """把缓存结果逐条发布到 job (流式端点照常收到每一条)，返回 (结果列表, 响应头)"""
+    for i, item in enumerate(cached_result):
+        job.publish(f"(缓存) 批次 {i + 1}/{len(cached_result)}", item)
+    return cached_result, headers
 
-        # 3. (关键!) 立即关闭文件句柄，【释放文件锁】
-        tmp.close()
 
-        print(f"--- 文件已临时保存到: {tmp_path} (文件锁已释放) ---")
+def run_extraction(upload, progress=None):
+    """
+    检测 -> 路由 -> 提取，返回 (结果列表, 响应头)；失败时抛出异常。
+    progress 为 Job 时，随批次完成更新任务进度。
+    (V26.20) upload 为 upload_store.Upload：内存中的字节或落盘的临时文件
+    """
+    # (V26.16) 同一份文书 (同模型、同 Prompt 版本) 已提取过：直接返回缓存结果
+    # (单文件请求在提交任务前已查过一次；这里仍需检查：排队期间相同内容的任务可能已经写入缓存)
+    cached = cached_extraction(upload)
+    if cached is not None:
+        return publish_cached(progress, *cached) if progress else cached
+    cache_key = result_cache_key(upload.digest)
+    print(f"--- (缓存) 未命中 {cache_key[:12]} ---")
 
-        # 4. (现在可以安全调用了) 检测 PDF 类型
-        #    (fitz.open(tmp_path) 现在可以成功打开文件了)
-        pdf_type = detect_pdf_type(tmp_path)
+    # (V26.14) 整个请求只打开这一次，检测/文本/筛选/渲染共用同一个会话
+    #          (会话必须在删除临时文件之前关闭，释放 PyMuPDF 对文件的占用)
+    with upload.open_session() as session:
+        pdf_type, text_pages, scanned_pages = detect_pdf_type(session)
 
         if pdf_type == "TEXT_PDF":
             # (流程一) 文本型 PDF
-            print(f"--- (大脑) 正在使用 PyMuPDF 提取 {tmp_path} 的全部文本... ---")
-            doc = fitz.open(tmp_path)
-            text = "\n".join([page.get_text() for page in doc.pages()])
-            doc.close()  # 再次确保关闭
+            # (V26.8) 检测时已逐页取得文本，无需再次打开 PDF
+            if progress:
+                progress.add_work(len(text_pages), 1)
+            text = build_document_text(text_pages)
 
-            extracted_data = call_qwen_text_api(text)
+            extracted_data = scheduled(progress, extract_text_document, text)
 
             if extracted_data:
-                return jsonify([extracted_data])
+                extracted_data_list = [extracted_data]
             else:
                 raise Exception("Qwen-Text 未能返回有效数据。")
+            if progress:
+                progress.chunk_done(len(text_pages), "全文 (文本模型)", extracted_data)
 
         elif pdf_type == "SCANNED_PDF":
             # (流程二) 扫描型 PDF
-            # (call_qwen_vlm_api 也会打开和关闭 tmp_path)
-            extracted_data_list = call_qwen_vlm_api(tmp_path)
+            extracted_data_list = call_qwen_vlm_api(session, progress=progress)
 
-            if extracted_data_list:
-                return jsonify(extracted_data_list)
-            else:
+            if not extracted_data_list:
                 raise Exception("Qwen-VLM 未能返回有效数据。")
 
+        elif pdf_type == "MIXED_PDF":
+            # (流程三) (V26.8 新增) 混合型 PDF：文本页走文本模型，扫描页走 VLM，两路并行
+            extracted_data_list = extract_mixed_pdf(session, text_pages, scanned_pages, progress)
+
+            if not extracted_data_list:
+                raise Exception("Qwen-Text 与 Qwen-VLM 均未能返回有效数据。")
+
         else:  # "ERROR"
             raise Exception("无法检测或读取 PDF。")
 
+    # (V26.16) 只缓存所有批次都成功的结果 (含失败批次的结果下次应重新提取)
+    if not any("error" in item for item in extracted_data_list):
+        RESULT_CACHE.put(cache_key, extracted_data_list)
+    return extracted_data_list, {"X-Cache": "MISS", "X-Cache-Key": cache_key}
+
+
+def extract_upload(job, upload):
+    """
+    (V26.18) 工作线程入口：提取一个已接收的上传，结束后删除落盘的临时文件 (如果有)
+    (V26.24) 结束时 (任务标记完成之前) 注销 SINGLE_FLIGHT 登记；之后的相同上传走结果缓存
+    """
+    try:
+        return run_extraction(upload, progress=job)
     except Exception as e:
-        # 5. (不变) 捕获所有错误
         print(f"【服务器处理错误】: {e}")
-        return jsonify({"error": str(e)}), 500
+        raise
+    finally:
+        SINGLE_FLIGHT.done(result_cache_key(upload.digest), job)
+        upload.close()
 
+
+def run_batch(job, uploads):
+    """
+    (V26.22 新增) 批量提取：最多 BATCH_MAX_ACTIVE_DOCUMENTS 份文书同时处理，
+    它们的 VLM 批次和文本调用经 UPSTREAM_SCHEDULER 按文档轮转，大扫描件不会独占上游名额。
+    (V26.23) 每份文书开始处理时才按页数计入准入控制 (额度不足时等待)，处理完立即归还。
+    每份文书完成后发布一条记录 (流式端点可逐份接收)；返回 ({"documents": [...], "summary": {...}}, 响应头)
+    """
+    print(f"--- (批量) {len(uploads)} 份文书，同时处理 {BATCH_MAX_ACTIVE_DOCUMENTS} 份 ---")
+    job.add_work(0, len(uploads))
+    documents = [None] * len(uploads)
+    started_at = time.monotonic()
+
+    def process_document(index):
+        upload = uploads[index]
+        # (只用于统计本文档的页数/批次，并在提交者的调度队列内轮转；客户端与权重沿用批量任务的提交者)
+        document_progress = Job(upload.name, client=job.client, weight=job.weight)
+        pages = upload.page_count()
+        ADMISSION.admit(pages, wait=True)
+        document_started_at = time.monotonic()
+        try:
+            result, headers = run_extraction(upload, progress=document_progress)
+            entry = {"name": upload.name, "status": "done", "cache": headers["X-Cache"], "result": result}
+        except Exception as e:
+            print(f"【批量处理错误】 ({upload.name}): {e}")
+            entry = {"name": upload.name, "status": "failed", "error": str(e)}
+        finally:
+            ADMISSION.release(pages)
+            upload.close()
+        entry["pages"] = document_progress.pages_done
+        entry["chunks"] = document_progress.chunks_done
+        entry["seconds"] = round(time.monotonic() - document_started_at, 2)
+        documents[index] = entry
+        job.add_work(entry["pages"], 0)
+        job.chunk_done(entry["pages"], upload.name, entry)
+
+    with ThreadPoolExecutor(max_workers=BATCH_MAX_ACTIVE_DOCUMENTS, thread_name_prefix="batch") as pool:
+        list(pool.map(process_document, range(len(uploads))))
+
+    elapsed = max(time.monotonic() - started_at, 1e-6)
+    succeeded = [entry for entry in documents if entry["status"] == "done"]
+    pages = sum(entry["pages"] for entry in documents)
+    summary = {
+        "documents": len(documents),
+        "succeeded": len(succeeded),
+        "failed": len(documents) - len(succeeded),
+        "cache_hits": sum(1 for entry in succeeded if entry["cache"].startswith("HIT")),
+        "pages": pages,
+        "elapsed_seconds": round(elapsed, 1),
+        "documents_per_minute": round(len(documents) / elapsed * 60, 2),
+        "pages_per_minute": round(pages / elapsed * 60, 1),
+        "mean_document_seconds": round(sum(entry["seconds"] for entry in documents) / len(documents), 2),
+    }
+    print(f"--- (批量) 完成: {summary['succeeded']}/{summary['documents']} 份成功，{pages} 页，"
+          f"用时 {summary['elapsed_seconds']} 秒 ({summary['documents_per_minute']} 份/分钟) ---")
+    return {"documents": documents, "summary": summary}, {}
+
+
+# --- 9. (新) Flask 服务器核心 ---
+class UploadRequest(Request):
+    """
+    (V26.20) 上传文件由 Werkzeug 直接写入 UploadBuffer：UPLOAD_MEMORY_MAX_BYTES 以内留在内存，超出落盘，
+    每个文件超过 UPLOAD_MAX_BYTES 时在读取中立即拒绝 (分块传输没有 Content-Length 也一样)；
+    receive_upload 直接接管缓冲区，内容只保存一份
+    (V26.22) 批量上传时每个文件只在内存中保留 BATCH_MEMORY_MAX_BYTES；
+    缓冲区上限为 BATCH_MAX_BYTES (zip 可以超过单文件上限)，其中每个 PDF 在接收时再按 UPLOAD_MAX_BYTES 检查
+    请求结束时 (包括解析中途超限或客户端断开) 关闭本请求创建的全部缓冲区，删除未被接管的临时文件
+    """
+
+    @property
+    def is_batch(self):
+        return self.path == "/batches"
+
+    @property
+    def max_content_length(self):
+        """请求体上限：批量端点为 BATCH_MAX_BYTES，其他端点为 UPLOAD_MAX_BYTES (Werkzeug 在读取前或读取中返回 413)"""
+        return BATCH_MAX_BYTES if self.is_batch else UPLOAD_MAX_BYTES
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.is_batch:
+            buffer = UploadBuffer(BATCH_MEMORY_MAX_BYTES, BATCH_MAX_BYTES)
+        else:
+            buffer = UploadBuffer(UPLOAD_MEMORY_MAX_BYTES, UPLOAD_MAX_BYTES)
+        self.__dict__.setdefault("upload_buffers", []).append(buffer)
+        return buffer
+
+    def close(self):
+        # (Werkzeug 解析 multipart 出错时，已创建的缓冲区不会出现在 request.files 中，也不会被关闭)
+        for buffer in self.__dict__.pop("upload_buffers", []):
+            buffer.close()
+        super().close()
+
+
+app = Flask(__name__)
+app.request_class = UploadRequest
+
+# (V26.18 新增) 有界工作线程池：所有提取 (同步或异步) 都在这里排队执行
+# (V26.23) 工作线程按客户端轮转分配
+JOBS = JobManager(workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, retention_seconds=JOB_RETENTION_SECONDS)
+
+# (V26.23 新增) 准入控制：排队 + 处理中的总页数超过上限时拒绝新任务，并估算需要等待的时间
+ADMISSION = AdmissionController(ADMISSION_MAX_QUEUED_PAGES,
+                                default_pages_per_minute=ADMISSION_DEFAULT_PAGES_PER_MINUTE)
+
+
+def client_identity():
+    """(V26.23) 返回 (客户端, 权重)：优先使用 X-Client-Id 令牌，否则使用来源 IP"""
+    client = request.headers.get(CLIENT_ID_HEADER) or request.remote_addr
+    return client, CLIENT_WEIGHTS.get(client, 1.0)
+
+
+def run_admitted(job, pages, fn, payload):
+    """(V26.23) 工作线程入口：运行 fn(job, payload)，结束后归还准入的页数额度"""
+    try:
+        return fn(job, payload)
     finally:
-        # 6. (关键!) 无论成功还是失败，【手动删除】临时文件
-        if os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-                print(f"--- 临时文件 {tmp_path} 已成功删除 ---")
-            except Exception as e:
-                print(f"【警告】: 无法删除临时文件 {tmp_path}: {e}")
-    # --- (V25.2 修复结束) ---
+        ADMISSION.release(pages)
+
+
+def submit_admitted(name, fn, payload, pages):
+    """
+    (V26.23) 按页数通过准入控制后提交任务。
+    系统饱和时抛出 AdmissionRejectedError，队列已满时抛出 QueueFullError (两种情况都由调用方清理上传)
+    """
+    client, weight = client_identity()
+    ADMISSION.admit(pages)
+    try:
+        job = JOBS.submit(name, run_admitted, pages, fn, payload, client=client, weight=weight)
+    except QueueFullError:
+        ADMISSION.release(pages, processed=False)
+        raise
+    if pages:
+        print(f"--- (准入) {name}: {pages} 页，客户端 {client} (权重 {weight}) ---")
+    return job
+
+
+def get_upload():
+    """返回 (上传文件, None)；请求不合法时返回 (None, 错误响应)"""
+    if request.content_length and request.content_length > UPLOAD_MAX_BYTES:
+        return None, upload_too_large_response()  # (V26.22) 在解析请求体之前拒绝
+    if 'file' not in request.files:
+        print("【请求错误】: 'file' 字段未在请求中找到。")
+        return None, (jsonify({"error": "请求中未包含 'file'。"}), 400)
+
+    file = request.files['file']
+    if file.filename == '':
+        return None, (jsonify({"error": "未选择文件。"}), 400)
+    return file, None
+
+
+def submit_upload(file):
+    """
+    接收上传内容并提交任务；队列已满 (QueueFullError) 或系统饱和 (AdmissionRejectedError) 时删除临时文件
+    (V26.24) 返回 (任务, 是否合并)：相同内容的任务还在进行中时不再提交，直接返回那个任务
+    """
+    upload = receive_upload(file.stream, file.filename, UPLOAD_MEMORY_MAX_BYTES, UPLOAD_MAX_BYTES)
+
+    # (V26.16) 命中结果缓存：在请求线程中直接完成，不经过合并、准入控制和任务队列 (毫秒级返回，不会收到 429/503)
+    cached = cached_extraction(upload)
+    if cached is not None:
+        upload.close()
+        client, weight = client_identity()
+        return JOBS.run_now(file.filename, publish_cached, *cached, client=client, weight=weight), False
+
+    # (页数在 join 之外计算：join 持有全局锁，锁内只做查找与提交)
+    pages = upload.page_count()
+    try:
+        job, coalesced = SINGLE_FLIGHT.join(
+            result_cache_key(upload.digest),
+            lambda: submit_admitted(file.filename, extract_upload, upload, pages))
+    except (QueueFullError, AdmissionRejectedError):
+        upload.close()
+        raise
+    if coalesced:
+        print(f"--- (合并) {file.filename} 与进行中的任务 {job.id} ({job.name}) 内容相同，等待其结果 ---")
+        upload.close()
+    return job, coalesced
+
+
+def upload_too_large_response(e=None):
+    max_bytes = e.max_bytes if isinstance(e, UploadTooLargeError) else request.max_content_length
+    message = f"上传文件超过上限 {max_bytes // (1024 * 1024)} MB。"
+    print(f"【请求错误】: {message}")
+    return jsonify({"error": message}), 413
+
+
+# (V26.20) 请求体超限触发的 413 也返回 JSON，与其他错误格式一致
+# (单个文件超限时 UploadBuffer 在 Werkzeug 解析请求体的过程中抛出 UploadTooLargeError)
+app.register_error_handler(413, upload_too_large_response)
+app.register_error_handler(UploadTooLargeError, upload_too_large_response)
+
+
+def queue_full_response(e):
+    print(f"【服务器繁忙】: {e}")
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(JOB_QUEUE_RETRY_AFTER)}
+
+
+def admission_rejected_response(e):
+    """(V26.23) 429 + 预计等待时间 (Retry-After 响应头与 JSON 中的 retry_after 相同)"""
+    print(f"【服务器繁忙】: {e}")
+    return jsonify({"error": str(e), "retry_after": e.retry_after}), 429, {"Retry-After": str(e.retry_after)}
+
+
+# (V26.21 新增) 流式响应：每个批次一完成就发送一条记录，最后一条为 done 或 error
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",  # (每行一个 JSON 对象)
+    "sse": "text/event-stream",  # (Server-Sent Events，浏览器可直接用 EventSource 接收)
+}
+
+
+def final_record(job):
+    """任务结束后的最后一条记录 (V26.22: 批量任务附带汇总)"""
+    if job.status == "done" and isinstance(job.result, dict):
+        return {"type": "done", "count": len(job.result["documents"]), "summary": job.result["summary"]}
+    if job.status == "done":
+        return {"type": "done", "count": len(job.result), "cache": job.headers.get("X-Cache")}
+    record = {"type": "error", "error": job.error}
+    retry_after = getattr(job.exception, "retry_after", None)
+    if retry_after:
+        record["retry_after"] = retry_after
+    return record
+
+
+def stream_job(job, stream_format, start=0):
+    """把任务发布的记录按 stream_format 编码后逐条发送；start 用于断线重连时跳过已收到的记录"""
+    def encode(record):
+        if record is None:  # (保活：NDJSON 发空行，SSE 发注释行)
+            return "\n" if stream_format == "ndjson" else ": keepalive\n\n"
+        line = json.dumps(record, ensure_ascii=False)
+        return f"{line}\n" if stream_format == "ndjson" else f"event: {record['type']}\ndata: {line}\n\n"
+
+    def generate():
+        for record in job.follow(start, heartbeat=STREAM_HEARTBEAT_SECONDS):
+            yield encode(record)
+        yield encode(final_record(job))
+
+    return Response(generate(), mimetype=STREAM_FORMATS[stream_format],
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Job-Id": job.id})
+
+
+def get_stream_format():
+    """返回 (格式, None)；未请求流式时格式为 None；格式不支持时返回 (None, 错误响应)"""
+    stream_format = request.args.get("stream")
+    if stream_format and stream_format not in STREAM_FORMATS:
+        return None, (jsonify({"error": f"不支持的 stream 格式: {stream_format} (可选 ndjson / sse)"}), 400)
+    return stream_format, None
+
+
+@app.route("/extract", methods=["POST"])
+def handle_extraction():
+    """
+    同步端点：上传后等待提取完成再返回结果列表。
+    (V26.18) 只是薄包装——提交任务并等待；长扫描件请使用 POST /jobs + GET /jobs/<id>。
+    (V26.21) ?stream=ndjson 或 ?stream=sse 时改为流式返回，每个批次完成后立即发送
+    """
+    print("\n" + "=" * 50)
+    print(f"--- 收到新的 /extract 请求 ---")
+
+    stream_format, error_response = get_stream_format()
+    if error_response:
+        return error_response
+    file, error_response = get_upload()
+    if error_response:
+        return error_response
+
+    try:
+        job, coalesced = submit_upload(file)
+    except QueueFullError as e:
+        return queue_full_response(e)
+    except AdmissionRejectedError as e:
+        return admission_rejected_response(e)
+    except UploadTooLargeError as e:
+        return upload_too_large_response(e)
+    except Exception as e:
+        print(f"【服务器处理错误】: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    if stream_format:
+        return stream_job(job, stream_format)
+
+    job.wait()
+    if job.status == "done":
+        headers = dict(job.headers, **{"X-Coalesced": "1"}) if coalesced else job.headers  # (V26.24)
+        return jsonify(job.result), 200, headers
+
+    if isinstance(job.exception, CircuitOpenError):
+        # (V26.5) 熔断期间快速失败，明确告诉客户端稍后再试
+        retry_after = str(int(job.exception.retry_after or BREAKER_RESET_TIMEOUT))
+        return jsonify({"error": job.error}), 503, {"Retry-After": retry_after}
+    return jsonify({"error": job.error}), 500
+
+
+# (V26.18 新增) 异步任务 API：提交后立即返回任务 ID，客户端轮询状态、进度和结果
+@app.route("/jobs", methods=["POST"])
+def handle_submit_job():
+    print("\n" + "=" * 50)
+    print(f"--- 收到新的 /jobs 请求 ---")
+
+    file, error_response = get_upload()
+    if error_response:
+        return error_response
+
+    try:
+        job, coalesced = submit_upload(file)
+    except QueueFullError as e:
+        return queue_full_response(e)
+    except AdmissionRejectedError as e:
+        return admission_rejected_response(e)
+    except UploadTooLargeError as e:
+        return upload_too_large_response(e)
+    except Exception as e:
+        print(f"【服务器处理错误】: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    if not coalesced:
+        print(f"--- (任务) {job.id} 已排队: {job.name} ---")
+    status_url = f"/jobs/{job.id}"
+    return jsonify({"id": job.id, "status": job.status, "url": status_url, "coalesced": coalesced}), 202, \
+        {"Location": status_url}
+
+
+# (V26.22 新增) 批量提取：多个 file 字段 (multipart) 或一个 zip；返回任务 ID，进度/结果与 /jobs 相同
+@app.route("/batches", methods=["POST"])
+def handle_submit_batch():
+    print("\n" + "=" * 50)
+    print(f"--- 收到新的 /batches 请求 ---")
+
+    files = [file for file in request.files.getlist("file") if file.filename]
+    if not files:
+        return jsonify({"error": "请求中未包含 'file'。"}), 400
+
+    uploads = []
+    try:
+        if len(files) == 1 and files[0].filename.lower().endswith(".zip"):
+            uploads = receive_zip_uploads(files[0].stream, BATCH_MEMORY_MAX_BYTES, UPLOAD_MAX_BYTES,
+                                          BATCH_MAX_DOCUMENTS)
+        elif len(files) > BATCH_MAX_DOCUMENTS:
+            raise BatchTooLargeError(f"共 {len(files)} 个文件，超过上限 {BATCH_MAX_DOCUMENTS} 个")
+        else:
+            for file in files:
+                uploads.append(receive_upload(file.stream, file.filename, BATCH_MEMORY_MAX_BYTES, UPLOAD_MAX_BYTES))
+        if not uploads:
+            raise BatchTooLargeError("没有找到 PDF 文件。")
+        # (V26.23) 批量任务不整体计入准入额度：提交时只检查第一份能否进入，之后 run_batch 逐份计入、逐份归还
+        ADMISSION.check(uploads[0].page_count())
+        job = submit_admitted(f"批量 {len(uploads)} 份", run_batch, uploads, 0)
+    except Exception as e:
+        # (未交给任务的上传由这里清理；交给任务后由 run_batch 逐份清理)
+        for upload in uploads:
+            upload.close()
+        if isinstance(e, QueueFullError):
+            return queue_full_response(e)
+        if isinstance(e, AdmissionRejectedError):
+            return admission_rejected_response(e)
+        print(f"【请求错误】: {e}")
+        if isinstance(e, (BatchTooLargeError, zipfile.BadZipFile)):
+            return jsonify({"error": str(e)}), 400
+        if isinstance(e, UploadTooLargeError):
+            return jsonify({"error": str(e)}), 413
+        return jsonify({"error": str(e)}), 500
+
+    print(f"--- (任务) {job.id} 已排队: {job.name} ---")
+    status_url = f"/jobs/{job.id}"
+    return jsonify({"id": job.id, "status": job.status, "documents": len(uploads), "url": status_url}), 202, \
+        {"Location": status_url}
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def handle_job_status(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": f"任务 {job_id} 不存在或已过期。"}), 404
+    return jsonify(job.snapshot())
+
+
+# (V26.21 新增) 任务结果的流式接收；?after=N 跳过已收到的前 N 条记录 (断线重连)
+@app.route("/jobs/<job_id>/stream", methods=["GET"])
+def handle_job_stream(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": f"任务 {job_id} 不存在或已过期。"}), 404
+    stream_format = request.args.get("format", "ndjson")
+    if stream_format not in STREAM_FORMATS:
+        return jsonify({"error": f"不支持的格式: {stream_format} (可选 ndjson / sse)"}), 400
+    return stream_job(job, stream_format, start=request.args.get("after", 0, type=int))
+
+
+# (V26.11 新增) 运行统计：Prompt 版本、Prompt 体积与上游缓存命中 (V26.16: 结果缓存命中; V26.18: 任务数)
+@app.route("/stats", methods=["GET"])
+def handle_stats():
+    stats = stats_snapshot()
+    stats["jobs"] = JOBS.snapshot()
+    stats["upstream_scheduler"] = UPSTREAM_SCHEDULER.snapshot()
+    stats["admission"] = ADMISSION.snapshot()  # (V26.23)
+    return jsonify(stats)
+
+
+def stats_snapshot():
+    """(V26.19) Flask 与 ASGI 两种服务模式共用的统计项"""
+    return {
+        "prompt_version": PROMPT_VERSION,
+        "text": TEXT_PROMPT_STATS.snapshot(),
+        "vlm": VLM_PROMPT_STATS.snapshot(),
+        "result_cache": RESULT_CACHE.snapshot(),
+        "vlm_chunk_cache": VLM_CHUNK_CACHE.snapshot(),
+        "single_flight": SINGLE_FLIGHT.snapshot(),  # (V26.24) 合并到进行中计算的请求数
+    }
 
 
 # --- 10. (新) 启动服务器 ---
 if __name__ == "__main__":
     print("--- 法律文书提取【后端服务器 V25】 ---")
     print(f"--- 正在加载 Qwen (Text: {QWEN_MODEL_NAME_TEXT}, VLM: {QWEN_MODEL_NAME_VISION}) ---")
+    print(f"--- Prompt 版本: {PROMPT_VERSION} ---")
     print(f"--- API Key: {API_KEY[:5]}...{API_KEY[-4:]} (已加载) ---")
     print("\n【警告】: 这是一个开发服务器。请勿在生产环境中使用。")
     # 监听 0.0.0.0 (所有内网 IP) 的 5000 端口
@@ -0,0 +1,48 @@
+"""
+(V26.24 新增) 相同内容的进行中请求合并 (single-flight)
+
+两位同事几秒内先后上传同一份 PDF 时，结果缓存还没有写入，以前会跑两遍完整流程、付两次模型调用费用。
+现在按内容键 (与结果缓存相同：SHA-256 + 模型 + Prompt 版本) 登记进行中的计算：
+计算结束前到达的相同请求直接挂到这次计算上，等待并取得同一份结果，自己不调用上游。
+计算结束后的相同请求走结果缓存 (失败的计算不写缓存，之后的请求会重新计算)。
+server.py 登记 Job，async_server.py 登记 asyncio.Task；本模块不关心登记的是什么。
+"""
+import threading
+
+
+class SingleFlight:
+    """(线程安全) 用法: flight, coalesced = join(key, start)；计算结束时 (由发起者) 调用 done(key, flight)"""
+
+    def __init__(self):
+        self.flights = {}  # (key -> 进行中的计算)
+        self.started = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def join(self, key, start):
+        """
+        key 有进行中的计算时返回 (该计算, True)；否则调用 start() 开始新的计算并登记，返回 (新计算, False)。
+        start() 在锁内调用 (保证相同 key 只开始一次)，应当只提交任务、不做耗时工作；它抛出的异常原样传给调用方。
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, True
+            flight = start()
+            self.flights[key] = flight
+            self.started += 1
+            return flight, False
+
+    def done(self, key, flight):
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "in_flight": len(self.flights),
+                "started": self.started,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,79 @@
+"""page_filter 打分：用 PyMuPDF 合成的页面检查扫描件常见的黑边、灰底不会被误判"""
+import os
+import sys
+
+import fitz  # PyMuPDF
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from page_filter import score_page  # noqa: E402
+
+A4 = fitz.paper_rect("a4")
+BAND_HEIGHT = 5 * 72 / 25.4  # (5 mm 的扫描仪黑边)
+
+
+def text_page(doc, background=None, top_bottom_bands=False, side_bands=False):
+    """整页密排正文；可选灰色/泛黄底色与贴边黑带"""
+    page = doc.new_page(width=A4.width, height=A4.height)
+    if background is not None:
+        page.draw_rect(page.rect, color=None, fill=background)
+    line = "本院认为，原告诉讼请求有事实和法律依据，本院予以支持。依照相关规定，判决如下。"
+    for y in range(60, int(A4.height) - 50, 16):
+        page.insert_text((50, y), line, fontname="china-s", fontsize=11)
+    if top_bottom_bands:
+        page.draw_rect(fitz.Rect(0, 0, A4.width, BAND_HEIGHT), color=None, fill=(0, 0, 0))
+        page.draw_rect(fitz.Rect(0, A4.height - BAND_HEIGHT, A4.width, A4.height), color=None, fill=(0, 0, 0))
+    if side_bands:
+        page.draw_rect(fitz.Rect(0, 0, BAND_HEIGHT, A4.height), color=None, fill=(0, 0, 0))
+        page.draw_rect(fitz.Rect(A4.width - BAND_HEIGHT, 0, A4.width, A4.height), color=None, fill=(0, 0, 0))
+    return page
+
+
+@pytest.fixture
+def doc():
+    document = fitz.open()
+    yield document
+    document.close()
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"top_bottom_bands": True},
+    {"side_bands": True},
+    {"top_bottom_bands": True, "side_bands": True},
+    {"background": (0.73, 0.73, 0.73)},  # (灰度约 185)
+    {"background": (0.78, 0.76, 0.62)},  # (泛黄纸张，灰度约 190)
+    {"background": (0.75, 0.75, 0.75), "top_bottom_bands": True},
+], ids=["plain", "top-bottom-bands", "side-bands", "all-bands", "grey", "yellowed", "grey-bands"])
+def test_text_scans_are_kept(doc, options):
+    score, reason, stats = score_page(text_page(doc, **options))
+    assert reason == "正文页", stats
+    assert score == 1.0
+
+
+def test_table_page_is_skipped(doc):
+    page = doc.new_page(width=A4.width, height=A4.height)
+    for y in range(60, int(A4.height) - 50, 20):
+        page.draw_line((40, y), (A4.width - 40, y), color=(0, 0, 0), width=1.5)
+        page.insert_text((50, y + 14), "证据 1  借款合同  原件  证明借款事实", fontname="china-s", fontsize=10)
+    _, reason, stats = score_page(page)
+    assert reason.startswith("表格页"), stats
+
+
+def test_photo_page_is_skipped(doc):
+    rng = np.random.default_rng(0)
+    height, width = 400, 300
+    gradient = np.linspace(30, 230, width)[None, :] + rng.normal(0, 40, (height, width))
+    samples = np.clip(gradient, 0, 255).astype(np.uint8)
+    pixmap = fitz.Pixmap(fitz.csGRAY, width, height, samples.tobytes(), False)
+    page = doc.new_page(width=A4.width, height=A4.height)
+    page.insert_image(page.rect, pixmap=pixmap)
+    _, reason, stats = score_page(page)
+    assert reason.startswith("照片"), stats
+
+
+def test_blank_page_is_skipped(doc):
+    _, reason, _ = score_page(doc.new_page(width=A4.width, height=A4.height))
+    assert reason == "空白页"
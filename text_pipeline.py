@@ -0,0 +1,241 @@
+"""
+(V26.9 新增) 长文书文本路径：按 token 预算分段 + 并行提取 + 合并
+
+server.py 与 court_documents_extraction_withQWEN.py 共用此模块。
+短文书仍走单次调用；超过阈值的长文书 (例如二审判决) 在章节边界
+(诉讼请求、事实和理由、本院认为、判决如下 …) 处切成若干段，
+各段并行调用文本模型，再按字段合并为同一个 JSON 结构。
+(V26.10) 构建 Prompt 前先压缩文本：去掉页眉/页脚/页码，拼回句中硬换行，合并空白。
+"""
+import re
+
+# --- 1. 常量 ---
+LONG_DOC_TOKEN_THRESHOLD = 24000  # (估算 token 数超过此值才分段)
+SEGMENT_TOKEN_BUDGET = 8000  # (每段的估算 token 上限)
+
+# (章节标题：在这些行之前切分)
+SECTION_PATTERN = re.compile(
+    r"^\s*(诉讼请求|事实和理由|事实与理由|上诉请求|.{0,40}(诉称|辩称)|经审理查明|本院查明|本院认为|"
+    r"判决如下|裁定如下|如不服本判决|如不服本裁定)"
+)
+
+# (长文本字段：各段的结果按顺序拼接；其余字段取第一个非空值)
+LONG_TEXT_FIELDS = ("claims", "facts_and_reasons", "judgment_main")
+
+_SENTENCE_PATTERN = re.compile(r"[^。；\n]+[。；\n]?|\n")
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+
+# --- 2. token 估算 ---
+def estimate_tokens(text):
+    """粗略估算：中文字符约 1 token/字，其余字符约 4 字符/token"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk) // 4
+
+
+def is_long_document(text, threshold=LONG_DOC_TOKEN_THRESHOLD):
+    return estimate_tokens(text) > threshold
+
+
+# --- 3. 按章节边界分段 ---
+def _split_sections(text):
+    """在章节标题行之前切开，返回章节文本列表 (保持原文顺序，不丢字)"""
+    sections, current = [], []
+    for line in text.splitlines(keepends=True):
+        if current and SECTION_PATTERN.match(line):
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+
+def _split_oversized(section, budget):
+    """单个章节超出预算时，退而在行/句子边界 (换行、句号) 处切开"""
+    pieces, current, current_tokens = [], [], 0
+    for sentence in _SENTENCE_PATTERN.findall(section):
+        sentence_tokens = estimate_tokens(sentence)
+        if current and current_tokens + sentence_tokens > budget:
+            pieces.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += sentence_tokens
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+
+def split_into_segments(text, budget=SEGMENT_TOKEN_BUDGET):
+    """
+    把全文切成若干段，每段估算 token 数不超过 budget (单行超长时除外)。
+    优先在章节边界处切，相邻的小章节合并到同一段。
+    """
+    segments, current, current_tokens = [], [], 0
+    for section in _split_sections(text):
+        section_tokens = estimate_tokens(section)
+        pieces = [section] if section_tokens <= budget else _split_oversized(section, budget)
+        for piece in pieces:
+            piece_tokens = estimate_tokens(piece)
+            if current and current_tokens + piece_tokens > budget:
+                segments.append("".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        segments.append("".join(current))
+    return segments
+
+
+def segment_prompt(segment, index, total):
+    """分段调用时的用户消息 (提醒模型这只是全文的一部分，找不到的字段设为 null)"""
+    return (f"法律文书原文(从PDF提取的纯文本，长文书第 {index + 1}/{total} 段；"
+            f"本段中找不到的字段请设为 null):\n{segment}")
+
+
+# --- 4. 合并各段结果 ---
+def merge_extractions(results):
+    """
+    按段顺序合并各段的 JSON：
+    - 嵌套对象逐键递归合并
+    - 长文本字段 (LONG_TEXT_FIELDS) 把各段的非空值按顺序拼接 (去重)
+    - 其余字段取第一个非空值 (案号、法院在前面的段，上诉期在后面的段)
+    """
+    results = [r for r in results if isinstance(r, dict)]
+    if not results:
+        return None
+    merged = {}
+    for result in results:
+        for key, value in result.items():
+            merged[key] = _merge_value(key, merged.get(key), value)
+    return merged
+
+
+def _merge_value(key, current, value):
+    if value is None or value == "":
+        return current
+    if current is None:
+        return value
+    if isinstance(current, dict) and isinstance(value, dict):
+        combined = dict(current)
+        for sub_key, sub_value in value.items():
+            combined[sub_key] = _merge_value(sub_key, combined.get(sub_key), sub_value)
+        return combined
+    if key in LONG_TEXT_FIELDS and isinstance(current, str) and isinstance(value, str):
+        if value in current:
+            return current
+        return f"{current}\n{value}"
+    return current
+
+
+# --- 5. (V26.10 新增) 文本压缩预处理 ---
+EDGE_LINES = 3  # (每页只在首尾各 3 行中寻找并删除页眉/页脚/页码)
+REPEATED_LINE_MIN_PAGES = 3  # (至少在这么多页重复出现，才视为页眉/页脚)
+REPEATED_LINE_PAGE_RATIO = 0.5  # (且出现在至少一半的页上)
+WRAP_WIDTH_PERCENTILE = 0.8  # (取行长的第 80 百分位作为正文行宽)
+WRAP_MIN_FILL = 0.85  # (行长达到正文行宽的 85% 才视为"排满后折行")
+
+_PAGE_NUMBER_PATTERN = re.compile(
+    r"^\s*(第\s*\d+\s*页(\s*[/，,]?\s*共\s*\d+\s*页)?|[-—]?\s*\d+\s*[-—]?|\d+\s*/\s*\d+)\s*$"
+)
+# (以这些字符结尾的行是完整的句子/标题，不与下一行拼接)
+_LINE_END_CHARS = "。；：！？」』）)"
+# (以这些开头的行是新的条目/段落，不拼接到上一行)
+_ITEM_START_PATTERN = re.compile(r"^\s*([一二三四五六七八九十]+、|（[一二三四五六七八九十]+）|\(?\d+[.、)）])")
+_SPACE_RUN_PATTERN = re.compile(r"[ \t　\xa0]+")
+
+
+def _find_repeated_lines(page_lines):
+    """统计出现在多页首尾的相同行 (页眉/页脚)"""
+    if len(page_lines) < REPEATED_LINE_MIN_PAGES:
+        return set()
+    page_counts = {}
+    for lines in page_lines:
+        edge = {line for line in lines[:EDGE_LINES] + lines[-EDGE_LINES:] if line}
+        for line in edge:
+            page_counts[line] = page_counts.get(line, 0) + 1
+    min_pages = max(REPEATED_LINE_MIN_PAGES, int(len(page_lines) * REPEATED_LINE_PAGE_RATIO))
+    return {line for line, count in page_counts.items() if count >= min_pages}
+
+
+def _rejoin_wrapped_lines(lines):
+    """
+    把 PDF 排版造成的句中硬换行拼回去：只有排满整行 (接近正文行宽) 且未以标点结尾的行，
+    才与下一行拼接；空行、标题、编号条目和短行 (案号、落款等) 保持独立。
+    """
+    lengths = sorted(len(line) for line in lines if line)
+    if not lengths:
+        return []
+    full_width = lengths[int(len(lengths) * WRAP_WIDTH_PERCENTILE)] * WRAP_MIN_FILL
+
+    paragraphs = []
+    previous_line = ""
+    for line in lines:
+        if not line:
+            if paragraphs and paragraphs[-1]:
+                paragraphs.append("")
+            previous_line = ""
+            continue
+        if (previous_line and len(previous_line) >= full_width and previous_line[-1] not in _LINE_END_CHARS
+                and not SECTION_PATTERN.match(line) and not _ITEM_START_PATTERN.match(line)):
+            separator = " " if previous_line[-1].isascii() and line[0].isascii() else ""
+            paragraphs[-1] += separator + line
+        else:
+            paragraphs.append(line)
+        previous_line = line
+    return paragraphs
+
+
+def compact_page_texts(page_texts):
+    """
+    压缩逐页文本，返回 (压缩后的全文, 统计信息)。
+    - 去掉重复的页眉/页脚 (保留第一次出现，案号页眉因此不会丢失) 和页码行；
+      只看每页首尾 EDGE_LINES 行，正文中单独成行的金额、年份等不会被误删
+    - 拼回句中的硬换行，合并连续空白
+    不改动句子内部的任何字符，长文本字段仍可逐字提取 (完整性铁则)。
+    """
+    raw_text = "\n".join(page_texts)
+    page_lines = [[_SPACE_RUN_PATTERN.sub(" ", line).strip() for line in text.splitlines()] for text in page_texts]
+    repeated = _find_repeated_lines(page_lines)
+
+    seen_repeated = set()
+    kept_lines = []
+    removed_lines = 0
+    for lines in page_lines:
+        edge = EDGE_LINES if len(lines) > EDGE_LINES * 2 else 1  # (很短的页只看首尾各一行，首尾区域不与正文重叠)
+        for index, line in enumerate(lines):
+            at_edge = index < edge or index >= len(lines) - edge
+            if at_edge and line in repeated:
+                if line in seen_repeated:
+                    removed_lines += 1
+                    continue
+                seen_repeated.add(line)
+            elif at_edge and _PAGE_NUMBER_PATTERN.match(line):
+                removed_lines += 1
+                continue
+            kept_lines.append(line)  # (不在页与页之间断段：跨页的句子同样会被拼回)
+
+    text = "\n".join(_rejoin_wrapped_lines(kept_lines)).strip()
+    tokens_before, tokens_after = estimate_tokens(raw_text), estimate_tokens(text)
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+        "removed_lines": removed_lines,
+        "repeated_lines": len(repeated),
+    }
+    return text, stats
+
+
+def format_compaction_stats(stats):
+    ratio = stats["tokens_saved"] / stats["tokens_before"] * 100 if stats["tokens_before"] else 0
+    return (f"--- (压缩) 文本约 {stats['tokens_before']} -> {stats['tokens_after']} token，"
+            f"节省 {stats['tokens_saved']} ({ratio:.0f}%)；去掉页眉/页脚/页码 {stats['removed_lines']} 行 ---")
+
+
+def join_page_texts(text_pages, compact=True):
+    """把 {页码: 文本} 按页码顺序拼成全文；compact 为 True 时先做压缩预处理。返回 (全文, 统计信息或 None)"""
+    page_texts = [text_pages[i] for i in sorted(text_pages)]
+    if not compact:
+        return "\n".join(page_texts), None
+    return compact_page_texts(page_texts)
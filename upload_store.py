@@ -0,0 +1,228 @@
+"""
+(V26.20 新增) 上传文件接收：小文件留在内存，大文件落盘，超限立即拒绝
+
+V25.2 起每个上传都先写入 NamedTemporaryFile，再由 PyMuPDF 反复按路径打开，最后删除——每个请求一次完整的磁盘往返。
+现在分块读取上传流：
+- 不超过 memory_max_bytes 时只保留在内存中，由 DocumentSession 以 stream 模式打开
+- 超过后把已读部分和剩余部分写入临时文件 (仍按 V25.2 的方式：关闭句柄后再交给 PyMuPDF)
+- 累计超过 max_bytes 时立即停止读取，抛出 UploadTooLargeError
+读取的同时计算 SHA-256，结果缓存不必再读一遍内容。
+(V26.22) 批量提取：从 zip 压缩包中逐个接收 PDF
+(V26.23) 准入控制按页计量：Upload.page_count() 只读页数，不解析页面内容
+Flask 服务器中 Werkzeug 解析 multipart 时直接写入 UploadBuffer (边写边算哈希、检查大小、超过阈值落盘)，
+receive_upload 直接接管这个缓冲区，不再把已经收下的内容复制第二遍；
+其他来源 (zip 成员、ASGI 上传) 仍按上面的方式分块读取。
+"""
+import hashlib
+import io
+import os
+import tempfile
+import zipfile
+
+from pdf_session import DocumentSession, open_document
+
+READ_BLOCK_SIZE = 256 * 1024
+
+
+class BatchTooLargeError(Exception):
+    """批量上传的 PDF 数超过上限 (或一个 PDF 也没有)"""
+
+
+class UploadTooLargeError(Exception):
+    """上传内容超过大小上限"""
+
+    def __init__(self, message, max_bytes):
+        super().__init__(message)
+        self.max_bytes = max_bytes
+
+
+class Upload:
+    """一次上传的内容：data (内存) 与 path (落盘) 二者之一；用完后调用 close() 删除落盘文件"""
+
+    def __init__(self, name, digest, size, data=None, path=None):
+        self.name = name
+        self.digest = digest
+        self.size = size
+        self.data = data
+        self.path = path
+
+    @property
+    def in_memory(self):
+        return self.data is not None
+
+    def open_session(self):
+        return DocumentSession(self.data if self.in_memory else self.path, name=self.name, digest=self.digest)
+
+    def page_count(self):
+        """(V26.23) 页数；无法打开的 PDF 按 1 页计 (错误留给提取流程报告)"""
+        try:
+            with open_document(self.data if self.in_memory else self.path) as doc:
+                return max(doc.page_count, 1)
+        except Exception:
+            return 1
+
+    def close(self):
+        """删除落盘的临时文件 (内存上传只释放引用)"""
+        self.data = None
+        if self.path and os.path.exists(self.path):
+            try:
+                os.unlink(self.path)
+                print(f"--- 临时文件 {self.path} 已成功删除 ---")
+            except Exception as e:
+                print(f"【警告】: 无法删除临时文件 {self.path}: {e}")
+
+
+class UploadBuffer:
+    """
+    可写的上传缓冲区 (Werkzeug 的 stream_factory 返回值)：写入时计算 SHA-256，
+    累计超过 max_bytes 时立即抛出 UploadTooLargeError (分块传输没有 Content-Length 也能及时拒绝)，
+    超过 memory_max_bytes 时把已写入的部分转存到临时文件，之后直接写文件。
+    超限抛出异常前、以及被 receive_upload 接管之前关闭 (例如请求解析失败或客户端断开) 时删除临时文件。
+    """
+
+    def __init__(self, memory_max_bytes, max_bytes):
+        self.memory_max_bytes = memory_max_bytes
+        self.max_bytes = max_bytes
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.memory = io.BytesIO()
+        self.file = None
+
+    def _target(self):
+        return self.file if self.file is not None else self.memory
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.close()  # (Werkzeug 解析出错时不会关闭已创建的缓冲区，临时文件在这里删除)
+            raise UploadTooLargeError(f"上传文件超过上限 {self.max_bytes // (1024 * 1024)} MB", self.max_bytes)
+        self.digest.update(data)
+        if self.file is None and self.size > self.memory_max_bytes:
+            self.file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+            self.file.write(self.memory.getbuffer())
+            self.memory = None
+        return self._target().write(data)
+
+    def read(self, size=-1):
+        return self._target().read(size)
+
+    def seek(self, offset, whence=0):
+        return self._target().seek(offset, whence)
+
+    def tell(self):
+        return self._target().tell()
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def detach(self, name):
+        """把内容交给一个 Upload (内存中的 bytes 或已关闭的临时文件)，之后 close() 不再删除任何东西"""
+        if self.file is None:
+            data, self.memory = self.memory.getvalue(), None
+            print(f"--- 上传文件 {name} ({self.size / 1024:.0f} KB) 保留在内存中 ---")
+            return Upload(name, self.digest.hexdigest(), self.size, data=data)
+        tmp, self.file = self.file, None
+        # (关键!) 立即关闭文件句柄，【释放文件锁】(V25.2)
+        tmp.close()
+        print(f"--- 上传文件 {name} ({self.size / 1024 / 1024:.1f} MB) 超过内存阈值，已临时保存到: {tmp.name} ---")
+        return Upload(name, self.digest.hexdigest(), self.size, path=tmp.name)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            os.unlink(self.file.name)
+            self.file = None
+        self.memory = None
+
+    @property
+    def closed(self):
+        return self.file is None and self.memory is None
+
+
+def receive_upload(stream, name, memory_max_bytes, max_bytes):
+    """
+    从可读的二进制流分块读取上传内容，返回 Upload；超过 max_bytes 时抛出 UploadTooLargeError
+    stream 是 UploadBuffer 时 (写入时已算好哈希) 直接接管，不再复制；
+    缓冲区的上限可能比 max_bytes 宽 (批量请求按整个 zip 计)，这里再按单个文件的上限检查一次
+    """
+    if isinstance(stream, UploadBuffer):
+        if stream.size > max_bytes:
+            stream.close()
+            raise UploadTooLargeError(f"{name} 超过上限 {max_bytes // (1024 * 1024)} MB", max_bytes)
+        return stream.detach(name)
+
+    digest = hashlib.sha256()
+    blocks = []
+    size = 0
+    tmp = None
+    try:
+        for block in iter(lambda: stream.read(READ_BLOCK_SIZE), b""):
+            size += len(block)
+            if size > max_bytes:
+                raise UploadTooLargeError(f"上传文件超过上限 {max_bytes // (1024 * 1024)} MB", max_bytes)
+            digest.update(block)
+            if tmp is None and size > memory_max_bytes:
+                # (超过内存阈值：改为落盘，先写入已读的部分)
+                tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+                tmp.writelines(blocks)
+                blocks = []
+            if tmp is None:
+                blocks.append(block)
+            else:
+                tmp.write(block)
+    except BaseException:
+        if tmp is not None:
+            tmp.close()
+            os.unlink(tmp.name)
+        raise
+
+    if tmp is None:
+        print(f"--- 上传文件 {name} ({size / 1024:.0f} KB) 保留在内存中 ---")
+        return Upload(name, digest.hexdigest(), size, data=b"".join(blocks))
+
+    # (关键!) 立即关闭文件句柄，【释放文件锁】(V25.2)
+    tmp.close()
+    print(f"--- 上传文件 {name} ({size / 1024 / 1024:.1f} MB) 超过内存阈值，已临时保存到: {tmp.name} ---")
+    return Upload(name, digest.hexdigest(), size, path=tmp.name)
+
+
+def zip_member_name(info):
+    """没有 UTF-8 标记的文件名按 GBK 解码 (Windows 资源管理器压缩的中文文件名)"""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("gbk")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def receive_zip_uploads(stream, memory_max_bytes, max_bytes, max_files):
+    """
+    接收 zip 中的所有 PDF (忽略目录、非 PDF 文件和 macOS 的 __MACOSX 元数据)，返回 Upload 列表。
+    单个 PDF 超过 max_bytes 时抛出 UploadTooLargeError；PDF 数超过 max_files 时抛出 BatchTooLargeError。
+    """
+    uploads = []
+    try:
+        with zipfile.ZipFile(stream) as archive:
+            members = [info for info in archive.infolist()
+                       if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+                       and info.filename.lower().endswith(".pdf")]
+            if len(members) > max_files:
+                raise BatchTooLargeError(f"压缩包中有 {len(members)} 个 PDF，超过上限 {max_files} 个")
+            for info in members:
+                name = os.path.basename(zip_member_name(info))
+                if info.file_size > max_bytes:
+                    raise UploadTooLargeError(f"{name} 超过上限 {max_bytes // (1024 * 1024)} MB", max_bytes)
+                with archive.open(info) as member:
+                    uploads.append(receive_upload(member, name, memory_max_bytes, max_bytes))
+    except BaseException:
+        for upload in uploads:
+            upload.close()
+        raise
+    return uploads
@@ -0,0 +1,159 @@
+"""
+(V26.3 新增) VLM 流水线工具
+
+server.py 与 court_documents_extraction_withQWEN.py 共用此模块。
+渲染 (生产者) 在后台线程中运行，VLM 调用 (消费者) 在调用方线程中运行，
+两者通过有界队列衔接：批次 N 在调用 VLM 时，批次 N+1 仍在渲染/编码。
+(V26.4) 消费者一侧可以有界并发地调用 VLM，结果仍按批次顺序交回。
+(V26.6) 批次大小由 AIMD 控制器根据调用耗时和失败情况动态调整。
+后台线程只预取渲染好的页面；分块在分发器空出名额、取下一个批次时才进行，批次大小总是 AIMD 的最新建议。
+"""
+import queue
+import threading
+from collections import deque
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# --- 1. 常量 ---
+PIPELINE_QUEUE_SIZE = 2  # (生产者最多领先消费者 2 个元素，防止内存无限增长)
+
+_ITEM = "item"
+_DONE = "done"
+_ERROR = "error"
+_END = object()  # (dispatch_in_order: items 已取完)
+
+
+# --- 2. 生产者/消费者：后台线程迭代，有界队列交付 ---
+def prefetch(iterable, maxsize=PIPELINE_QUEUE_SIZE):
+    """
+    在后台线程中迭代 iterable，通过有界队列把元素按原顺序交给调用方。
+    生产者中的异常会在调用方线程中重新抛出；调用方提前退出时生产者随之停止。
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(kind, value):
+        while not stop.is_set():
+            try:
+                q.put((kind, value), timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put(_ITEM, item):
+                    return
+            put(_DONE, None)
+        except Exception as e:
+            put(_ERROR, e)
+
+    threading.Thread(target=producer, daemon=True).start()
+    try:
+        while True:
+            kind, value = q.get()
+            if kind == _DONE:
+                return
+            if kind == _ERROR:
+                raise value
+            yield value
+    finally:
+        stop.set()
+
+
+# --- 3. (V26.4 新增) 有界并发分发器 ---
+def dispatch_in_order(items, func, max_in_flight):
+    """
+    最多 max_in_flight 个 func(item) 同时执行，结果【按 items 的原顺序】产出。
+    max_in_flight <= 1 时退化为普通的串行循环。
+    只有空出名额时才从 items 取下一个元素：items 是 iter_adaptive_chunks 时，
+    每个批次都在前面的批次完成 (AIMD 已记录其耗时/失败) 之后才按最新的建议大小切出。
+    """
+    if max_in_flight <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    items = iter(items)
+    pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="vlm-dispatch")
+    pending = deque()
+    exhausted = False
+    try:
+        while True:
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+            running = [future for future in pending if not future.done()]
+            # (窗口略大于并发数：队首批次较慢时，后面的批次也能先跑起来)
+            if not exhausted and len(running) < max_in_flight and len(pending) < max_in_flight * 2:
+                item = next(items, _END)
+                if item is _END:
+                    exhausted = True
+                else:
+                    pending.append(pool.submit(func, item))
+                continue
+            if not pending:
+                return
+            wait(running, return_when=FIRST_COMPLETED)  # (已完成的队首已在上面产出，这里 running 不为空)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# --- 4. (V26.6 新增) AIMD 自适应批次大小 ---
+class AdaptiveChunkSizer:
+    """
+    (线程安全) 加性增、乘性减：
+    批次在 fast_seconds 内成功 -> 批次 +1 页；超时/非 200/重试 -> 批次减半。
+    始终限制在 [min_size, max_size] 之间。
+    """
+
+    def __init__(self, initial, min_size=1, max_size=6, fast_seconds=45.0):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.fast_seconds = fast_seconds
+        self.size = min(max(initial, min_size), max_size)
+        self.used_sizes = []  # (实际发出的每个批次的页数，用于日志)
+        self.lock = threading.Lock()
+
+    def next_size(self):
+        with self.lock:
+            return self.size
+
+    def record_success(self, elapsed):
+        with self.lock:
+            if elapsed <= self.fast_seconds and self.size < self.max_size:
+                self.size += 1
+                print(f"--- (自适应) 批次 {elapsed:.0f} 秒完成，批次大小增至 {self.size} 页 ---")
+
+    def record_failure(self):
+        with self.lock:
+            new_size = max(self.min_size, self.size // 2)
+            if new_size != self.size:
+                print(f"--- (自适应) 调用超时/失败，批次大小从 {self.size} 页减至 {new_size} 页 ---")
+            self.size = new_size
+
+
+def iter_adaptive_chunks(iterable, sizer, plan=None):
+    """
+    按 sizer 当前建议的大小分块。
+    (V26.17) plan 为同一文档上次运行的各批次页数时，先按 plan 切分 (批次边界与上次相同，未变化的批次才能命中批次缓存)，
+    plan 用完后再按 sizer 的建议继续。
+    """
+    iterator = iter(iterable)
+    planned = iter(plan or ())
+    while True:
+        chunk = list(islice(iterator, next(planned, None) or sizer.next_size()))
+        if not chunk:
+            return
+        sizer.used_sizes.append(len(chunk))
+        yield chunk
+
+
+# --- 5. (V26.7 新增) 页码描述 ---
+def describe_pages(page_indices):
+    """[0, 1, 2] -> "第 1 - 3 页"；不连续时 [0, 2, 5] -> "第 1, 3, 6 页" """
+    numbers = [i + 1 for i in page_indices]
+    if numbers == list(range(numbers[0], numbers[-1] + 1)):
+        return f"第 {numbers[0]} - {numbers[-1]} 页" if len(numbers) > 1 else f"第 {numbers[0]} 页"
+    return f"第 {', '.join(map(str, numbers))} 页"